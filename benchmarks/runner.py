@@ -0,0 +1,231 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+
+#
+# Copyright (c) Facebook, Inc. and its affiliates.
+#
+# This source code is licensed under the MIT license found in the
+# LICENSE file in the root directory of this source tree.
+#
+
+import argparse
+import json
+import logging
+import platform
+import statistics
+import timeit
+
+from ..state_service.__version__ import __version__
+from .suite import BENCHMARKS
+from .suite import Environment
+
+
+class Runner(object):
+    """
+    Times benchmarks for every value of the parameter that they vary.
+
+    Each operation is run enough times to take at least 0.2 seconds (as
+    `timeit` does), and this is repeated `repeat` times; the fastest
+    repetition is the least disturbed by the rest of the host, so it is
+    the one that results are compared by.
+    """
+
+    def __init__(self, repeat=5):
+        self._logger = None
+        self.repeat = repeat
+
+    @property
+    def logger(self):
+        if self._logger is None:
+            self._logger = logging.getLogger(self.__class__.__name__)
+
+        return self._logger
+
+    def run(self, names, params):
+        """
+        Args:
+            names (list): The names of the benchmarks to run
+            params (dict): The values of each parameter, e.g.,
+                {'machine_size': [3, 100]}
+
+        Returns:
+            list: One result per benchmark and parameter value
+
+        Raises:
+            - RuntimeError if an operation fails
+        """
+        results = []
+        for name in names:
+            benchmark, param = BENCHMARKS[name]
+            for value in params[param]:
+                sizes = {param: value} if param in Environment.SIZES else {}
+                env = Environment(**sizes)
+                try:
+                    operation = benchmark(env, value)
+                    results.append(self._time(name, param, value, operation))
+                finally:
+                    env.close()
+
+                self.logger.info(f'{results[-1]["id"]}: {results[-1]["min"]}')
+
+        return results
+
+    def _time(self, name, param, value, operation):
+        benchmark_id = f'{name}[{param}={value}]'
+
+        #
+        # A failing request is answered quickly, and would be mistaken for
+        # a fast one.
+        #
+        response = operation()
+        status = getattr(response, 'status_code', 200)
+        if status >= 400:
+            raise RuntimeError(f'{benchmark_id} failed with status {status}')
+
+        timer = timeit.Timer(operation)
+        number, _ = timer.autorange()
+        times = [t / number for t in timer.repeat(self.repeat, number)]
+        return {
+            'id': benchmark_id,
+            'benchmark': name,
+            'params': {param: value},
+            'number': number,
+            'repeat': self.repeat,
+            'min': min(times),
+            'median': statistics.median(times),
+        }
+
+
+def compare(results, baseline, tolerance):
+    """
+    Compares the fastest time of each result to the baseline's result of
+    the same benchmark and parameter, if the baseline has one.
+
+    Args:
+        results (list): Results of `Runner.run`
+        baseline (dict): A document written by `main`
+        tolerance (float): The fraction by which a result may be slower
+            than the baseline
+
+    Returns:
+        list: `(id, baseline, current, ratio)` of each compared result,
+        and the ids of the results that regressed
+    """
+    previous = {result['id']: result for result in baseline['results']}
+    comparisons, regressions = [], []
+    for result in results:
+        base = previous.get(result['id'])
+        if base is None:
+            continue
+
+        ratio = result['min'] / base['min']
+        comparisons.append((result['id'], base['min'], result['min'], ratio))
+        if ratio > 1 + tolerance:
+            regressions.append(result['id'])
+
+    return comparisons, regressions
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(
+        prog='benchmarks',
+        description='Times the request paths and persistence of '
+                    'StateService.',
+    )
+    parser.add_argument('--baseline',
+                        type=str,
+                        required=False,
+                        help='results of a previous run to compare to; '
+                             'exits with 1 if a benchmark regressed',
+                        )
+    parser.add_argument('--batch-sizes',
+                        type=_sizes,
+                        default=[1, 100],
+                        help='entries per POST /state/batch request',
+                        )
+    parser.add_argument('--benchmarks',
+                        type=lambda value: value.split(','),
+                        default=list(BENCHMARKS),
+                        help=f'benchmarks to run, among '
+                             f'{",".join(BENCHMARKS)}',
+                        )
+    parser.add_argument('--machine-sizes',
+                        type=_sizes,
+                        default=[3, 100, 1000],
+                        help='states per state machine',
+                        )
+    parser.add_argument('--model-sizes',
+                        type=_sizes,
+                        default=[1000, 100000],
+                        help='weights per model',
+                        )
+    parser.add_argument('--output',
+                        type=str,
+                        required=False,
+                        help='write results as JSON to this file, e.g., to '
+                             'store a baseline',
+                        )
+    parser.add_argument('--repeat',
+                        type=int,
+                        default=5,
+                        help='repetitions of each benchmark',
+                        )
+    parser.add_argument('--tolerance',
+                        type=float,
+                        default=0.1,
+                        help='fraction by which a benchmark may be slower '
+                             'than the baseline',
+                        )
+    options = parser.parse_args(argv)
+
+    unknown = set(options.benchmarks) - set(BENCHMARKS)
+    if unknown:
+        parser.error(f'unknown benchmarks {",".join(sorted(unknown))}')
+
+    params = {
+        'batch_size': options.batch_sizes,
+        'machine_size': options.machine_sizes,
+        'model_size': options.model_sizes,
+    }
+    results = Runner(options.repeat).run(options.benchmarks, params)
+    document = {
+        'version': __version__,
+        'python': platform.python_version(),
+        'platform': platform.platform(),
+        'results': results,
+    }
+
+    if options.output:
+        with open(options.output, 'w') as f:
+            json.dump(document, f, indent=2)
+            f.write('\n')
+
+    comparisons, regressions = [], []
+    if options.baseline:
+        with open(options.baseline, 'r') as f:
+            baseline = json.load(f)
+
+        comparisons, regressions = compare(
+            results, baseline, options.tolerance)
+
+    _report(results, comparisons, regressions)
+    return 1 if regressions else 0
+
+
+def _report(results, comparisons, regressions):
+    ratios = {comparison[0]: comparison[3] for comparison in comparisons}
+    for result in results:
+        line = (
+            f'{result["id"]:<40} {result["min"] * 1e6:>12.1f} us '
+            f'{result["median"] * 1e6:>12.1f} us'
+        )
+        if result['id'] in ratios:
+            line += f' {ratios[result["id"]]:>7.2f}x'
+            if result['id'] in regressions:
+                line += ' REGRESSED'
+
+        print(line)
+
+
+def _sizes(value):
+    return [int(size) for size in value.split(',')]
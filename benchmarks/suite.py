@@ -0,0 +1,187 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+
+#
+# Copyright (c) Facebook, Inc. and its affiliates.
+#
+# This source code is licensed under the MIT license found in the
+# LICENSE file in the root directory of this source tree.
+#
+
+import argparse
+import json
+import os
+import pickle
+import tempfile
+import yaml
+
+from ..state_service.state_machine import StateMachine
+from ..state_service.state_service import app
+from ..state_service.state_service import state_service
+
+
+class BenchmarkModel(object):
+    """
+    A model whose serialized size is proportional to its number of
+    `weights`, and whose predictions cost little, so that benchmarks
+    measure StateService rather than the model.
+    """
+
+    def __init__(self, size):
+        self.weights = [float(i) for i in range(size)]
+
+    def predict(self, values):
+        if values and isinstance(values[0], (list, tuple)):
+            return [0] * len(values)
+
+        return [0]
+
+
+class Environment(object):
+    """
+    A state machine of `machine_size` states, and a model of `model_size`
+    weights with its configuration, written to a temporary directory.
+
+    Every state but the last is an increment state whose target is never
+    reached, so the state machine can be updated indefinitely and every
+    state is written when it is saved.
+    """
+
+    MODEL_NAME = 'benchmark'
+    SIZES = ('machine_size', 'model_size')
+    TEAM = 'benchmarks'
+
+    def __init__(self, machine_size=3, model_size=1000):
+        self._client = None
+        self._directory = tempfile.TemporaryDirectory()
+        self._machine = None
+        self._saved_options = None
+
+        config = os.path.join(self._directory.name, 'conf')
+        models = os.path.join(self._directory.name, 'models')
+        os.makedirs(config)
+        os.makedirs(os.path.join(models, self.TEAM))
+
+        self.options = argparse.Namespace(
+            config=config,
+            machine=os.path.join(self._directory.name, 'machine.yaml'),
+            models=models,
+        )
+
+        with open(self.options.machine, 'w') as f:
+            yaml.safe_dump(self._machine_data(machine_size), f)
+
+        with open(os.path.join(config, f'{self.MODEL_NAME}.json'), 'w') as f:
+            json.dump({
+                'name': self.MODEL_NAME,
+                'team': self.TEAM,
+                'model': f'{self.MODEL_NAME}.pkl',
+                'states': ['walk', 'run'],
+            }, f)
+
+        model_path = os.path.join(models, self.TEAM, f'{self.MODEL_NAME}.pkl')
+        with open(model_path, 'wb') as f:
+            pickle.dump(BenchmarkModel(model_size), f)
+
+    @property
+    def client(self):
+        """
+        Returns a Flask test client of the StateService application, which
+        serves this environment's state machine and models.
+        """
+        if self._client is None:
+            self._saved_options = state_service._options
+            state_service._options = self.options
+            state_service._machine = None
+            state_service._initialize()
+            app.testing = True
+            self._client = app.test_client()
+
+        return self._client
+
+    @property
+    def machine(self):
+        if self._machine is None:
+            self._machine = StateMachine(self.options)
+            self._machine.build()
+
+        return self._machine
+
+    def close(self):
+        if self._client is not None:
+            state_service.machine.close()
+            state_service._machine = None
+            state_service._options = self._saved_options
+            self._client = None
+
+        if self._machine is not None:
+            self._machine.close()
+            self._machine = None
+
+        self._directory.cleanup()
+
+    def _machine_data(self, machine_size):
+        states = [{
+            'name': f'state_{i}',
+            'func': 'increment',
+            'current': {'key': 'count', 'value': 0},
+            'target': {
+                'name': f'state_{i + 1}',
+                'when': {'key': 'count', 'value': 10 ** 12},
+            },
+        } for i in range(machine_size - 1)]
+        states.append({'name': f'state_{machine_size - 1}'})
+
+        return {'current_state': 'state_0', 'states': states}
+
+
+#
+# Each benchmark takes an Environment and the value of the one parameter
+# that it varies, and returns the operation to time. The other sizes keep
+# the Environment's defaults.
+#
+
+def get_state(env, machine_size):
+    client = env.client
+    return lambda: client.get('/state?state=state_0')
+
+
+def update_state(env, machine_size):
+    client = env.client
+    return lambda: client.put('/state?state=state_0')
+
+
+def create_state(env, model_size):
+    client = env.client
+    data = {'name': Environment.MODEL_NAME, 'values': [1.0, 2.0, 3.0]}
+    return lambda: client.post('/state', json=data)
+
+
+def create_states(env, batch_size):
+    client = env.client
+    data = {'entries': [{
+        'name': Environment.MODEL_NAME,
+        'host_id': f'host_{i}',
+        'values': [1.0, 2.0, 3.0],
+    } for i in range(batch_size)]}
+    return lambda: client.post('/state/batch', json=data)
+
+
+def save(env, machine_size):
+    return env.machine.save
+
+
+def deserialize_model(env, model_size):
+    machine = env.machine
+    return lambda: machine._deserialize_model(
+        Environment.TEAM, f'{Environment.MODEL_NAME}.pkl')
+
+
+BENCHMARKS = {
+    'get_state': (get_state, 'machine_size'),
+    'update_state': (update_state, 'machine_size'),
+    'create_state': (create_state, 'model_size'),
+    'create_states': (create_states, 'batch_size'),
+    'save': (save, 'machine_size'),
+    'deserialize_model': (deserialize_model, 'model_size'),
+}
@@ -18,14 +18,16 @@ DESCRIPTION = 'StateService is a state-machine-as-a-service.'
 URL = 'https://github.com/facebookincubator/StateService'
 EMAIL = 'declanr@fb.com'
 AUTHOR = 'Declan Ryan'
-REQUIRES_PYTHON = '>=3.6.0'
+REQUIRES_PYTHON = '>=3.8.0'
 VERSION = None
 
 REQUIRED = [
     'flask', 'itsdangerous', 'Jinja2', 'python-click', 'PyYAML', 'werkzeug',
 ]
 
-EXTRAS = {}
+EXTRAS = {
+    'asgi': ['uvicorn[standard]'],
+}
 
 here = os.path.abspath(os.path.dirname(__file__))
 
@@ -54,7 +56,7 @@ setup(
     author_email=EMAIL,
     python_requires=REQUIRES_PYTHON,
     url=URL,
-    packages=find_packages(exclude=('tests',)),
+    packages=find_packages(exclude=('benchmarks', 'tests')),
     install_requires=REQUIRED,
     extras_require=EXTRAS,
     include_package_data=True,
@@ -63,7 +65,7 @@ setup(
         'License :: OSI Approved :: MIT License',
         'Programming Language :: Python',
         'Programming Language :: Python :: 3',
-        'Programming Language :: Python :: 3.6',
+        'Programming Language :: Python :: 3.8',
         'Programming Language :: Python :: Implementation :: CPython',
     ],
     cmdclass={},
@@ -0,0 +1,425 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+
+#
+# Copyright (c) Facebook, Inc. and its affiliates.
+#
+# This source code is licensed under the MIT license found in the
+# LICENSE file in the root directory of this source tree.
+#
+
+import asyncio
+import functools
+import json
+import logging
+import time
+
+from urllib.parse import parse_qs
+
+from . import metrics
+from .events import Lagged
+from .waiters import StateWaiters
+
+
+class AsgiApplication(object):
+    """
+    Serves StateService as an ASGI application, so that an asyncio server
+    (e.g., uvicorn) can hold many thousands of keep-alive connections in one
+    thread.
+
+    Endpoints behave as the Flask application's endpoints do, since both
+    call the same StateService methods. Reads of the state machine are
+    answered on the event loop, since they only read memory, unless other
+    processes update the state machine (e.g., with --storage); those reads,
+    updates (which persist the state machine), predictions and building
+    named state machines run in an executor, so that they never block the
+    event loop.
+    Requests that wait for a state are parked on futures rather than
+    threads.
+
+    GET /state?state=:state[&wait=:seconds]
+    GET /state/events
+    PUT /state?state=:state
+    POST /state
+    POST /state/batch
+    GET /ready
+    GET /metrics
+    GET /models/batches
+    GET /models/cache
+    POST /profile?seconds=:seconds or ?requests=:requests
+    GET /machines
+    GET and PUT /machines/:name/state?state=:state
+
+    Requests are observed in the same metrics as the Flask application's,
+    by the name of the Flask endpoint.
+    """
+
+    def __init__(self, service, executor=None):
+        """
+        Args:
+            service (StateService): Answers requests
+            executor (Executor): Runs blocking work; the event loop's
+                default executor if None
+        """
+        self._executor = executor
+        self._logger = None
+        self._routes = {
+            ('GET', '/state'): ('get_state', self._get_state),
+            ('PUT', '/state'): ('update_state', self._put_state),
+            ('POST', '/state'): ('create_state', self._post_state),
+            ('POST', '/state/batch'): ('create_states', self._post_states),
+            ('GET', '/ready'): ('get_ready', self._get_ready),
+            ('GET', '/metrics'): ('get_metrics', self._get_metrics),
+            ('GET', '/models/batches'): (
+                'get_model_batches', self._get_model_batches),
+            ('GET', '/models/cache'): (
+                'get_model_cache', self._get_model_cache),
+            ('GET', '/machines'): ('get_machines', self._get_machines),
+        }
+        self._service = service
+        self._waiters = {}
+
+    async def __call__(self, scope, receive, send):
+        if scope['type'] == 'lifespan':
+            await self._lifespan(receive, send)
+            return
+
+        if scope['type'] != 'http':
+            return
+
+        method, path = scope['method'], scope['path']
+        headers = {
+            name.decode('latin-1'): value.decode('latin-1')
+            for name, value in scope.get('headers', ())
+        }
+        if (method, path) == ('GET', '/state/events'):
+            await self._stream_events(headers, receive, send)
+            return
+
+        args = {
+            key: values[-1]
+            for key, values in parse_qs(
+                scope['query_string'].decode('latin-1')).items()
+        }
+
+        start = time.perf_counter()
+        profiler = self._service._profiler
+        profiled = profiler is not None and profiler.active
+        endpoint, handler = self._routes.get((method, path), (None, None))
+        if (method, path) == ('POST', '/profile'):
+            client = scope.get('client') or (None, None)
+            endpoint, handler = 'start_profile', functools.partial(
+                self._post_profile, client[0])
+        elif handler is None:
+            endpoint, handler = self._machine_route(method, path)
+
+        if handler is None:
+            response = (404, '')
+        else:
+            body = b''
+            if method in ('POST', 'PUT'):
+                body = await self._read_body(receive)
+
+            try:
+                response = await handler(args, body, headers)
+            except Exception as e:
+                self.logger.exception(f'{method} {path}: {str(e)}')
+                response = (500, '')
+
+        metrics.REQUEST_SECONDS.labels(
+            endpoint or 'none', str(response[0]),
+        ).observe(time.perf_counter() - start)
+
+        await self._respond(send, *response)
+        if profiled:
+            profiler.count_request()
+
+    @property
+    def logger(self):
+        if self._logger is None:
+            self._logger = logging.getLogger(self.__class__.__name__)
+
+        return self._logger
+
+    async def _get_machines(self, args, body, headers):
+        names = await self._run(self._service.registry.names)
+        return 200, {'machines': names}
+
+    async def _get_metrics(self, args, body, headers):
+        return 200, metrics.collect(), {'Content-Type': metrics.CONTENT_TYPE}
+
+    async def _get_model_batches(self, args, body, headers):
+        return 200, self._service.machine.coalescer.stats
+
+    async def _get_model_cache(self, args, body, headers):
+        return 200, self._service.machine.model_cache.stats
+
+    async def _get_ready(self, args, body, headers):
+        if not self._service._ready.is_set():
+            return 503, {'ready': False}
+
+        return 200, {'ready': True, 'errors': self._service._preload_errors}
+
+    async def _get_state(self, args, body, headers):
+        return await self._check_state(
+            'GET /state', self._service.machine, args, headers)
+
+    async def _lifespan(self, receive, send):
+        """
+        Initializes StateService when the server starts, and writes pending
+        updates when it stops.
+        """
+        while True:
+            message = await receive()
+            if message['type'] == 'lifespan.startup':
+                try:
+                    await self._run(self._service._initialize)
+                except Exception as e:
+                    self.logger.exception(f'Unable to start: {str(e)}')
+                    await send({
+                        'type': 'lifespan.startup.failed',
+                        'message': str(e),
+                    })
+                    return
+
+                await send({'type': 'lifespan.startup.complete'})
+            elif message['type'] == 'lifespan.shutdown':
+                await self._run(self._service.close)
+                await send({'type': 'lifespan.shutdown.complete'})
+                return
+
+    def _machine_route(self, method, path):
+        """
+        Returns the endpoint and the handler of /machines/:name/state, or
+        None for both if `path` is not such a path.
+        """
+        parts = path.split('/')
+        if len(parts) != 4 or parts[1] != 'machines' or parts[3] != 'state':
+            return None, None
+
+        name = parts[2]
+        if method == 'GET':
+            return 'get_machine_state', functools.partial(
+                self._get_machine_state, name)
+
+        if method == 'PUT':
+            return 'update_machine_state', functools.partial(
+                self._put_machine_state, name)
+
+        return None, None
+
+    async def _get_machine_state(self, name, args, body, headers):
+        route = f'GET /machines/{name}/state'
+        machine = await self._named_machine(route, name)
+        if machine is None:
+            return 404, ''
+
+        return await self._check_state(route, machine, args, headers)
+
+    async def _check_state(self, route, machine, args, headers):
+        state = args.get('state')
+        wait = self._service._wait_time(route, args.get('wait'))
+        if wait is None:
+            return 500, ''
+
+        if state is not None and wait > 0:
+            await self._state_waiters(machine).wait(state, wait)
+
+        return await self._read(
+            machine, self._service._check_state,
+            route, machine, state, headers.get('if-none-match'))
+
+    async def _named_machine(self, route, name):
+        #
+        # The first request to a state machine builds it, which reads its
+        # file.
+        #
+        machine = self._service.registry.built(name)
+        if machine is not None:
+            return machine
+
+        return await self._run(self._service._named_machine, route, name)
+
+    async def _post_state(self, args, body, headers):
+        return await self._run(
+            self._service._predict_state, 'POST /state', self._json(body))
+
+    async def _post_states(self, args, body, headers):
+        return await self._run(
+            self._service._predict_states, 'POST /state/batch',
+            self._json(body))
+
+    async def _post_profile(self, remote_addr, args, body, headers):
+        return self._service._start_profile(
+            'POST /profile', args, remote_addr,
+            headers.get('x-profile-token'))
+
+    async def _put_machine_state(self, name, args, body, headers):
+        route = f'PUT /machines/{name}/state'
+        machine = await self._named_machine(route, name)
+        if machine is None:
+            return 404, ''
+
+        return await self._run(
+            self._service._change_state, route, machine, args.get('state'))
+
+    async def _put_state(self, args, body, headers):
+        return await self._run(
+            self._service._change_state, 'PUT /state', self._service.machine,
+            args.get('state'))
+
+    def _json(self, body):
+        try:
+            return json.loads(body)
+        except ValueError:
+            return None
+
+    async def _stream_events(self, headers, receive, send):
+        """
+        Streams events until the client disconnects or falls too far
+        behind. Waiting for events holds no thread.
+        """
+        route = 'GET /state/events'
+        machine = self._service.machine
+        payloads, last_id = await self._read(
+            machine, self._service._first_events,
+            route, machine, headers.get('last-event-id'))
+
+        await send({
+            'type': 'http.response.start',
+            'status': 200,
+            'headers': [(b'content-type', b'text/event-stream')] + [
+                (name.lower().encode('latin-1'), value.encode('latin-1'))
+                for name, value in self._service.EVENT_HEADERS.items()
+            ],
+        })
+
+        disconnected = asyncio.ensure_future(self._wait_disconnect(receive))
+        try:
+            while True:
+                await send({
+                    'type': 'http.response.body',
+                    'body': b''.join(payloads),
+                    'more_body': True,
+                })
+
+                waiting = asyncio.ensure_future(machine.events.wait_async(
+                    last_id, self._service.KEEPALIVE_INTERVAL))
+                await asyncio.wait(
+                    [waiting, disconnected],
+                    return_when=asyncio.FIRST_COMPLETED,
+                )
+                if disconnected.done():
+                    waiting.cancel()
+                    return
+
+                try:
+                    events = waiting.result()
+                except Lagged:
+                    self.logger.warning(f'{route}: Dropped a slow client')
+                    break
+
+                payloads, last_id = self._service._next_events(
+                    machine, last_id, events)
+
+            await send({'type': 'http.response.body', 'body': b''})
+        finally:
+            disconnected.cancel()
+
+    async def _wait_disconnect(self, receive):
+        while True:
+            message = await receive()
+            if message['type'] == 'http.disconnect':
+                return
+
+    def _state_waiters(self, machine):
+        waiters = self._waiters.get(machine)
+        if waiters is None:
+            waiters = self._waiters.setdefault(
+                machine, StateWaiters(machine, self._executor))
+
+        return waiters
+
+    async def _read_body(self, receive):
+        chunks = []
+        while True:
+            message = await receive()
+            if message['type'] == 'http.disconnect':
+                break
+
+            chunks.append(message.get('body', b''))
+            if not message.get('more_body', False):
+                break
+
+        return b''.join(chunks)
+
+    async def _respond(self, send, status, body, headers=None):
+        """
+        Sends a response; a `dict` body is sent as JSON, and a `str` body
+        as text.
+        """
+        if isinstance(body, dict):
+            content = json.dumps(body).encode('utf-8')
+            content_type = 'application/json'
+        else:
+            content = body.encode('utf-8')
+            content_type = 'text/html; charset=utf-8'
+
+        fields = {
+            'content-type': content_type,
+            'content-length': str(len(content)),
+        }
+        fields.update(
+            (name.lower(), value) for name, value in (headers or {}).items())
+
+        await send({
+            'type': 'http.response.start',
+            'status': status,
+            'headers': [
+                (name.encode('latin-1'), value.encode('latin-1'))
+                for name, value in fields.items()
+            ],
+        })
+        await send({'type': 'http.response.body', 'body': content})
+
+    async def _read(self, machine, func, *args):
+        """
+        Calls `func`, which reads `machine`, on the event loop, unless
+        other processes update the state machine: reading it then queries
+        its storage (or shared memory) and may wait for its lock, so it is
+        read in the executor.
+        """
+        if machine.is_shared:
+            return await self._run(func, *args)
+
+        return func(*args)
+
+    def _run(self, func, *args):
+        loop = asyncio.get_running_loop()
+        return loop.run_in_executor(
+            self._executor, functools.partial(func, *args))
+
+
+def serve(app, host, port):
+    """
+    Serves an ASGI application with uvicorn, which uses uvloop and
+    httptools when they are installed.
+
+    Raises:
+        - RuntimeError if uvicorn is not installed
+    """
+    try:
+        import uvicorn
+    except ImportError:
+        raise RuntimeError(
+            'Serving with --asgi requires uvicorn: pip install uvicorn'
+        )
+
+    uvicorn.run(
+        app,
+        host=host,
+        port=port,
+        access_log=False,
+        lifespan='on',
+        log_config=None,
+    )
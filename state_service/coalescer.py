@@ -0,0 +1,137 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+
+#
+# Copyright (c) Facebook, Inc. and its affiliates.
+#
+# This source code is licensed under the MIT license found in the
+# LICENSE file in the root directory of this source tree.
+#
+
+import threading
+
+
+class Batch(object):
+    """
+    Collects the rows of concurrent prediction requests for one model.
+    """
+
+    __slots__ = ('done', 'error', 'full', 'result', 'rows')
+
+    def __init__(self):
+        self.done = threading.Event()
+        self.error = None
+        self.full = threading.Event()
+        self.result = None
+        self.rows = []
+
+
+class PredictionCoalescer(object):
+    """
+    Merges concurrent prediction requests for the same model into a single
+    call to the model's `predict` method.
+
+    The first request for a model opens a batch and waits for up to a
+    window of time, or until the batch holds a maximum number of rows,
+    while other requests add their rows to the batch. The first request
+    then makes the prediction for the whole batch, and each request
+    receives the predictions for its own rows.
+    """
+
+    DEFAULT_MAX_BATCH_SIZE = 64
+    DEFAULT_WINDOW = 0.002
+
+    def __init__(self, predict):
+        """
+        Args:
+            predict (callable): Predicts states given a model name and a
+                list of rows
+        """
+        self._batches = {}
+        self._lock = threading.Lock()
+        self._predict = predict
+        self._stats = {}
+
+    def predict(self, model_name, rows,
+                window=DEFAULT_WINDOW,
+                max_batch_size=DEFAULT_MAX_BATCH_SIZE):
+        """
+        Predicts the states of `rows`, sharing a call to the model with
+        other requests that arrive within `window` seconds.
+
+        Returns:
+            list: The predicted state of each row
+        """
+        with self._lock:
+            batch = self._batches.get(model_name)
+            is_leader = batch is None
+            if is_leader:
+                batch = Batch()
+                self._batches[model_name] = batch
+
+            start = len(batch.rows)
+            batch.rows.extend(rows)
+            end = len(batch.rows)
+
+            if end >= max_batch_size:
+                self._close(model_name, batch)
+
+        if is_leader:
+            batch.full.wait(window)
+            with self._lock:
+                self._close(model_name, batch)
+
+            self._run(model_name, batch)
+        else:
+            batch.done.wait()
+
+        if batch.error is not None:
+            raise batch.error
+
+        return batch.result[start:end]
+
+    @property
+    def stats(self):
+        """
+        Returns the number of batches, the number of rows and the largest
+        batch predicted for each model.
+        """
+        with self._lock:
+            return {
+                name: dict(stats, mean=stats['rows'] / stats['batches'])
+                for name, stats in self._stats.items()
+            }
+
+    def _close(self, model_name, batch):
+        """
+        Stops `batch` from accepting rows. Must be called with the lock.
+        """
+        if self._batches.get(model_name) is batch:
+            del self._batches[model_name]
+
+        batch.full.set()
+
+    def _record(self, model_name, size):
+        with self._lock:
+            stats = self._stats.setdefault(
+                model_name, {'batches': 0, 'rows': 0, 'largest': 0}
+            )
+            stats['batches'] += 1
+            stats['rows'] += size
+            stats['largest'] = max(stats['largest'], size)
+
+    def _run(self, model_name, batch):
+        try:
+            result = self._predict(model_name, batch.rows)
+            if len(result) != len(batch.rows):
+                raise RuntimeError(
+                    f'{model_name} returned {len(result)} predictions for '
+                    f'{len(batch.rows)} rows'
+                )
+
+            batch.result = result
+        except Exception as e:
+            batch.error = e
+        finally:
+            self._record(model_name, len(batch.rows))
+            batch.done.set()
@@ -0,0 +1,166 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+
+#
+# Copyright (c) Facebook, Inc. and its affiliates.
+#
+# This source code is licensed under the MIT license found in the
+# LICENSE file in the root directory of this source tree.
+#
+
+import logging
+import threading
+import time
+
+#
+# Durability modes of updates to a state machine:
+#
+#   none: updates are written, but not flushed to disk (fsync)
+#   sync: each update is written and flushed before it is acknowledged
+#   group: updates that arrive within a short window are written and
+#          flushed together before they are acknowledged
+#   async: updates are acknowledged immediately, and written and flushed
+#          by a background thread
+#
+NONE = 'none'
+SYNC = 'sync'
+GROUP = 'group'
+ASYNC = 'async'
+
+MODES = (NONE, SYNC, GROUP, ASYNC)
+
+
+class Round(object):
+    """
+    A group of updates that are flushed together.
+    """
+
+    __slots__ = ('done', 'error')
+
+    def __init__(self):
+        self.done = threading.Event()
+        self.error = None
+
+
+class GroupCommit(object):
+    """
+    Flushes the updates of concurrent requests with one write and one fsync.
+
+    The first request of a round waits for a short window, while later
+    requests join the round, and then persists the updates of every
+    request in the round. Each request returns once its update is flushed.
+    """
+
+    DEFAULT_WINDOW = 0.002
+
+    def __init__(self, persist, window=DEFAULT_WINDOW):
+        """
+        Args:
+            persist (callable): Writes and flushes every pending update
+            window (float): Seconds that a round waits for other requests
+        """
+        self._lock = threading.Lock()
+        self._persist = persist
+        self._round = None
+        self._window = window
+
+    def commit(self):
+        """
+        Returns once the caller's pending update is flushed.
+
+        Raises:
+            The error raised when the round was persisted
+        """
+        with self._lock:
+            current = self._round
+            is_leader = current is None
+            if is_leader:
+                current = self._round = Round()
+
+        if is_leader:
+            time.sleep(self._window)
+            with self._lock:
+                self._round = None
+
+            try:
+                self._persist()
+            except Exception as e:
+                current.error = e
+            finally:
+                current.done.set()
+        else:
+            current.done.wait()
+
+        if current.error is not None:
+            raise current.error
+
+
+class Flusher(object):
+    """
+    Writes and flushes pending updates from a background thread, so that
+    requests do not wait for the disk.
+
+    Updates that arrive while a flush is in progress are written by the
+    next flush, so that many updates are written together. Updates made in
+    the last `interval` seconds may be lost if the process crashes.
+    """
+
+    DEFAULT_INTERVAL = 0.1
+
+    def __init__(self, persist, interval=DEFAULT_INTERVAL):
+        """
+        Args:
+            persist (callable): Writes and flushes every pending update
+            interval (float): Minimum seconds between flushes
+        """
+        self._dirty = threading.Event()
+        self._interval = interval
+        self._lock = threading.Lock()
+        self._logger = None
+        self._persist = persist
+        self._stopped = threading.Event()
+        self._thread = None
+
+    def close(self):
+        """
+        Stops the background thread after flushing pending updates.
+        """
+        with self._lock:
+            thread, self._thread = self._thread, None
+
+        if thread is not None:
+            self._stopped.set()
+            self._dirty.set()
+            thread.join()
+            self._flush()
+
+    def notify(self):
+        """
+        Schedules a flush of pending updates.
+        """
+        with self._lock:
+            if self._thread is None:
+                self._thread = threading.Thread(target=self._run, daemon=True)
+                self._thread.start()
+
+        self._dirty.set()
+
+    @property
+    def logger(self):
+        if self._logger is None:
+            self._logger = logging.getLogger(self.__class__.__name__)
+
+        return self._logger
+
+    def _run(self):
+        while not self._stopped.is_set():
+            self._dirty.wait()
+            self._stopped.wait(self._interval)
+            self._dirty.clear()
+            self._flush()
+
+    def _flush(self):
+        try:
+            self._persist()
+        except Exception as e:
+            self.logger.exception(f'Unable to flush updates: {str(e)}')
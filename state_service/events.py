@@ -0,0 +1,152 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+
+#
+# Copyright (c) Facebook, Inc. and its affiliates.
+#
+# This source code is licensed under the MIT license found in the
+# LICENSE file in the root directory of this source tree.
+#
+
+import asyncio
+import collections
+import json
+import threading
+
+
+class Lagged(Exception):
+    """
+    Raised when a subscriber asks for events that were already discarded,
+    i.e., when it fell further behind than the publisher's buffer.
+    """
+
+
+class EventPublisher(object):
+    """
+    Publishes the events of a state machine (transitions and updates) as
+    Server-Sent Events.
+
+    Every event is encoded once and appended to a single ring buffer, with
+    an increasing id. Subscribers read the buffer from the id of the last
+    event they received, so publishing an event costs the same however
+    many subscribers there are. A subscriber that falls behind by more
+    than the buffer's size cannot catch up and is dropped; it can reconnect
+    with the id of the last event it received (`Last-Event-ID`).
+    """
+
+    DEFAULT_SIZE = 1024
+    KEEPALIVE = b': keepalive\n\n'
+
+    def __init__(self, size=DEFAULT_SIZE):
+        self._condition = threading.Condition()
+        self._events = collections.deque(maxlen=size)
+        self._futures = {}
+        self._last_id = 0
+
+    def events_after(self, last_id):
+        """
+        Returns the events published after the event `last_id`, as
+        `(id, payload)` pairs.
+
+        Raises:
+            - Lagged if some of these events were discarded
+        """
+        with self._condition:
+            return self._events_after(last_id)
+
+    def message(self, event, data, event_id=None):
+        """
+        Encodes an event as a Server-Sent Event.
+        """
+        lines = [f'event: {event}', f'data: {json.dumps(data)}']
+        if event_id is not None:
+            lines.append(f'id: {event_id}')
+
+        return ('\n'.join(lines) + '\n\n').encode('utf-8')
+
+    def publish(self, event, data):
+        """
+        Publishes an event, and wakes the subscribers that wait for one.
+        """
+        with self._condition:
+            self._last_id += 1
+            payload = self.message(event, data, self._last_id)
+            self._events.append((self._last_id, payload))
+            self._condition.notify_all()
+            futures, self._futures = self._futures, {}
+
+        #
+        # Each event loop is woken once, however many of its subscribers
+        # wait.
+        #
+        for loop, waiting in futures.items():
+            try:
+                loop.call_soon_threadsafe(_resolve, waiting)
+            except RuntimeError:
+                # The event loop was closed.
+                pass
+
+    def wait(self, last_id, timeout):
+        """
+        Waits up to `timeout` seconds for events after `last_id`.
+
+        Returns:
+            The events, which are empty if none were published
+
+        Raises:
+            - Lagged if some of these events were discarded
+        """
+        with self._condition:
+            if self._last_id == last_id:
+                self._condition.wait(timeout)
+
+            return self._events_after(last_id)
+
+    async def wait_async(self, last_id, timeout):
+        """
+        Waits up to `timeout` seconds for events after `last_id`, without
+        blocking the event loop.
+        """
+        loop = asyncio.get_running_loop()
+        future = loop.create_future()
+        with self._condition:
+            if self._last_id == last_id:
+                self._futures.setdefault(loop, set()).add(future)
+            else:
+                future.set_result(True)
+
+        try:
+            await asyncio.wait([future], timeout=timeout)
+        finally:
+            with self._condition:
+                waiting = self._futures.get(loop)
+                if waiting is not None:
+                    waiting.discard(future)
+                    if not waiting:
+                        del self._futures[loop]
+
+        return self.events_after(last_id)
+
+    @property
+    def last_id(self):
+        return self._last_id
+
+    def _events_after(self, last_id):
+        if last_id == self._last_id:
+            return []
+
+        #
+        # An id after the last event was sent before StateService
+        # restarted, which numbers events from 1 again.
+        #
+        if last_id > self._last_id or self._events[0][0] > last_id + 1:
+            raise Lagged(f'Events after {last_id} were discarded')
+
+        skip = last_id + 1 - self._events[0][0]
+        return [self._events[i] for i in range(skip, len(self._events))]
+
+
+def _resolve(futures):
+    for future in futures:
+        if not future.done():
+            future.set_result(True)
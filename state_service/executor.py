@@ -0,0 +1,192 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+
+#
+# Copyright (c) Facebook, Inc. and its affiliates.
+#
+# This source code is licensed under the MIT license found in the
+# LICENSE file in the root directory of this source tree.
+#
+
+import argparse
+import logging
+import multiprocessing
+import os
+import threading
+import weakref
+import zlib
+
+from concurrent.futures import ProcessPoolExecutor
+from concurrent.futures.process import BrokenProcessPool
+
+#
+# The state machine of a worker process. Each worker holds its own copy
+# of the models that it has loaded.
+#
+_machine = None
+
+
+def _initialize_worker(factory, options):
+    global _machine
+    _machine = factory(options)
+
+    #
+    # Each worker applies changes to its own copy of the models.
+    #
+    interval = getattr(options, 'watch_models', None)
+    if interval:
+        _machine.watch_models(interval)
+
+
+def _predict(model_name, values):
+    return _machine._predict(model_name, values)
+
+
+def _preload(model_name):
+    _machine.preload_model(model_name)
+
+
+class PredictionExecutor(object):
+    """
+    Runs model inference in a pool of worker processes, so that CPU-bound
+    models do not block the process that serves the state machine.
+
+    Each worker process builds its own state machine and keeps its own
+    cache of deserialized models. Predictions are routed to workers by
+    model name, so that a model is always served by the same worker and
+    that worker's cache stays warm.
+
+    If a worker dies (e.g., a model crashes its process), the predictions
+    that it was running fail, and its pool is replaced by a new one the
+    next time that a model is routed to it.
+
+    A process forked from one that started the pools (e.g., a worker of
+    --workers after --preload-models) starts its own pools; the pools of
+    the parent are run by threads that do not exist in the child.
+    """
+
+    def __init__(self, workers, factory, options):
+        """
+        Args:
+            workers (int): Number of worker processes
+            factory (callable): Builds a state machine from `options` in
+                each worker, e.g., the StateMachine class
+            options (Namespace): Command-line arguments of StateService
+        """
+        self._factory = factory
+        self._lock = threading.Lock()
+        self._logger = None
+        self._options = options
+        self._pools = None
+        self._workers = workers
+
+        reference = weakref.ref(self)
+        os.register_at_fork(
+            after_in_child=lambda: reference() and reference()._reset())
+
+    @property
+    def logger(self):
+        if self._logger is None:
+            self._logger = logging.getLogger(self.__class__.__name__)
+
+        return self._logger
+
+    def predict(self, model_name, values):
+        """
+        Predicts states using the worker that serves `model_name`, and
+        waits for the prediction.
+        """
+        return self.submit(model_name, values).result()
+
+    def preload(self, model_name):
+        """
+        Deserializes (and warms up) a model in the worker that serves it.
+
+        Returns:
+            A `concurrent.futures.Future` that completes when the model is
+            loaded
+        """
+        return self._submit(model_name, _preload, model_name)
+
+    def shutdown(self):
+        with self._lock:
+            pools, self._pools = self._pools, None
+
+        if pools is not None:
+            for pool in pools:
+                pool.shutdown()
+
+    def submit(self, model_name, values):
+        """
+        Predicts states using the worker that serves `model_name`.
+
+        Returns:
+            A `concurrent.futures.Future` of the predicted states
+        """
+        return self._submit(model_name, _predict, model_name, values)
+
+    @property
+    def pools(self):
+        with self._lock:
+            if self._pools is None:
+                self._pools = [
+                    self._create_pool() for _ in range(self._workers)
+                ]
+
+            return self._pools
+
+    @property
+    def workers(self):
+        return self._workers
+
+    def _create_pool(self):
+        #
+        # Workers are spawned rather than forked, because the parent
+        # process runs timer and server threads.
+        #
+        context = multiprocessing.get_context('spawn')
+        options = argparse.Namespace(
+            **dict(vars(self._options), prediction_workers=0)
+        )
+        return ProcessPoolExecutor(
+            max_workers=1,
+            mp_context=context,
+            initializer=_initialize_worker,
+            initargs=(self._factory, options),
+        )
+
+    def _replace_pool(self, index, broken):
+        """
+        Replaces the pool at `index` if it is still `broken`, i.e., if no
+        other thread replaced it first.
+
+        Returns:
+            The pool at `index`
+        """
+        with self._lock:
+            if self._pools is None:
+                raise RuntimeError('The prediction executor is shut down')
+
+            if self._pools[index] is broken:
+                self.logger.warning(
+                    f'Prediction worker {index} died; starting a new one')
+                broken.shutdown(wait=False)
+                self._pools[index] = self._create_pool()
+
+            return self._pools[index]
+
+    def _reset(self):
+        """
+        Forgets the pools of a parent process in a forked process; they
+        remain the parent's to use and shut down.
+        """
+        self._lock = threading.Lock()
+        self._pools = None
+
+    def _submit(self, model_name, func, *args):
+        index = zlib.crc32(model_name.encode('utf-8')) % self._workers
+        pool = self.pools[index]
+        try:
+            return pool.submit(func, *args)
+        except BrokenProcessPool:
+            return self._replace_pool(index, pool).submit(func, *args)
@@ -0,0 +1,121 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+
+#
+# Copyright (c) Facebook, Inc. and its affiliates.
+#
+# This source code is licensed under the MIT license found in the
+# LICENSE file in the root directory of this source tree.
+#
+
+import json
+import os
+
+
+class Journal(object):
+    """
+    An append-only log of updates to a state machine.
+
+    Each update appends one record (a line of JSON) with the version of the
+    state machine, the name of the current state and the counters of the
+    states that changed, so that persisting an update costs one small
+    write, however large the state machine is. Records hold values rather
+    than differences, so replaying a record more than once is harmless.
+
+    The journal is compacted by writing a snapshot of the state machine
+    and then discarding the records that the snapshot includes.
+    """
+
+    def __init__(self, path):
+        self._file = None
+        self._path = path
+
+    def append(self, records, sync=False):
+        """
+        Appends records to the journal with a single write.
+
+        Args:
+            records (list): Records to append
+            sync (bool): Whether to flush the journal to disk (fsync)
+
+        Returns:
+            int: The size of the journal in bytes
+        """
+        lines = ''.join(
+            json.dumps(record, separators=(',', ':')) + '\n'
+            for record in records
+        )
+        f = self._open()
+        f.write(lines.encode('utf-8'))
+        if sync:
+            os.fsync(f.fileno())
+
+        return f.tell()
+
+    def close(self):
+        if self._file is not None:
+            self._file.close()
+            self._file = None
+
+    def discard(self, offset, sync=False):
+        """
+        Discards the records before `offset`, e.g., records included in a
+        snapshot. The remaining records are written to a new file that
+        replaces the journal.
+        """
+        with open(self._path, 'rb') as f:
+            f.seek(offset)
+            remaining = f.read()
+
+        temporary_path = f'{self._path}.tmp'
+        with open(temporary_path, 'wb') as f:
+            f.write(remaining)
+            if sync:
+                f.flush()
+                os.fsync(f.fileno())
+
+        os.replace(temporary_path, self._path)
+        self.close()
+
+    def records(self):
+        """
+        Returns the records of the journal, oldest first. A partial record
+        at the end of the journal (e.g., after a crash) is ignored.
+        """
+        if not os.path.exists(self._path):
+            return
+
+        with open(self._path, 'rb') as f:
+            for line in f:
+                try:
+                    yield json.loads(line)
+                except ValueError:
+                    return
+
+    @property
+    def path(self):
+        return self._path
+
+    @property
+    def size(self):
+        return os.fstat(self._open().fileno()).st_size
+
+    def _open(self):
+        """
+        Opens the journal for appending, reopening it if another process
+        replaced it while compacting.
+        """
+        if self._file is not None:
+            try:
+                replaced = os.stat(self._path).st_ino != \
+                    os.fstat(self._file.fileno()).st_ino
+            except FileNotFoundError:
+                replaced = True
+
+            if replaced:
+                self.close()
+
+        if self._file is None:
+            self._file = open(self._path, 'ab', buffering=0)
+
+        return self._file
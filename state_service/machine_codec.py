@@ -0,0 +1,106 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+
+#
+# Copyright (c) Facebook, Inc. and its affiliates.
+#
+# This source code is licensed under the MIT license found in the
+# LICENSE file in the root directory of this source tree.
+#
+
+import json
+import marshal
+
+import yaml
+
+#
+# libyaml's loader and dumper are an order of magnitude faster than the
+# pure-Python ones, and are used when PyYAML was built with libyaml.
+#
+Loader = getattr(yaml, 'CSafeLoader', yaml.SafeLoader)
+Dumper = getattr(yaml, 'CSafeDumper', yaml.SafeDumper)
+
+
+class YamlCodec(object):
+    """
+    Encodes a state machine as YAML, the format in which state machines
+    are written by people.
+    """
+
+    extension = '.yaml'
+    name = 'yaml'
+
+    def dump(self, data):
+        return yaml.dump(
+            data, Dumper=Dumper, default_flow_style=False,
+        ).encode('utf-8')
+
+    def load(self, data):
+        try:
+            return yaml.load(data, Loader=Loader)
+        except yaml.YAMLError as e:
+            raise ValueError(str(e))
+
+
+class JsonCodec(object):
+    """
+    Encodes a state machine as compact JSON.
+    """
+
+    extension = '.json'
+    name = 'json'
+
+    def dump(self, data):
+        return json.dumps(data, separators=(',', ':')).encode('utf-8')
+
+    def load(self, data):
+        return json.loads(data)
+
+
+class BinaryCodec(object):
+    """
+    Encodes a state machine with `marshal`, the fastest format to read and
+    write. Unlike a pickle, reading a binary file only builds dicts, lists,
+    strings and numbers, and never runs code, so a file that someone else
+    wrote cannot run code in StateService. Binary files are only read if
+    they start with `MAGIC`.
+    """
+
+    MAGIC = b'SSMACHINE2\n'
+    VERSION = 4
+
+    extension = '.bin'
+    name = 'binary'
+
+    def dump(self, data):
+        return self.MAGIC + marshal.dumps(data, self.VERSION)
+
+    def load(self, data):
+        if not data.startswith(self.MAGIC):
+            raise ValueError('not a binary state machine')
+
+        try:
+            return marshal.loads(data[len(self.MAGIC):])
+        except (EOFError, TypeError) as e:
+            raise ValueError(str(e))
+
+
+CODECS = {
+    codec.name: codec for codec in (YamlCodec, JsonCodec, BinaryCodec)
+}
+
+
+def get_codec(name):
+    """
+    Returns the codec named `name`.
+
+    Raises:
+        - RuntimeError if no codec is named `name`
+    """
+    try:
+        return CODECS[name]()
+    except KeyError:
+        raise RuntimeError(
+            f'{name} is not a snapshot format; expected one of '
+            f'{", ".join(sorted(CODECS))}'
+        )
@@ -0,0 +1,156 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+
+#
+# Copyright (c) Facebook, Inc. and its affiliates.
+#
+# This source code is licensed under the MIT license found in the
+# LICENSE file in the root directory of this source tree.
+#
+
+import argparse
+import os
+import threading
+
+from .state_machine import StateMachine
+
+
+class MachineRegistry(object):
+    """
+    Hosts the state machines of a directory, one per YAML file, named after
+    their files (e.g., `rollout.yaml` is named `rollout`).
+
+    A state machine is built the first time it is requested, so idle state
+    machines cost nothing but a directory entry. Each state machine has its
+    own lock and its own files, so requests to one state machine never wait
+    for another.
+    """
+
+    EXTENSIONS = ('.yaml', '.yml')
+
+    def __init__(self, options):
+        """
+        Args:
+            options (Namespace): Options of StateService; `machines` is the
+                directory of state machines, and `journal`, if given, is
+                the directory of their journals
+        """
+        self._lock = threading.Lock()
+        self._machines = {}
+        self._options = options
+
+    def close(self):
+        with self._lock:
+            machines = list(self._machines.values())
+
+        for machine in machines:
+            machine.close()
+
+    def built(self, name):
+        """
+        Returns the state machine named `name` if it was built, or None,
+        without reading any file.
+        """
+        machine = self._machines.get(name)
+        if machine is None or not machine.is_built:
+            return None
+
+        return machine.built()
+
+    def get(self, name):
+        """
+        Returns the state machine named `name`, building it if it was not
+        requested before, or None if there is no such state machine.
+
+        Raises:
+            - RuntimeError if the state machine cannot be built
+        """
+        machine = self._machines.get(name)
+        if machine is not None:
+            return machine.built()
+
+        path = self._path(name)
+        if path is None:
+            return None
+
+        #
+        # Building a state machine reads its file, so the registry's lock
+        # is only held to create it; requests to other state machines are
+        # not blocked meanwhile.
+        #
+        with self._lock:
+            machine = self._machines.get(name)
+            if machine is None:
+                machine = _LazyMachine(self._machine_options(name, path))
+                self._machines[name] = machine
+
+        return machine.built()
+
+    def names(self):
+        """
+        Returns the names of the state machines of the directory.
+        """
+        return sorted(
+            os.path.splitext(filename)[0]
+            for filename in os.listdir(self._directory())
+            if os.path.splitext(filename)[1] in self.EXTENSIONS
+        )
+
+    def _directory(self):
+        try:
+            return self._options.machines
+        except AttributeError:
+            raise RuntimeError('No state machines directory provided.')
+
+    def _machine_options(self, name, path):
+        options = argparse.Namespace(**vars(self._options))
+        options.machine = path
+
+        journal = getattr(self._options, 'journal', None)
+        if journal:
+            options.journal = os.path.join(journal, f'{name}.log')
+
+        return options
+
+    def _path(self, name):
+        #
+        # Names come from URLs, so they must not reach outside of the
+        # directory.
+        #
+        if not name or name.startswith('.') or os.path.basename(name) != name:
+            return None
+
+        for extension in self.EXTENSIONS:
+            path = os.path.join(self._directory(), f'{name}{extension}')
+            if os.path.isfile(path):
+                return path
+
+        return None
+
+
+class _LazyMachine(object):
+    """
+    A state machine that is built once, on first use.
+    """
+
+    def __init__(self, options):
+        self._built = False
+        self._lock = threading.Lock()
+        self._machine = StateMachine(options)
+
+    def built(self):
+        if not self._built:
+            with self._lock:
+                if not self._built:
+                    self._machine.build()
+                    self._built = True
+
+        return self._machine
+
+    def close(self):
+        if self._built:
+            self._machine.close()
+
+    @property
+    def is_built(self):
+        return self._built
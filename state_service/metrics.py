@@ -0,0 +1,262 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+
+#
+# Copyright (c) Facebook, Inc. and its affiliates.
+#
+# This source code is licensed under the MIT license found in the
+# LICENSE file in the root directory of this source tree.
+#
+
+import bisect
+import functools
+import os
+import threading
+import time
+
+from .scheduler import get_scheduler
+
+
+#
+# Bounds of the buckets of histograms, in seconds. Most operations of
+# StateService take microseconds to milliseconds; predictions and model
+# deserialization may take seconds.
+#
+DEFAULT_BUCKETS = (
+    0.0001, 0.00025, 0.0005, 0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1,
+    0.25, 0.5, 1.0, 2.5, 5.0, 10.0,
+)
+
+CONTENT_TYPE = 'text/plain; version=0.0.4; charset=utf-8'
+
+
+class Histogram(object):
+    """
+    A histogram of durations, in the Prometheus text format, with one
+    series per combination of label values.
+
+    Observing a value finds its bucket without a lock, and then holds the
+    series' own lock for two additions, so that threads that observe
+    different series never wait for each other, and threads that observe
+    the same series wait for less than a microsecond.
+    """
+
+    def __init__(self, name, documentation, labels=(),
+                 buckets=DEFAULT_BUCKETS):
+        self._buckets = tuple(buckets)
+        self._lock = threading.Lock()
+        self._series = {}
+        self.documentation = documentation
+        self.label_names = tuple(labels)
+        self.name = name
+
+    def collect(self):
+        """
+        Returns the lines of the histogram in the Prometheus text format.
+        """
+        lines = [
+            f'# HELP {self.name} {self.documentation}',
+            f'# TYPE {self.name} histogram',
+        ]
+        bounds = [_format_value(bound) for bound in self._buckets] + ['+Inf']
+
+        with self._lock:
+            items = sorted(self._series.items())
+
+        for values, series in items:
+            counts, total = series.snapshot()
+            labels = list(zip(self.label_names, values))
+            cumulative = 0
+            for bound, count in zip(bounds, counts):
+                cumulative += count
+                lines.append(
+                    f'{self.name}_bucket'
+                    f'{_format_labels(labels + [("le", bound)])} {cumulative}'
+                )
+
+            lines.append(
+                f'{self.name}_sum{_format_labels(labels)} '
+                f'{_format_value(total)}'
+            )
+            lines.append(
+                f'{self.name}_count{_format_labels(labels)} {cumulative}')
+
+        return lines
+
+    def labels(self, *values):
+        """
+        Returns the series of the histogram for label `values`.
+        """
+        series = self._series.get(values)
+        if series is None:
+            if len(values) != len(self.label_names):
+                raise RuntimeError(
+                    f'{self.name} expects labels {self.label_names}')
+
+            with self._lock:
+                series = self._series.setdefault(
+                    values, _Series(self._buckets))
+
+        return series
+
+    def observe(self, value):
+        self.labels().observe(value)
+
+    def _reset_locks(self):
+        self._lock = threading.Lock()
+        for series in self._series.values():
+            series._lock = threading.Lock()
+
+
+class Gauge(object):
+    """
+    A value that is read when metrics are collected, e.g., the number of
+    pending timers, so that it costs nothing in between.
+    """
+
+    def __init__(self, name, documentation, function):
+        self._function = function
+        self.documentation = documentation
+        self.name = name
+
+    def collect(self):
+        return [
+            f'# HELP {self.name} {self.documentation}',
+            f'# TYPE {self.name} gauge',
+            f'{self.name} {_format_value(self._function())}',
+        ]
+
+    def _reset_locks(self):
+        pass
+
+
+class _Series(object):
+
+    __slots__ = ('_buckets', '_counts', '_lock', '_sum')
+
+    def __init__(self, buckets):
+        self._buckets = buckets
+        self._counts = [0] * (len(buckets) + 1)
+        self._lock = threading.Lock()
+        self._sum = 0.0
+
+    def observe(self, value):
+        index = bisect.bisect_left(self._buckets, value)
+        with self._lock:
+            self._counts[index] += 1
+            self._sum += value
+
+    def snapshot(self):
+        with self._lock:
+            return list(self._counts), self._sum
+
+
+_metrics = []
+
+
+def collect():
+    """
+    Returns every metric in the Prometheus text format.
+    """
+    lines = []
+    for metric in _metrics:
+        lines.extend(metric.collect())
+
+    return '\n'.join(lines) + '\n'
+
+
+def gauge(name, documentation, function):
+    metric = Gauge(name, documentation, function)
+    _metrics.append(metric)
+    return metric
+
+
+def histogram(name, documentation, labels=(), buckets=DEFAULT_BUCKETS):
+    metric = Histogram(name, documentation, labels, buckets)
+    _metrics.append(metric)
+    return metric
+
+
+def timed(metric):
+    """
+    Decorates a function to observe its duration in the histogram
+    `metric`, whether it returns or raises.
+    """
+    series = metric.labels()
+
+    def decorator(func):
+        @functools.wraps(func)
+        def wrapper(*args, **kwargs):
+            start = time.perf_counter()
+            try:
+                return func(*args, **kwargs)
+            finally:
+                series.observe(time.perf_counter() - start)
+
+        return wrapper
+
+    return decorator
+
+
+def _format_labels(labels):
+    if not labels:
+        return ''
+
+    pairs = ','.join(f'{name}="{_escape(value)}"' for name, value in labels)
+    return f'{{{pairs}}}'
+
+
+def _escape(value):
+    return str(value).replace('\\', '\\\\').replace('"', '\\"').replace(
+        '\n', '\\n')
+
+
+def _format_value(value):
+    return repr(float(value))
+
+
+def _reset_after_fork():
+    #
+    # A thread of the parent may have held a lock when the process forked,
+    # and it does not exist in the child.
+    #
+    for metric in _metrics:
+        metric._reset_locks()
+
+
+os.register_at_fork(after_in_child=_reset_after_fork)
+
+
+REQUEST_SECONDS = histogram(
+    'state_service_request_duration_seconds',
+    'Time to answer requests, by route and status code.',
+    ('route', 'status'),
+)
+PREDICT_SECONDS = histogram(
+    'state_service_predict_duration_seconds',
+    'Time to predict states with a model, by model.',
+    ('model',),
+)
+DESERIALIZE_SECONDS = histogram(
+    'state_service_model_deserialize_duration_seconds',
+    'Time to deserialize a model from its file, by model.',
+    ('model',),
+)
+SAVE_SECONDS = histogram(
+    'state_service_save_duration_seconds',
+    'Time to save the state machine after an update.',
+)
+WRITE_MACHINE_SECONDS = histogram(
+    'state_service_write_machine_duration_seconds',
+    'Time to write a snapshot of the state machine.',
+)
+LOCK_WAIT_SECONDS = histogram(
+    'state_service_lock_wait_seconds',
+    'Time spent waiting for the locks of the state machine, by lock.',
+    ('lock',),
+)
+PENDING_TIMERS = gauge(
+    'state_service_pending_timers',
+    'Number of scheduled transitions of asynchronous states.',
+    lambda: len(get_scheduler()),
+)
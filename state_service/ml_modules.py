@@ -8,9 +8,87 @@
 # LICENSE file in the root directory of this source tree.
 #
 
-import numpy as np  # noqa: F401
-import pandas as pd  # noqa: F401
+import importlib
+import threading
 
-from sklearn.model_selection import train_test_split  # noqa: F401
-from sklearn.metrics import accuracy_score  # noqa: F401
-from sklearn import tree  # noqa: F401
+#
+# The ML libraries that models may require, keyed by the name of a
+# framework. A model's configuration declares the frameworks it needs
+# with a `framework` key, e.g., "framework": "sklearn", and the modules
+# of those frameworks are imported just before the model is first
+# deserialized. Deployments that only serve an explicit state machine
+# never import them.
+#
+# One file (ml_modules.py) is used to list all libraries, so that edits to
+# the main codebase are minimized.
+#
+FRAMEWORKS = {
+    'numpy': ['numpy'],
+    'pandas': ['numpy', 'pandas'],
+    'sklearn': [
+        'numpy',
+        'sklearn.model_selection',
+        'sklearn.metrics',
+        'sklearn.tree',
+    ],
+}
+
+#
+# Frameworks loaded for models whose configuration does not declare any.
+#
+DEFAULT_FRAMEWORKS = ['numpy', 'pandas', 'sklearn']
+
+_loaded = set()
+_lock = threading.Lock()
+
+
+def register_framework(name, modules):
+    """
+    Declares the modules that models of a framework require.
+    """
+    with _lock:
+        FRAMEWORKS[name] = list(modules)
+        _loaded.discard(name)
+
+
+def load_frameworks(names=None):
+    """
+    Imports the modules of each framework in `names`, unless they were
+    imported before.
+
+    Args:
+        names (str or list): Frameworks declared by a model's configuration,
+            or None for the default frameworks
+
+    Raises:
+        - RuntimeError if a framework is unknown or cannot be imported
+    """
+    if names is None:
+        names = DEFAULT_FRAMEWORKS
+    elif isinstance(names, str):
+        names = [names]
+
+    for name in names:
+        if name in _loaded:
+            continue
+
+        with _lock:
+            if name in _loaded:
+                continue
+
+            if name not in FRAMEWORKS:
+                raise RuntimeError(f'{name} is not a known framework')
+
+            for module in FRAMEWORKS[name]:
+                try:
+                    importlib.import_module(module)
+                except ImportError:
+                    raise RuntimeError(
+                        f'Unable to import {module} for the {name} framework'
+                    )
+
+            _loaded.add(name)
+
+
+def loaded_frameworks():
+    return set(_loaded)
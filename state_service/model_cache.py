@@ -0,0 +1,200 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+
+#
+# Copyright (c) Facebook, Inc. and its affiliates.
+#
+# This source code is licensed under the MIT license found in the
+# LICENSE file in the root directory of this source tree.
+#
+
+import hashlib
+import os
+import threading
+
+from collections import OrderedDict
+
+
+class ModelCache(object):
+    """
+    Keeps deserialized models in memory, so that a prediction does not
+    read and unpickle a model from disk for every request.
+
+    Models are keyed by team and model name. A cached model is reused for
+    as long as the signature of its file (modification time and size) is
+    unchanged; otherwise, the model is deserialized again. With
+    `use_hash`, a hash of the file's contents is computed when its
+    signature changes, and the model is only deserialized again if the
+    contents changed (e.g., not when the same model is copied again), so
+    a hit costs a `stat` with or without it. When the cache is full, the
+    least-recently-used model is evicted.
+
+    Hits, misses, reloads and evictions are counted, so that the capacity
+    of the cache can be sized for a deployment.
+    """
+
+    DEFAULT_CAPACITY = 32
+
+    def __init__(self, capacity=DEFAULT_CAPACITY, use_hash=False):
+        self._capacity = capacity
+        self._entries = OrderedDict()
+        self._evictions = 0
+        self._hits = 0
+        self._lock = threading.Lock()
+        self._misses = 0
+        self._reloads = 0
+        self._use_hash = use_hash
+
+    def get(self, key, path, loader):
+        """
+        Returns the model stored under `key`, loading it with `loader` if
+        it is not cached or if the file at `path` changed since it was
+        loaded.
+
+        Args:
+            key (tuple): Identifies the model, e.g., (team, model)
+            path (str): Path to the serialized model
+            loader (callable): Deserializes the model at `path`
+
+        Returns:
+            The deserialized model
+        """
+        signature = self._signature(path)
+        if signature is None or self._capacity <= 0:
+            # The file cannot be inspected (or caching is disabled), so
+            # the loader decides how to handle it.
+            return loader()
+
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is not None and entry[0] == signature:
+                self._entries.move_to_end(key)
+                self._hits += 1
+                return entry[1]
+
+        digest = self._digest(path)
+        with self._lock:
+            if entry is not None and digest is not None and \
+                    digest == entry[2] and self._entries.get(key) is entry:
+                self._entries[key] = (signature, entry[1], digest)
+                self._entries.move_to_end(key)
+                self._hits += 1
+                return entry[1]
+
+            self._misses += 1
+            if entry is not None:
+                self._reloads += 1
+
+        model = loader()
+        if model is None:
+            return model
+
+        with self._lock:
+            self._entries[key] = (signature, model, digest)
+            self._entries.move_to_end(key)
+            while len(self._entries) > self._capacity:
+                self._entries.popitem(last=False)
+                self._evictions += 1
+
+        return model
+
+    def clear(self):
+        with self._lock:
+            self._entries.clear()
+
+    def invalidate(self, key):
+        """
+        Removes a model from the cache, if it is cached.
+        """
+        with self._lock:
+            self._entries.pop(key, None)
+
+    def refresh(self, key, path, loader):
+        """
+        Reloads a cached model if its file changed, and evicts it if its
+        file was removed. Models that are not cached are not loaded.
+
+        The new model replaces the old one atomically; predictions that
+        are using the old model are not interrupted.
+
+        Returns:
+            True if the model was reloaded or evicted
+            False otherwise
+        """
+        with self._lock:
+            entry = self._entries.get(key)
+
+        if entry is None:
+            return False
+
+        signature = self._signature(path)
+        if signature == entry[0]:
+            return False
+
+        if signature is None:
+            self.invalidate(key)
+            return True
+
+        digest = self._digest(path)
+        if digest is not None and digest == entry[2]:
+            with self._lock:
+                if self._entries.get(key) is entry:
+                    self._entries[key] = (signature, entry[1], digest)
+
+            return False
+
+        model = loader()
+        with self._lock:
+            if key in self._entries:
+                self._entries[key] = (signature, model, digest)
+                self._reloads += 1
+
+        return True
+
+    @property
+    def capacity(self):
+        return self._capacity
+
+    @property
+    def stats(self):
+        """
+        Returns the cache's counters as a `dict`.
+        """
+        with self._lock:
+            return {
+                'capacity': self._capacity,
+                'size': len(self._entries),
+                'hits': self._hits,
+                'misses': self._misses,
+                'reloads': self._reloads,
+                'evictions': self._evictions,
+            }
+
+    def _signature(self, path):
+        try:
+            stat = os.stat(path)
+        except OSError:
+            return None
+
+        return (stat.st_mtime_ns, stat.st_size)
+
+    def _digest(self, path):
+        """
+        Returns the hash of the file at `path`, or None without `use_hash`
+        or if the file cannot be read.
+        """
+        if not self._use_hash:
+            return None
+
+        digest = hashlib.sha1()
+        try:
+            with open(path, 'rb') as f:
+                for chunk in iter(lambda: f.read(1 << 20), b''):
+                    digest.update(chunk)
+        except OSError:
+            return None
+
+        return digest.hexdigest()
+
+    def __len__(self):
+        return len(self._entries)
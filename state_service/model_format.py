@@ -0,0 +1,119 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+
+#
+# Copyright (c) Facebook, Inc. and its affiliates.
+#
+# This source code is licensed under the MIT license found in the
+# LICENSE file in the root directory of this source tree.
+#
+
+import mmap
+import os
+import pickle
+import struct
+import sys
+
+#
+# A memory-mapped model (.mpkl) stores a model pickled with protocol 5,
+# with the model's arrays written as out-of-band buffers after the pickle:
+#
+#   magic | pickle size | buffer count | (offset, size) per buffer |
+#   pickle | aligned buffers...
+#
+# A model is loaded by mapping the file into memory, so that numpy arrays
+# are views of the mapping rather than copies. Processes that load the
+# same model share one copy of its arrays in the page cache.
+#
+EXTENSION = '.mpkl'
+MAGIC = b'SSMODEL1'
+
+_ALIGNMENT = 64
+_HEADER = struct.Struct('<8sQQ')
+_BUFFER = struct.Struct('<QQ')
+
+
+def dump_model(model, path):
+    """
+    Serializes a model to a memory-mappable file.
+
+    The file is written to a temporary file and then renamed, so that
+    processes that map the model never read a partial file.
+    """
+    buffers = []
+    data = pickle.dumps(model, protocol=5, buffer_callback=buffers.append)
+    buffers = [buffer.raw() for buffer in buffers]
+
+    offset = _HEADER.size + _BUFFER.size * len(buffers) + len(data)
+    table = []
+    for buffer in buffers:
+        offset = _align(offset)
+        table.append((offset, buffer.nbytes))
+        offset += buffer.nbytes
+
+    temporary_path = f'{path}.tmp'
+    with open(temporary_path, 'wb') as f:
+        f.write(_HEADER.pack(MAGIC, len(data), len(buffers)))
+        for entry in table:
+            f.write(_BUFFER.pack(*entry))
+
+        f.write(data)
+        for (offset, _), buffer in zip(table, buffers):
+            f.write(b'\0' * (offset - f.tell()))
+            f.write(buffer)
+
+    os.replace(temporary_path, path)
+
+
+def is_mapped_model(path):
+    return os.path.splitext(path)[1].lower() == EXTENSION
+
+
+def load_model(path):
+    """
+    Deserializes a model, mapping its arrays from the file rather than
+    copying them. The arrays of the model are read-only.
+
+    Raises:
+        - RuntimeError if the file is not a memory-mapped model
+    """
+    with open(path, 'rb') as f:
+        mapping = mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ)
+
+    view = memoryview(mapping)
+    if len(view) < _HEADER.size:
+        raise RuntimeError(f'{path} is not a memory-mapped model')
+
+    magic, size, count = _HEADER.unpack_from(view)
+    if magic != MAGIC:
+        raise RuntimeError(f'{path} is not a memory-mapped model')
+
+    buffers = []
+    for index in range(count):
+        offset, length = _BUFFER.unpack_from(
+            view, _HEADER.size + _BUFFER.size * index)
+        buffers.append(view[offset:offset + length])
+
+    start = _HEADER.size + _BUFFER.size * count
+    return pickle.loads(view[start:start + size], buffers=buffers)
+
+
+def convert_model(source, destination):
+    """
+    Converts a pickled model to a memory-mapped model.
+    """
+    with open(source, 'rb') as f:
+        model = pickle.load(f)
+
+    dump_model(model, destination)
+
+
+def _align(offset):
+    return (offset + _ALIGNMENT - 1) // _ALIGNMENT * _ALIGNMENT
+
+
+if __name__ == '__main__':
+    if len(sys.argv) != 3:
+        sys.exit(f'usage: {sys.argv[0]} MODEL.pkl MODEL{EXTENSION}')
+
+    convert_model(sys.argv[1], sys.argv[2])
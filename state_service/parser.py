@@ -52,6 +52,13 @@ class Parser(object):
             self._parser = argparse.ArgumentParser(prog='state_service',
                                                    fromfile_prefix_chars='@',
                                                    )
+            self._parser.add_argument('--asgi',
+                                      action='store_true',
+                                      default=False,
+                                      help='serve requests from an asyncio '
+                                           'event loop with uvicorn, for '
+                                           'many concurrent connections',
+                                      )
             self._parser.add_argument('--config',
                                       type=str,
                                       required=False,
@@ -62,12 +69,68 @@ class Parser(object):
                                       default=False,
                                       help='start server in debug mode',
                                       )
+            self._parser.add_argument('--durability',
+                                      type=str,
+                                      required=False,
+                                      choices=['none', 'sync', 'group', 'async'],
+                                      default='none',
+                                      help='how updates of the state machine '
+                                           'are flushed to disk: none, sync '
+                                           '(each update), group (concurrent '
+                                           'updates together) or async (in '
+                                           'the background)',
+                                      )
+            self._parser.add_argument('--durability-window',
+                                      type=float,
+                                      required=False,
+                                      metavar='MILLISECONDS',
+                                      help='how long a group waits for '
+                                           'concurrent updates (default 2) '
+                                           'or how often async updates are '
+                                           'flushed (default 100)',
+                                      )
+            self._parser.add_argument('--event-buffer',
+                                      type=int,
+                                      required=False,
+                                      default=1024,
+                                      help='number of events kept for '
+                                           'clients of /state/events; a '
+                                           'client that falls further '
+                                           'behind is disconnected',
+                                      )
             self._parser.add_argument('--host',
                                       type=str,
                                       required=False,
                                       default='127.0.0.1',
                                       help='the host that serves StateService',
                                       )
+            self._parser.add_argument('--increment-hint',
+                                      type=float,
+                                      required=False,
+                                      default=0,
+                                      metavar='SECONDS',
+                                      help='how long clients may cache the '
+                                           'answer to GET /state when the '
+                                           'current state is an increment '
+                                           'state (0 disables caching)',
+                                      )
+            self._parser.add_argument('--journal',
+                                      type=str,
+                                      required=False,
+                                      help='append updates of the state '
+                                           'machine to this journal rather '
+                                           'than rewriting the state machine '
+                                           '(with --machines, a directory of '
+                                           'journals)',
+                                      )
+            self._parser.add_argument('--journal-size',
+                                      type=int,
+                                      required=False,
+                                      default=1 << 20,
+                                      help='size in bytes at which the journal '
+                                           'is compacted into the state '
+                                           'machine file',
+                                      )
             self._parser.add_argument('--logger',
                                       type=str,
                                       required=False,
@@ -79,6 +142,29 @@ class Parser(object):
                                       required=False,
                                       help='path to a state machine',
                                       )
+            self._parser.add_argument('--machines',
+                                      type=str,
+                                      required=False,
+                                      help='path to a directory of state '
+                                           'machines, served as '
+                                           '/machines/<name>/state',
+                                      )
+            self._parser.add_argument('--model-cache-hash',
+                                      action='store_true',
+                                      default=False,
+                                      help='reload cached models only if '
+                                           'the hash of their file changed '
+                                           'when its modification time or '
+                                           'size changes',
+                                      )
+            self._parser.add_argument('--model-cache-size',
+                                      type=int,
+                                      required=False,
+                                      default=32,
+                                      help='number of deserialized models '
+                                           'kept in memory (0 disables '
+                                           'caching)',
+                                      )
             self._parser.add_argument('--models',
                                       type=str,
                                       required=False,
@@ -90,3 +176,87 @@ class Parser(object):
                                       default=5000,
                                       help='the port that StateService listens to',
                                       )
+            self._parser.add_argument('--prediction-workers',
+                                      type=int,
+                                      required=False,
+                                      default=0,
+                                      help='number of processes that run '
+                                           'model inference (0 runs models '
+                                           'in the serving process)',
+                                      )
+            self._parser.add_argument('--preload-models',
+                                      action='store_true',
+                                      default=False,
+                                      help='load every model at startup; '
+                                           'GET /ready reports 503 until '
+                                           'models are loaded',
+                                      )
+            self._parser.add_argument('--profile-dir',
+                                      type=str,
+                                      required=False,
+                                      help='directory that profiles are '
+                                           'written to; enables SIGUSR2',
+                                      )
+            self._parser.add_argument('--profile-token-file',
+                                      type=str,
+                                      required=False,
+                                      help='file holding a token; with '
+                                           '--profile-dir, enables POST '
+                                           '/profile from loopback clients '
+                                           'that send it in the '
+                                           'X-Profile-Token header',
+                                      )
+            self._parser.add_argument('--retry-jitter',
+                                      type=float,
+                                      required=False,
+                                      default=0,
+                                      metavar='SECONDS',
+                                      help='random delay of up to SECONDS '
+                                           'added to Retry-After, so that '
+                                           'clients do not retry at once',
+                                      )
+            self._parser.add_argument('--snapshot-format',
+                                      type=str,
+                                      required=False,
+                                      choices=['yaml', 'json', 'binary'],
+                                      default='yaml',
+                                      help='format of snapshots of the state '
+                                           'machine; json and binary '
+                                           'snapshots are written next to '
+                                           'the YAML file',
+                                      )
+            self._parser.add_argument('--storage',
+                                      type=str,
+                                      required=False,
+                                      metavar='URL',
+                                      help='store state machines in a '
+                                           'storage backend rather than in '
+                                           'their files, e.g., '
+                                           'sqlite:/path/to/machines.db',
+                                      )
+            self._parser.add_argument('--threaded',
+                                      action='store_true',
+                                      default=False,
+                                      help='serve requests concurrently, so '
+                                           'that predictions can be '
+                                           'coalesced',
+                                      )
+            self._parser.add_argument('--watch-models',
+                                      type=float,
+                                      nargs='?',
+                                      const=2.0,
+                                      default=None,
+                                      metavar='SECONDS',
+                                      help='apply changes to the configuration '
+                                           'and models directories without '
+                                           'restarting (polled every '
+                                           'SECONDS when inotify is not '
+                                           'available)',
+                                      )
+            self._parser.add_argument('--workers',
+                                      type=int,
+                                      required=False,
+                                      default=1,
+                                      help='number of pre-forked processes '
+                                           'that serve requests',
+                                      )
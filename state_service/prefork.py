@@ -0,0 +1,166 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+
+#
+# Copyright (c) Facebook, Inc. and its affiliates.
+#
+# This source code is licensed under the MIT license found in the
+# LICENSE file in the root directory of this source tree.
+#
+
+import logging
+import os
+import signal
+import socket
+
+from werkzeug.serving import make_server
+
+
+class PreforkServer(object):
+    """
+    Serves a WSGI application from several worker processes that share one
+    listening socket.
+
+    The parent process binds the socket and forks the workers, so that
+    anything loaded before `serve` is called (e.g., the state machine and
+    models) is shared by the workers copy-on-write. The parent restarts
+    workers that exit, and stops them when it receives SIGINT or SIGTERM.
+    A worker that receives SIGTERM stops serving, and exits once its
+    finalizer returns.
+    """
+
+    BACKLOG = 128
+
+    def __init__(self, app, host, port, workers, initializer=None,
+                 finalizer=None):
+        """
+        Args:
+            app (callable): The WSGI application
+            host (str): The host to listen on
+            port (int): The port to listen on
+            workers (int): The number of worker processes
+            initializer (callable): Called in each worker before it serves
+                requests, e.g., to start threads, which do not survive
+                `fork`
+            finalizer (callable): Called in each worker before it exits,
+                e.g., to flush pending writes
+        """
+        self._app = app
+        self._finalizer = finalizer
+        self._host = host
+        self._initializer = initializer
+        self._logger = None
+        self._port = port
+        self._socket = None
+        self._stopping = False
+        self._workers = workers
+        self._worker_pids = set()
+
+    def serve(self):
+        """
+        Forks the workers and waits until the server is stopped.
+        """
+        self._socket = self._bind()
+        signal.signal(signal.SIGINT, self._stop)
+        signal.signal(signal.SIGTERM, self._stop)
+
+        for _ in range(self._workers):
+            self._fork()
+
+        self.logger.info(
+            f'Serving on {self._host}:{self._port} with '
+            f'{self._workers} workers'
+        )
+
+        while self._worker_pids:
+            try:
+                pid, _ = os.wait()
+            except ChildProcessError:
+                break
+            except InterruptedError:
+                continue
+
+            self._worker_pids.discard(pid)
+            if not self._stopping:
+                self.logger.error(f'Worker {pid} exited; restarting it')
+                self._fork()
+
+        self._socket.close()
+
+    @property
+    def logger(self):
+        if self._logger is None:
+            self._logger = logging.getLogger(self.__class__.__name__)
+
+        return self._logger
+
+    @property
+    def worker_pids(self):
+        return set(self._worker_pids)
+
+    def _bind(self):
+        family = socket.AF_INET6 if ':' in self._host else socket.AF_INET
+        sock = socket.socket(family, socket.SOCK_STREAM)
+        sock.setsockopt(socket.SOL_SOCKET, socket.SO_REUSEADDR, 1)
+        sock.bind((self._host, self._port))
+        sock.listen(self.BACKLOG)
+        sock.set_inheritable(True)
+        return sock
+
+    def _fork(self):
+        pid = os.fork()
+        if pid == 0:
+            signal.signal(signal.SIGINT, signal.SIG_DFL)
+            signal.signal(signal.SIGTERM, self._exit_worker)
+            status = 0
+            try:
+                if self._initializer is not None:
+                    self._initializer()
+
+                server = make_server(
+                    self._host, self._port, self._app,
+                    fd=self._socket.fileno(),
+                )
+                server.serve_forever()
+            except Exception:
+                self.logger.exception('Worker failed')
+                status = 1
+            finally:
+                status = self._finalize(status)
+                os._exit(status)
+
+        self._worker_pids.add(pid)
+
+    def _exit_worker(self, signum, frame):
+        #
+        # Leaves `serve_forever`, so that the worker finalizes before it
+        # exits; `os._exit` alone would skip the finalizer.
+        #
+        raise SystemExit(0)
+
+    def _finalize(self, status):
+        """
+        Runs the finalizer in a worker that is exiting.
+
+        Returns:
+            The exit status of the worker
+        """
+        if self._finalizer is None:
+            return status
+
+        signal.signal(signal.SIGTERM, signal.SIG_IGN)
+        try:
+            self._finalizer()
+        except Exception:
+            self.logger.exception('Worker failed to finalize')
+            return 1
+
+        return status
+
+    def _stop(self, signum, frame):
+        self._stopping = True
+        for pid in list(self._worker_pids):
+            try:
+                os.kill(pid, signal.SIGTERM)
+            except ProcessLookupError:
+                self._worker_pids.discard(pid)
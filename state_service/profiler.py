@@ -0,0 +1,204 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+
+#
+# Copyright (c) Facebook, Inc. and its affiliates.
+#
+# This source code is licensed under the MIT license found in the
+# LICENSE file in the root directory of this source tree.
+#
+
+import collections
+import itertools
+import logging
+import os
+import sys
+import threading
+import time
+import weakref
+
+
+class Profiler(object):
+    """
+    Samples the stacks of every thread of the process, for a number of
+    seconds or until a number of requests have been answered, and writes
+    them in the collapsed-stack format of flame graphs (one line per
+    distinct stack, `frame;frame;frame count`), e.g., for flamegraph.pl or
+    speedscope.
+
+    Sampling runs on its own thread, and reads the frames of the other
+    threads without interrupting them, so requests are profiled whichever
+    thread (or event loop) serves them. While the profiler is stopped, it
+    has no thread and costs nothing; while it samples, it costs a few
+    microseconds per thread per interval.
+    """
+
+    DEFAULT_INTERVAL = 0.005
+    DEFAULT_SECONDS = 30.0
+    MAX_SECONDS = 600.0
+
+    def __init__(self, directory, interval=DEFAULT_INTERVAL):
+        """
+        Args:
+            directory (str): The directory that profiles are written to
+            interval (float): Seconds between samples
+        """
+        self._done = None
+        self._interval = interval
+        self._labels = {}
+        self._lock = threading.Lock()
+        self._logger = None
+        self._path = None
+        self._remaining = None
+        self._sequence = itertools.count(1)
+        self._thread = None
+        self.directory = directory
+
+        reference = weakref.ref(self)
+        os.register_at_fork(
+            after_in_child=lambda: reference() and reference()._reset())
+
+    @property
+    def active(self):
+        return self._done is not None
+
+    @property
+    def logger(self):
+        if self._logger is None:
+            self._logger = logging.getLogger(self.__class__.__name__)
+
+        return self._logger
+
+    def count_request(self):
+        """
+        Counts a request that was answered while profiling, and stops
+        profiling after the number of requests that it was started for.
+        """
+        with self._lock:
+            if self._remaining is None:
+                return
+
+            self._remaining -= 1
+            if self._remaining <= 0:
+                self._done.set()
+
+    def start(self, seconds=None, requests=None):
+        """
+        Starts profiling for `seconds`, or until `requests` requests have
+        been answered (at most MAX_SECONDS).
+
+        Returns:
+            The path of the profile that will be written, or None if the
+            profiler is already running
+        """
+        if seconds is None:
+            seconds = self.MAX_SECONDS if requests else self.DEFAULT_SECONDS
+
+        seconds = min(seconds, self.MAX_SECONDS)
+        with self._lock:
+            if self._done is not None:
+                return None
+
+            #
+            # Profiles started within the same second (e.g., of a few
+            # requests each) must not replace one another.
+            #
+            stamp = time.strftime('%Y%m%d-%H%M%S')
+            name = f'profile-{os.getpid()}-{stamp}-{next(self._sequence)}'
+            self._path = os.path.join(self.directory, f'{name}.folded')
+            self._remaining = requests
+            self._done = threading.Event()
+            self._thread = threading.Thread(
+                target=self._run,
+                args=(self._done, self._path, time.monotonic() + seconds),
+                name='Profiler',
+                daemon=True,
+            )
+            self._thread.start()
+            return self._path
+
+    def stop(self):
+        """
+        Stops profiling, and waits for the profile to be written.
+
+        Returns:
+            The path of the profile, or None if the profiler is not running
+        """
+        with self._lock:
+            done, path, thread = self._done, self._path, self._thread
+
+        if done is None:
+            return None
+
+        done.set()
+        thread.join()
+        return path
+
+    def _label(self, code):
+        label = self._labels.get(code)
+        if label is None:
+            label = (
+                f'{code.co_name} '
+                f'({os.path.basename(code.co_filename)}:{code.co_firstlineno})'
+            )
+            self._labels[code] = label
+
+        return label
+
+    def _reset(self):
+        """
+        Forgets a profile that a parent process was writing; the thread
+        that sampled it does not exist in the child.
+        """
+        self._done = None
+        self._lock = threading.Lock()
+        self._remaining = None
+        self._thread = None
+
+    def _run(self, done, path, deadline):
+        stacks = collections.Counter()
+        own = threading.get_ident()
+        while not done.is_set():
+            for thread_id, frame in sys._current_frames().items():
+                if thread_id != own:
+                    stacks[self._stack(frame)] += 1
+
+            remaining = deadline - time.monotonic()
+            if remaining <= 0:
+                break
+
+            done.wait(min(self._interval, remaining))
+
+        try:
+            self._write(path, stacks)
+        except Exception as e:
+            self.logger.exception(f'Unable to write profile {path}: {str(e)}')
+        finally:
+            with self._lock:
+                self._done = None
+                self._remaining = None
+                self._thread = None
+                self._labels.clear()
+
+    def _stack(self, frame):
+        labels = []
+        while frame is not None:
+            labels.append(self._label(frame.f_code))
+            frame = frame.f_back
+
+        return ';'.join(reversed(labels))
+
+    def _write(self, path, stacks):
+        """
+        Writes the profile next to its final path, and then renames it,
+        so that a collector never reads a partial profile.
+        """
+        os.makedirs(self.directory, exist_ok=True)
+        temporary = f'{path}.tmp'
+        with open(temporary, 'w') as f:
+            for stack, count in sorted(stacks.items()):
+                f.write(f'{stack} {count}\n')
+
+        os.replace(temporary, path)
+        self.logger.info(
+            f'Wrote profile {path} ({sum(stacks.values())} samples)')
@@ -0,0 +1,256 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+
+#
+# Copyright (c) Facebook, Inc. and its affiliates.
+#
+# This source code is licensed under the MIT license found in the
+# LICENSE file in the root directory of this source tree.
+#
+
+import heapq
+import itertools
+import logging
+import os
+import threading
+import time
+
+
+class Timer(object):
+    """
+    A call scheduled by TimerScheduler. A cancelled timer stays in the
+    scheduler's heap until it is due or the heap is compacted.
+    """
+
+    __slots__ = ('callback', 'deadline')
+
+    def __init__(self, deadline, callback):
+        self.callback = callback
+        self.deadline = deadline
+
+    @property
+    def cancelled(self):
+        return self.callback is None
+
+
+class TimerScheduler(object):
+    """
+    Calls functions at scheduled times from a single thread, however many
+    calls are pending, e.g., the transitions of asynchronous states of many
+    state machines.
+
+    Timers are kept in a heap of `(deadline, sequence, timer)` tuples,
+    which are compared without calling Python code, so scheduling a timer
+    costs O(log n) and the thread only wakes up when the earliest timer is
+    due (or an earlier one is scheduled). Cancelled timers are removed
+    lazily, and the heap is compacted when most of it is cancelled.
+
+    Callbacks run on the scheduler's thread, one at a time, so they should
+    not block for long.
+    """
+
+    #
+    # The thread wakes up at least this often, so that deadlines far in the
+    # future do not overflow the timeout of `Condition.wait`.
+    #
+    MAX_WAIT = 3600.0
+
+    def __init__(self):
+        self._cancelled = 0
+        self._condition = threading.Condition()
+        self._heap = []
+        self._logger = None
+        self._sequence = itertools.count()
+        self._stopped = False
+        self._thread = None
+
+    def cancel(self, timer):
+        self.cancel_many([timer])
+
+    def cancel_many(self, timers):
+        """
+        Cancels timers; cancelling a timer that already ran is harmless.
+        """
+        with self._condition:
+            for timer in timers:
+                if timer is not None and not timer.cancelled:
+                    timer.callback = None
+                    self._cancelled += 1
+
+            if self._cancelled > len(self._heap) // 2:
+                self._compact()
+
+    def close(self):
+        """
+        Stops the thread. Pending timers are discarded.
+        """
+        with self._condition:
+            self._stopped = True
+            self._heap = []
+            self._cancelled = 0
+            self._condition.notify()
+            thread, self._thread = self._thread, None
+
+        if thread is not None and thread is not threading.current_thread():
+            thread.join()
+
+    def schedule(self, delay, callback):
+        """
+        Calls `callback` after `delay` seconds.
+
+        Returns:
+            Timer: A timer that can be cancelled
+        """
+        return self.schedule_many([(delay, callback)])[0]
+
+    def schedule_many(self, calls):
+        """
+        Schedules many calls at once.
+
+        Args:
+            calls (list): `(delay, callback)` pairs
+
+        Returns:
+            list: A timer for each call
+        """
+        now = time.monotonic()
+
+        with self._condition:
+            self._start()
+            head = self._heap[0] if self._heap else None
+            timers = [Timer(now + delay, callback) for delay, callback in calls]
+            entries = [
+                (timer.deadline, next(self._sequence), timer)
+                for timer in timers
+            ]
+
+            #
+            # Pushing timers one at a time costs O(k log n); rebuilding the
+            # heap costs O(n + k), which is cheaper for large batches.
+            #
+            if len(entries) > len(self._heap) // 4:
+                self._heap.extend(entries)
+                heapq.heapify(self._heap)
+            else:
+                for entry in entries:
+                    heapq.heappush(self._heap, entry)
+
+            #
+            # The thread only needs to wake up when the earliest timer
+            # changed.
+            #
+            if self._heap and self._heap[0] is not head:
+                self._condition.notify()
+
+        return timers
+
+    def __len__(self):
+        """
+        Returns the number of pending timers.
+        """
+        with self._condition:
+            return len(self._heap) - self._cancelled
+
+    @property
+    def logger(self):
+        if self._logger is None:
+            self._logger = logging.getLogger(self.__class__.__name__)
+
+        return self._logger
+
+    def _compact(self):
+        self._heap = [entry for entry in self._heap if not entry[2].cancelled]
+        heapq.heapify(self._heap)
+        self._cancelled = 0
+
+    def _run(self):
+        while True:
+            with self._condition:
+                callback = self._next()
+                if callback is None:
+                    return
+
+            try:
+                callback()
+            except Exception as e:
+                self.logger.exception(f'Timer failed: {str(e)}')
+
+    def _next(self):
+        """
+        Waits for the earliest timer to be due and removes it from the
+        heap. Must be called with the condition.
+
+        Returns:
+            The callback of the due timer, or None if the scheduler was
+            stopped
+        """
+        while not self._stopped:
+            if not self._heap:
+                self._condition.wait()
+                continue
+
+            deadline, _, timer = self._heap[0]
+            if timer.cancelled:
+                heapq.heappop(self._heap)
+                self._cancelled -= 1
+                continue
+
+            delay = deadline - time.monotonic()
+            if delay > 0:
+                self._condition.wait(min(delay, self.MAX_WAIT))
+                continue
+
+            #
+            # A timer that ran counts as cancelled, so that cancelling it
+            # afterwards is a no-op.
+            #
+            heapq.heappop(self._heap)
+            callback, timer.callback = timer.callback, None
+            return callback
+
+        return None
+
+    def _reset(self):
+        """
+        Discards the thread and the timers of the parent process in a
+        forked process; the parent keeps running its timers.
+        """
+        self._cancelled = 0
+        self._condition = threading.Condition()
+        self._heap = []
+        self._thread = None
+
+    def _start(self):
+        if self._thread is None:
+            self._stopped = False
+            self._thread = threading.Thread(target=self._run, daemon=True)
+            self._thread.start()
+
+
+_scheduler = None
+_scheduler_lock = threading.Lock()
+
+
+def get_scheduler():
+    """
+    Returns the scheduler that is shared by every state machine of the
+    process.
+    """
+    global _scheduler
+
+    with _scheduler_lock:
+        if _scheduler is None:
+            _scheduler = TimerScheduler()
+
+        return _scheduler
+
+
+def _reset_after_fork():
+    global _scheduler_lock
+
+    _scheduler_lock = threading.Lock()
+    if _scheduler is not None:
+        _scheduler._reset()
+
+
+os.register_at_fork(after_in_child=_reset_after_fork)
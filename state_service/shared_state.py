@@ -0,0 +1,59 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+
+#
+# Copyright (c) Facebook, Inc. and its affiliates.
+#
+# This source code is licensed under the MIT license found in the
+# LICENSE file in the root directory of this source tree.
+#
+
+import multiprocessing
+
+
+class SharedState(object):
+    """
+    Stores the mutable part of a state machine (the index of the current
+    state and the counter of each state) in shared memory, so that worker
+    processes forked from one parent have a single, consistent view of the
+    state machine.
+
+    Every write stores the version of the state machine. Readers compare
+    the version with the version they last read, and only read the state
+    machine (while holding the lock) when it changed.
+    """
+
+    def __init__(self, size):
+        """
+        Args:
+            size (int): Number of states in the state machine
+        """
+        context = multiprocessing.get_context('fork')
+        self._counters = context.RawArray('q', size)
+        self._current = context.RawValue('q', 0)
+        self._lock = context.RLock()
+        self._version = context.RawValue('Q', 0)
+
+    def read(self):
+        """
+        Returns the version, the index of the current state and the
+        counters of the state machine. Must be called with the lock.
+        """
+        return self._version.value, self._current.value, self._counters[:]
+
+    def write(self, version, current, counters):
+        """
+        Stores the version, the index of the current state and the counters
+        of the state machine. Must be called with the lock.
+        """
+        self._counters[:] = counters
+        self._current.value = current
+        self._version.value = version
+
+    @property
+    def lock(self):
+        return self._lock
+
+    @property
+    def version(self):
+        return self._version.value
@@ -9,8 +9,10 @@
 #
 
 import logging
+import sys
 import threading
 
+from collections.abc import Mapping
 from datetime import datetime
 from enum import Enum
 
@@ -20,34 +22,91 @@ class Action(Enum):
     TIME = 'time'
 
 
-class StateData(dict):
+class Criterion(object):
     """
-    Represents a nested `dict` in a State.
+    A key and a value that a state compares, e.g., the target value of an
+    `increment` state or the transition time of a `time` state. Criteria
+    are part of the definition of a state, so they are immutable.
+    """
+
+    __slots__ = ('key', 'value')
+
+    def __init__(self, key, value):
+        object.__setattr__(self, 'key', key)
+        object.__setattr__(self, 'value', value)
+
+    def to_dict(self):
+        return {'key': self.key, 'value': self.value}
+
+    def __eq__(self, other):
+        if isinstance(other, Mapping):
+            return self.to_dict() == other
+
+        if isinstance(other, Criterion):
+            return (self.key, self.value) == (other.key, other.value)
+
+        return NotImplemented
 
-    This is used to avoid using `State` to describe nested
-    `dict`s, which would add the properties of State to
-    nested states, e.g., `is_end_state`. These properties
-    only have meaning when describing a `State` object.
+    def __hash__(self):
+        return hash((self.key, self.value))
+
+    def __repr__(self):
+        return f'{self.__class__.__name__}({self.key!r}, {self.value!r})'
+
+    def __setattr__(self, key, value):
+        raise AttributeError(f'{self.__class__.__name__} is immutable')
+
+
+class Counter(object):
+    """
+    The current value of an `increment` state, which changes with every
+    update, and is kept apart from the state's definition.
     """
 
-    def __init__(self, data):
-        super(StateData, self).__init__(data)
+    __slots__ = ('key', 'value')
 
-        for key in self:
-            value = self[key]
-            if isinstance(value, list):
-                for index, item in enumerate(value):
-                    if isinstance(item, dict):
-                        value[index] = StateData(item)
+    def __init__(self, key, value):
+        self.key = key
+        self.value = value
 
-            elif isinstance(value, dict):
-                self[key] = StateData(value)
+    def to_dict(self):
+        return {'key': self.key, 'value': self.value}
 
-    def __getattr__(self, key):
-        return self[key]
+    def __eq__(self, other):
+        if isinstance(other, Mapping):
+            return self.to_dict() == other
 
+        if isinstance(other, Counter):
+            return (self.key, self.value) == (other.key, other.value)
 
-class State(dict):
+        return NotImplemented
+
+    __hash__ = None
+
+    def __repr__(self):
+        return f'{self.__class__.__name__}({self.key!r}, {self.value!r})'
+
+
+class Target(object):
+    """
+    The state that a state transitions to, and the criterion for the
+    transition.
+    """
+
+    __slots__ = ('name', 'when')
+
+    def __init__(self, name, when):
+        object.__setattr__(self, 'name', name)
+        object.__setattr__(self, 'when', when)
+
+    def __repr__(self):
+        return f'{self.__class__.__name__}({self.name!r}, {self.when!r})'
+
+    def __setattr__(self, key, value):
+        raise AttributeError(f'{self.__class__.__name__} is immutable')
+
+
+class State(object):
     """
     Represents a state, including when the state should transition to
     another state.
@@ -68,36 +127,63 @@ class State(dict):
     A state that does not provide an action is determined to be the final or
     end state.
 
-    State subclasses `dict` and overrides the `__init__` method to provide
-    'dot' method accessors for the `dict`'s keys.
+    A state is built from its definition (a `dict` read from the state
+    machine's file) and written back with `to_dict`. States use slots
+    rather than `dict`s, so that state machines with many states fit in
+    little memory: the definition (name, action and target) is immutable,
+    and the counter of an `increment` state is the only mutable part.
+    Accessing the `current` or `target` of a state that has none raises
+    KeyError, as accessing the key of its definition does.
     """
 
+    __slots__ = (
+        '_current',
+        '_delegate',
+        '_did_enter_state',
+        '_func',
+        '_lock',
+        '_logger',
+        '_target',
+        '_transition_time',
+        'name',
+    )
+
     DATE_FORMAT = '%Y-%m-%dT%H:%M:%S'
 
     def __init__(self, data):
-        super(State, self).__init__(data)
-
+        self._current = None
+        self._delegate = None
         self._did_enter_state = False
-        self._lock = threading.Lock()
+        self._func = None
+        self._lock = None
         self._logger = None
+        self._target = None
         self._transition_time = None
+        self.name = data['name']
 
-        for key in self:
-            value = self[key]
-            if isinstance(value, list):
-                for index, item in enumerate(value):
-                    if isinstance(item, dict):
-                        value[index] = State(item)
+        func = data.get('func')
+        if func is not None:
+            self._func = sys.intern(func)
 
-            elif isinstance(value, dict):
-                self[key] = StateData(value)
+        target = data.get('target')
+        if target is not None:
+            when = target['when']
+            self._target = Target(
+                target['name'],
+                Criterion(sys.intern(when['key']), when['value']),
+            )
+
+        current = data.get('current')
+        if current is not None:
+            self._current = Counter(
+                sys.intern(current['key']), current['value'])
 
     def increment(self):
         """
         Increments the current state's value and attempts to transition
         to the state's target state.
         """
-        self.current.value += 1
+        self._count()
         self.transition()
 
     def time(self):
@@ -112,8 +198,7 @@ class State(dict):
         Represents the State instance as a `dict`.
 
         An asynchronous state does not have a `current` key and
-        a normal state does. We deal with each case separately
-        and avoid overriding `__getattr__` with exception handling.
+        a normal state does, so we deal with each case separately.
 
         Returns:
             - A `dict` representing the latest state
@@ -128,21 +213,22 @@ class State(dict):
             'func': self.action,
             'target': {
                 'name': self.target.name,
-                'when': {
-                    'key': self.target.when.key,
-                    'value': self.target.when.value,
-                },
+                'when': self.target.when.to_dict(),
             },
         }
 
         if not self.is_async:
-            value['current'] = {
-                'key': self.current.key,
-                'value': self.current.value,
-            }
+            value['current'] = self.current.to_dict()
 
         return value
 
+    def time_to_transition(self):
+        """
+        Returns the seconds until an asynchronous state can transition to
+        its target state, which are negative once it can.
+        """
+        return (self.transition_time - self._now()).total_seconds()
+
     def transition(self):
         """
         Transitions from the current state to the its target state.
@@ -163,15 +249,37 @@ class State(dict):
             True if the action was successful
             False otherwise
         """
-        func = getattr(self, self.action)
-        func()
+        action = self.ACTIONS[self.action]
+        if action is not None:
+            action(self)
+
+        self.transition()
 
     @property
     def action(self):
         """
         Returns the action to perform when updating the state.
+
+        Raises:
+            - KeyError if the state is an end state
+        """
+        if self._func is None:
+            raise KeyError('func')
+
+        return self._func
+
+    @property
+    def current(self):
+        """
+        Returns the counter of an `increment` state.
+
+        Raises:
+            - KeyError if the state has no counter
         """
-        return self.func
+        if self._current is None:
+            raise KeyError('current')
+
+        return self._current
 
     @property
     def delegate(self):
@@ -190,7 +298,7 @@ class State(dict):
 
     @property
     def is_async(self):
-        return self.action == Action.TIME.value
+        return self._func == Action.TIME.value
 
     @property
     def is_end_state(self):
@@ -200,15 +308,17 @@ class State(dict):
         For end states, no action is defined, so calling it
         will raise an error.
         """
-        try:
-            self.action
-        except KeyError:
-            return True
-
-        return False
+        return self._func is None
 
     @property
     def lock(self):
+        #
+        # Only states that transition need a lock, so it is created by the
+        # first transition.
+        #
+        if self._lock is None:
+            self._lock = threading.Lock()
+
         return self._lock
 
     @property
@@ -218,6 +328,19 @@ class State(dict):
 
         return self._logger
 
+    @property
+    def target(self):
+        """
+        Returns the target of the state.
+
+        Raises:
+            - KeyError if the state is an end state
+        """
+        if self._target is None:
+            raise KeyError('target')
+
+        return self._target
+
     @property
     def transition_time(self):
         if self._transition_time is None:
@@ -239,15 +362,14 @@ class State(dict):
             For time action, if the value associated with the current state
             is before the value associated with the target state.
         """
+        guard = self.GUARDS.get(self._func)
+        return guard is not None and guard(self)
 
-        if self.action == Action.INCREMENT.value:
-            return self.current.value == self.target.when.value
-        elif self.action == Action.TIME.value:
-            now = self._now()
-            then = self.transition_time
-            return then < now
+    def _count(self):
+        self._current.value += 1
 
-        return False
+    def _counted(self):
+        return self._current.value == self._target.when.value
 
     def _enter_state(self):
         new_state_name = self.target.name
@@ -259,5 +381,22 @@ class State(dict):
     def _now(self):
         return datetime.now()
 
-    def __getattr__(self, key):
-        return self[key]
+    def _timed_out(self):
+        return self.transition_time < self._now()
+
+    def __repr__(self):
+        return f'{self.__class__.__name__}({self.name!r})'
+
+
+#
+# What each action does to a state when it is updated (None for nothing),
+# and the guard that decides whether the state then transitions.
+#
+State.ACTIONS = {
+    Action.INCREMENT.value: State._count,
+    Action.TIME.value: None,
+}
+State.GUARDS = {
+    Action.INCREMENT.value: State._counted,
+    Action.TIME.value: State._timed_out,
+}
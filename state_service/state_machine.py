@@ -8,27 +8,40 @@
 # LICENSE file in the root directory of this source tree.
 #
 
+import contextlib
+import hashlib
 import os
 import json
 import logging
 import pickle
 import threading
-import yaml
+import time
 
+from concurrent.futures import ThreadPoolExecutor
 from datetime import datetime
 
+from . import durability
+from . import metrics
+from . import model_format
+from .coalescer import PredictionCoalescer
+from .durability import Flusher
+from .durability import GroupCommit
+from .events import EventPublisher
+from .executor import PredictionExecutor
+from .journal import Journal
+from .machine_codec import JsonCodec
+from .machine_codec import get_codec
+from .machine_codec import YamlCodec
+from .ml_modules import load_frameworks
+from .model_cache import ModelCache
+from .scheduler import get_scheduler
+from .shared_state import SharedState
 from .state import State
 from .state_delegate import StateDelegate
-
-#
-# Import all ML libraries that the _deserialize_model method will
-# require.
-#
-# One file (ml_modules.py) is used to list all models, so that
-# edits to the main codebase are minimized and duplicate imports
-# are avoided.
-#
-from .ml_modules import *  # noqa: F401,F403
+from .storage import get_storage
+from .storage import release_storage
+from .transition_table import TransitionTable
+from .watcher import ModelWatcher
 
 
 class StateMachine(StateDelegate):
@@ -38,75 +51,386 @@ class StateMachine(StateDelegate):
 
     When configured with an explicit state machine, StateMachine updates
     the current state. When the explicit state machine is asynchronous
-    (scheduled), StateMachine stops and starts a `threaded.Timer` instance
-    to schedule updating the current state. StateMachine also persists the
-    state machine to file storage after every update.
+    (scheduled), StateMachine schedules updating the current state with
+    the timer scheduler that all state machines of the process share.
+    StateMachine also persists the state machine to file storage after
+    every update, either by rewriting the state machine or by appending
+    the update to a journal.
 
     When configured as an implicit state machine, StateMachine predicts the
     state of an application or machine using ML models that it hosts.
     """
 
+    DEFAULT_JOURNAL_SIZE = 1 << 20
+    POLL_INTERVAL = 1.0
+
     def __init__(self, options):
+        self._coalescer = None
+        self._compacting = threading.Lock()
+        self._config_files = {}
         self._current_state = None
+        self._current_index = None
         self._current_state_name = None
+        self._dirty_state_names = set()
+        self._codec = None
+        self._events = None
+        self._executor = None
+        self._executor_lock = threading.Lock()
+        self._flusher = None
+        self._group_commit = None
+        self._group_pending = False
+        self._journal = None
         self._lock = threading.Lock()
         self._logger = None
         self._machine = None
+        self._model_cache = None
         self._models = None
+        self._models_lock = threading.Lock()
+        self._observers = []
         self._options = options
+        self._pending_records = []
+        self._persist_lock = threading.Lock()
+        self._scheduler = None
+        self._shared = None
+        self._source_digest = None
+        self._state_changed = threading.Condition()
         self._states = None
-        self._thread_state = None
+        self._storage = None
+        self._table = None
+        self._timer = None
+        self._transaction_depth = 0
+        self._transaction_lock = threading.RLock()
+        self._transaction_owner = None
+        self._version = 0
+        self._watcher = None
 
     def build(self):
         """
         Transforms a state machine in YAML format to a list of
         State objects and identifies the name of the current state.
 
+        The states are compiled into a transition table, which rejects
+        invalid state machines (see `TransitionTable`) before they are
+        served.
+
         If the state machine is asynchronous, the state machine
         begins waiting for the current state to transition.
+
+        Raises:
+            - RuntimeError if the state machine is invalid
         """
         if self._machine is None:
-            self._machine = self._read_machine()
-            self._states = {}
-            self._current_state_name = self.machine['current_state']
-            self._states = self._create(self.machine['states'])
+            machine = self._load_machine()
+            self._table = TransitionTable(self._create(machine['states']))
+            self._states = dict(zip(self._table.names, self._table.states))
+            self._set_current(self._table.index(machine['current_state']))
+            self._version = machine.get('version', 0)
+            self._machine = machine
+
+            if self.storage is None and self.journal is not None:
+                self._replay()
 
             if self.is_async:
                 self._start_timer()
 
+    def add_observer(self, observer):
+        """
+        Calls `observer` with the name of the current state whenever the
+        current state changes, including changes made by other processes
+        that share the state machine (when they are read). Observers are
+        called while the state machine is updated, so they must not block.
+        """
+        with self._state_changed:
+            self._observers = self._observers + [observer]
+
     def is_current_state(self, name):
+        self._sync()
         return self._current_state_name == name
 
-    def predict(self, model_name, values):
+    def remove_observer(self, observer):
+        with self._state_changed:
+            self._observers = [o for o in self._observers if o != observer]
+
+    def wait_for_state(self, name, timeout):
+        """
+        Waits until `name` is the current state, or `timeout` seconds.
+
+        State machines that other processes update are read again every
+        `POLL_INTERVAL` seconds while waiting.
+
+        Returns:
+            True if `name` is the current state
+        """
+        deadline = time.monotonic() + timeout
+
+        #
+        # The condition is not held while reading a shared state machine,
+        # since updates notify the condition while holding the shared lock.
+        #
+        while not self.is_current_state(name):
+            remaining = deadline - time.monotonic()
+            if remaining <= 0:
+                return False
+
+            if self.is_shared:
+                remaining = min(remaining, self.POLL_INTERVAL)
+
+            with self._state_changed:
+                if self._current_state_name != name:
+                    self._state_changed.wait(remaining)
+
+        return True
+
+    def predict(self, model_name, values, coalesce=True):
         """
         Predicts the state of a machine using a hosted model.
 
         Args:
             model_name (str): Name of a model to deserialize
             values (list): Values that will be used as inputs to the model
+            coalesce (bool): Whether to merge the prediction with
+                concurrent ones if the model's configuration asks to; False
+                when there cannot be concurrent predictions, which the
+                coalescing window would only delay
 
         Returns:
             list: The predicted state of the machine
         """
+        start = time.perf_counter()
+        try:
+            conf = self.models[model_name]
+            settings = conf.get('coalesce')
+
+            if coalesce and settings is not None:
+                window = settings.get(
+                    'window_ms', PredictionCoalescer.DEFAULT_WINDOW * 1000)
+                max_batch_size = settings.get(
+                    'max_batch_size',
+                    PredictionCoalescer.DEFAULT_MAX_BATCH_SIZE,
+                )
+                return self.coalescer.predict(
+                    model_name, self._rows(values),
+                    window=window / 1000, max_batch_size=max_batch_size,
+                )
+
+            return self._predict(model_name, values)
+        finally:
+            self._observe_prediction(model_name, start)
+
+    def predict_batch(self, model_name, rows):
+        """
+        Predicts the states of many machines with a single call to a
+        hosted model's `predict` method.
+
+        Args:
+            model_name (str): Name of a model to deserialize
+            rows (list): One row of values per machine
+
+        Returns:
+            list: The predicted state of each machine, in the order of `rows`
+        """
+        start = time.perf_counter()
+        try:
+            states = self._predict(model_name, rows)
+        finally:
+            self._observe_prediction(model_name, start)
+
+        if len(states) != len(rows):
+            raise RuntimeError(
+                f'{model_name} returned {len(states)} predictions for '
+                f'{len(rows)} rows'
+            )
+
+        return states
+
+    def preload(self):
+        """
+        Deserializes every configured model concurrently, and warms up each
+        model that declares a `warmup` sample in its configuration.
+
+        Models are loaded in the worker processes that serve them when
+        inference runs in worker processes.
+
+        Returns:
+            dict: An error message for each model that failed to load
+        """
+        names = list(self.models)
+        if self.executor is not None:
+            futures = {name: self.executor.preload(name) for name in names}
+        else:
+            with ThreadPoolExecutor() as pool:
+                futures = {
+                    name: pool.submit(self.preload_model, name)
+                    for name in names
+                }
+
+        errors = {}
+        for name, future in futures.items():
+            try:
+                future.result()
+            except Exception as e:
+                self.logger.exception(f'Unable to preload {name}: {str(e)}')
+                errors[name] = str(e)
+
+        return errors
+
+    def preload_model(self, model_name):
+        """
+        Deserializes a model and, if its configuration declares a `warmup`
+        sample, predicts the state of the sample.
+        """
         conf = self.models[model_name]
         team, model = conf['team'], conf['model']
-        deserialized_model = self._deserialize_model(team, model)
+        self._load_model(team, model, conf.get('framework'))
 
-        if deserialized_model is None:
-            raise RuntimeError(f'No model is available for {team}/{model}.pkl')
+        warmup = conf.get('warmup')
+        if warmup is not None:
+            self._predict(model_name, self._rows(warmup))
 
-        prediction = deserialized_model.predict(values)
-        return [conf['states'][i] for i in prediction]
+    def reload_models(self):
+        """
+        Applies changes to the configuration directory and to the
+        serialized models that are cached.
+
+        Only configuration files whose modification time or size changed
+        are parsed again. The new set of models replaces the old one
+        atomically, so predictions in progress are not interrupted.
+
+        Returns:
+            dict: The names of models that were `added`, `changed` or
+            `removed`
+
+        Raises:
+            - RuntimeError if a configuration file is not valid
+        """
+        with self._models_lock:
+            config_files = {}
+            for entry in os.scandir(self._config_path()):
+                name, ext = os.path.splitext(entry.name)
+                if ext.lower() != '.json':
+                    continue
+
+                stat = entry.stat()
+                signature = (stat.st_mtime_ns, stat.st_size)
+                previous = self._config_files.get(entry.path)
+                if previous is not None and previous[0] == signature:
+                    config_files[entry.path] = previous
+                else:
+                    config_files[entry.path] = (
+                        signature, self._read_config(entry.path))
+
+            models = {conf['name']: conf for _, conf in config_files.values()}
+            previous_models = self._models or {}
+
+            changes = {
+                'added': sorted(models.keys() - previous_models.keys()),
+                'changed': sorted(
+                    name for name in models.keys() & previous_models.keys()
+                    if models[name] != previous_models[name]
+                    or self._refresh_model(models[name])
+                ),
+                'removed': sorted(previous_models.keys() - models.keys()),
+            }
+
+            self._config_files = config_files
+            self._models = models
+
+        return changes
+
+    def close(self):
+        """
+        Writes pending updates and stops background threads.
+        """
+        if self._flusher is not None:
+            self._flusher.close()
+
+        if self._watcher is not None:
+            self._watcher.stop()
+
+        if self._executor is not None:
+            self._executor.shutdown()
+
+        if self._timer is not None:
+            self.scheduler.cancel(self._timer)
+
+        if self._journal is not None:
+            self._journal.close()
+
+        if self._storage is not None:
+            release_storage(self._storage)
+            self._storage = None
+
+    def compact(self):
+        """
+        Writes a snapshot of the state machine and discards the records of
+        the journal that the snapshot includes.
+
+        Updates are not written while the journal is compacted.
+        """
+        sync = self._durability() != durability.NONE
+
+        with self._persisting():
+            self._sync()
+            with self.lock:
+                data = self._snapshot()
+
+            offset = self.journal.size
+            self._write_machine(data, sync=sync, compiled=True)
+            self.journal.discard(offset, sync=sync)
 
+    @metrics.timed(metrics.SAVE_SECONDS)
     def save(self):
-        states_as_dict = [state.to_dict() for state in list(self.states.values())]
-        data = {
-            'current_state': self._current_state_name,
-            'states': states_as_dict,
-        }
+        """
+        Persists the state machine.
 
-        with self.lock:
-            self._write_machine(data)
+        With a storage backend, the changes since the last save are
+        stored in it; with a journal, they are appended to the journal;
+        otherwise, the state machine is written to its file.
+
+        How the state machine is persisted depends on its durability mode:
+        `none` and `sync` write the state machine before returning (`sync`
+        also flushes it to disk), `group` flushes the changes of concurrent
+        saves together before returning, and `async` returns immediately
+        and flushes changes in the background.
+
+        In `group` mode, a save made in a transaction (e.g., by `update`)
+        waits for the flush once the transaction ends.
+        """
+        if self.storage is not None or self.journal is not None:
+            record = {
+                'version': self._version,
+                'current_state': self._current_state_name,
+                'values': {
+                    name: self.states[name].current.value
+                    for name in self._dirty_state_names
+                },
+            }
+            self._dirty_state_names.clear()
+
+            with self.lock:
+                self._pending_records.append(record)
+
+        #
+        # A shared state machine (or one in a storage backend) is updated
+        # under a lock that all processes share, so no other update can
+        # join a group; it is flushed as in `sync` mode.
+        #
+        mode = self._durability()
+        if mode == durability.ASYNC:
+            self.flusher.notify()
+        elif mode == durability.GROUP and self._shared is None and \
+                self.storage is None:
+            #
+            # Other updates cannot join the group while this thread holds
+            # the transaction lock, so the transaction waits for the flush
+            # once it releases the lock.
+            #
+            if self._transaction_owner == threading.get_ident():
+                self._group_pending = True
+            else:
+                self.group_commit.commit()
+        else:
+            self._persist()
 
     def update(self):
         """
@@ -121,23 +445,222 @@ class StateMachine(StateDelegate):
               transitioned to its target state
             - False otherwise
         """
-        self.current_state.update()
-        self.save()
+        with self.transaction():
+            self._sync()
+            index = self._current_index
+            state = self._table.states[index]
+            target = self._table.update(index)
+            if target != index:
+                self._enter(target)
+
+            self._version += 1
+            if not self._table.is_async[index]:
+                self._dirty_state_names.add(state.name)
+            self.save()
+
+            if self._events is not None:
+                self._publish(state)
 
         if not self.did_end and self.is_async:
             self._start_timer()
 
+    def time_to_transition(self):
+        """
+        Returns the seconds until the current state transitions on its own,
+        or None if only updates can change it, i.e., when it is not
+        asynchronous.
+        """
+        state = self.current_state
+        if state.is_end_state or not state.is_async:
+            return None
+
+        return max(0.0, state.time_to_transition())
+
+    def share(self):
+        """
+        Moves the current state and the counters of the state machine to
+        shared memory, so that processes forked afterwards share a single
+        view of the state machine.
+        """
+        if self._shared is None:
+            shared = SharedState(len(self._table))
+            with shared.lock:
+                shared.write(self._version, *self._shared_values())
+
+            self._shared = shared
+
+    @contextlib.contextmanager
+    def transaction(self):
+        """
+        Holds the lock of the state machine, so that threads that check
+        and update it (e.g., with --threaded or --asgi) do not interleave.
+        Transactions may be nested.
+
+        When the state machine is shared between processes, also holds the
+        lock of the shared state machine, reads the latest state before the
+        block and publishes changes made by the block.
+
+        With a storage backend, also holds the storage's lock and reads the
+        stored state machine if another process updated it.
+
+        In `group` durability mode, the updates of a transaction are
+        flushed once the outermost transaction releases the lock, so that
+        concurrent updates can join the same group.
+        """
+        start = time.perf_counter()
+        with self._transaction_lock:
+            self._lock_acquired('machine', start)
+            self._transaction_depth += 1
+            self._transaction_owner = threading.get_ident()
+            try:
+                with self._process_transaction():
+                    yield
+            finally:
+                self._transaction_depth -= 1
+                commit = self._transaction_depth == 0 and self._group_pending
+                if self._transaction_depth == 0:
+                    self._group_pending = False
+                    self._transaction_owner = None
+
+        if commit:
+            self.group_commit.commit()
+
+    def watch_models(self, interval=ModelWatcher.DEFAULT_INTERVAL):
+        """
+        Starts applying changes to the configuration and models
+        directories in the background.
+        """
+        if self._watcher is None:
+            self.models
+            paths = [self._config_path(), self._models_path()]
+            paths = [path for path in paths if path]
+            self._watcher = ModelWatcher(self, paths, interval)
+            self._watcher.start()
+
+    @property
+    def coalescer(self):
+        if self._coalescer is None:
+            self._coalescer = PredictionCoalescer(self._predict)
+
+        return self._coalescer
+
     @property
     def current_state(self):
-        return self.states[self._current_state_name]
+        self._sync()
+        return self._table.states[self._current_index]
 
     @property
     def did_end(self):
-        return self.current_state.is_end_state
+        self._sync()
+        return self._table.is_end[self._current_index]
+
+    @property
+    def codec(self):
+        """
+        Returns the codec in which snapshots of the state machine are
+        written.
+        """
+        if self._codec is None:
+            name = getattr(self._options, 'snapshot_format', None)
+            self._codec = get_codec(name or YamlCodec.name)
+
+        return self._codec
+
+    @property
+    def executor(self):
+        """
+        Returns the pool of processes that runs model inference, or None
+        when models are run in this process.
+        """
+        if self._executor is None:
+            workers = self._prediction_workers()
+            if workers > 0:
+                #
+                # Concurrent first predictions would otherwise each start
+                # a pool, and leak the worker processes of all but one.
+                #
+                with self._executor_lock:
+                    if self._executor is None:
+                        self._executor = PredictionExecutor(
+                            workers, type(self), self._options)
+
+        return self._executor
+
+    @property
+    def flusher(self):
+        if self._flusher is None:
+            self._flusher = Flusher(self._persist, self._durability_window(
+                Flusher.DEFAULT_INTERVAL))
+
+        return self._flusher
+
+    @property
+    def scheduler(self):
+        if self._scheduler is None:
+            self._scheduler = get_scheduler()
+
+        return self._scheduler
+
+    @property
+    def storage(self):
+        """
+        Returns the storage backend of the state machine, or None when the
+        state machine is stored in its file.
+        """
+        if self._storage is None:
+            url = getattr(self._options, 'storage', None)
+            if url:
+                self._storage = get_storage(url)
+
+        return self._storage
+
+    @property
+    def events(self):
+        """
+        Returns the publisher of the updates and transitions of the state
+        machine, which is created by the first subscriber.
+        """
+        if self._events is None:
+            self._events = EventPublisher(
+                getattr(self._options, 'event_buffer', None) or
+                EventPublisher.DEFAULT_SIZE
+            )
+
+        return self._events
+
+    @property
+    def group_commit(self):
+        if self._group_commit is None:
+            self._group_commit = GroupCommit(
+                self._persist, self._durability_window(
+                    GroupCommit.DEFAULT_WINDOW))
+
+        return self._group_commit
+
+    @property
+    def is_shared(self):
+        """
+        Returns True if other processes may update the state machine.
+        """
+        return self._shared is not None or self.storage is not None
 
     @property
     def is_async(self):
-        return self.current_state.is_async
+        self._sync()
+        return self._table.is_async[self._current_index]
+
+    @property
+    def journal(self):
+        """
+        Returns the journal of updates to the state machine, or None when
+        the state machine is rewritten after every update.
+        """
+        if self._journal is None:
+            path = getattr(self._options, 'journal', None)
+            if path:
+                self._journal = Journal(path)
+
+        return self._journal
 
     @property
     def lock(self):
@@ -155,33 +678,19 @@ class StateMachine(StateDelegate):
         return self._machine
 
     @property
-    def models(self):
-        if self._models is None:
-            self._models = {}
+    def model_cache(self):
+        if self._model_cache is None:
+            self._model_cache = ModelCache(
+                capacity=self._model_cache_size(),
+                use_hash=self._model_cache_hash(),
+            )
 
-            conf_files = []
-            for f in os.listdir(self._config_path()):
-                name, ext = os.path.splitext(f)
-                if ext.lower() == '.json':
-                    conf_files.append(f)
+        return self._model_cache
 
-            for conf_file in conf_files:
-                filepath = os.path.join(
-                    self._config_path(), conf_file
-                )
-                with open(filepath, 'r') as f:
-                    try:
-                        conf = json.load(f)
-                        name = conf['name']
-                        self._models[name] = conf
-                    except KeyError:
-                        raise RuntimeError(
-                            f'{filepath} is missing :name key'
-                        )
-                    except ValueError:
-                        raise RuntimeError(
-                            f'{filepath} is not proper JSON'
-                        )
+    @property
+    def models(self):
+        if self._models is None:
+            self.reload_models()
 
         return self._models
 
@@ -189,37 +698,141 @@ class StateMachine(StateDelegate):
     def states(self):
         return self._states
 
+    @property
+    def version(self):
+        """
+        Returns the version of the state machine, which increases with
+        every update, including updates made by other processes.
+        """
+        self._sync()
+        return self._version
+
     def did_enter_state(self, old_state, new_state_name):
         """StateDelegate method"""
-        self.states[old_state.name] = old_state
-        self._current_state_name = new_state_name
+        self._enter(self._table.index(new_state_name))
         return True
 
+    def _compact(self):
+        try:
+            self.compact()
+        except Exception as e:
+            self.logger.exception(f'Unable to compact the journal: {str(e)}')
+        finally:
+            self._compacting.release()
+
+    def _enter(self, index):
+        """
+        Makes the state at `index` the current state and notifies
+        observers if it changed.
+        """
+        if self._current_index == index:
+            return
+
+        self._set_current(index)
+        name = self._current_state_name
+
+        with self._state_changed:
+            self._state_changed.notify_all()
+            observers = self._observers
+
+        for observer in observers:
+            try:
+                observer(name)
+            except Exception as e:
+                self.logger.exception(f'Observer failed: {str(e)}')
+
+    def _publish(self, state):
+        """
+        Publishes an update of `state` once it was persisted, and the
+        transition that it caused, if any.
+        """
+        if not state.is_async:
+            self._events.publish('update', {
+                'state': state.name,
+                'value': state.current.value,
+                'version': self._version,
+            })
+
+        if self._current_state_name != state.name:
+            self._events.publish('transition', {
+                'from': state.name,
+                'to': self._current_state_name,
+                'version': self._version,
+            })
+
     def _config_path(self):
         try:
             return self._options.config
         except AttributeError:
             raise RuntimeError('No configuration directory provided.')
 
+    def _read_config(self, filepath):
+        with open(filepath, 'r') as f:
+            try:
+                conf = json.load(f)
+            except ValueError:
+                raise RuntimeError(
+                    f'{filepath} is not proper JSON'
+                )
+
+        if 'name' not in conf:
+            raise RuntimeError(
+                f'{filepath} is missing :name key'
+            )
+
+        return conf
+
+    def _refresh_model(self, conf):
+        """
+        Reloads a cached model if its serialized model changed.
+        """
+        if 'team' not in conf or 'model' not in conf:
+            return False
+
+        team, model = conf['team'], conf['model']
+        return self.model_cache.refresh(
+            (team, model),
+            self._model_path(team, model),
+            lambda: self._deserialize_model(
+                team, model, conf.get('framework')),
+        )
+
     def _create(self, states):
-        result = {}
-        for _, s in enumerate(states):
+        result = []
+        for s in states:
             state = State(s)
             state.delegate = self
-            state_name = state.name
-            result[state_name] = state
+            result.append(state)
 
         return result
 
     def _current_state(self):
-        return self.states[self._current_state_name]
+        return self._table.states[self._current_index]
 
-    def _deserialize_model(self, team, model):
-        model_path = os.path.join(
-            self._models_path(), team, model
-        )
+    def _deserialize_model(self, team, model, frameworks=None):
+        start = time.perf_counter()
+        try:
+            return self._read_model(team, model, frameworks)
+        finally:
+            metrics.DESERIALIZE_SECONDS.labels(f'{team}/{model}').observe(
+                time.perf_counter() - start)
+
+    def _read_model(self, team, model, frameworks=None):
+        model_path = self._model_path(team, model)
 
         if os.path.exists(model_path):
+            #
+            # ML libraries are imported the first time a model that
+            # requires them is deserialized (see ml_modules.py).
+            #
+            load_frameworks(frameworks)
+
+            if model_format.is_mapped_model(model_path):
+                try:
+                    return model_format.load_model(model_path)
+                except Exception:
+                    raise RuntimeError(f'Unable to deserialize {model_path}')
+
             with open(model_path, 'rb') as serialized_model:
                 try:
                     return pickle.load(serialized_model)
@@ -228,31 +841,323 @@ class StateMachine(StateDelegate):
         else:
             raise FileNotFoundError(f'{model_path} does not exist')
 
+    def _load_model(self, team, model, frameworks=None):
+        """
+        Returns a deserialized model, reusing the in-memory copy while
+        the model's file is unchanged.
+        """
+        return self.model_cache.get(
+            (team, model),
+            self._model_path(team, model),
+            lambda: self._deserialize_model(team, model, frameworks),
+        )
+
+    def _durability(self):
+        return getattr(self._options, 'durability', None) or durability.NONE
+
+    def _durability_window(self, default):
+        window = getattr(self._options, 'durability_window', None)
+        if window is None:
+            return default
+
+        return window / 1000
+
+    def _journal_size(self):
+        size = getattr(self._options, 'journal_size', None)
+        if size is None:
+            return self.DEFAULT_JOURNAL_SIZE
+
+        return size
+
+    def _compiled_path(self):
+        return f'{self._machine_path()}.compiled'
+
+    def _load_machine(self):
+        """
+        Reads the state machine from its storage backend, creating it there
+        from the state machine's file the first time, or from its file.
+        """
+        if self.storage is None:
+            return self._read_machine()
+
+        name = self._storage_name()
+        with self.storage.lock(name):
+            machine = self.storage.load(name)
+            if machine is None:
+                machine = self._read_machine()
+                self.storage.create(name, machine)
+
+        return machine
+
     def _machine_path(self):
         try:
             return self._options.machine
         except AttributeError:
             raise RuntimeError('No state machine provided.')
 
+    def _model_cache_hash(self):
+        return getattr(self._options, 'model_cache_hash', False)
+
+    def _model_cache_size(self):
+        size = getattr(self._options, 'model_cache_size', None)
+        if size is None:
+            return ModelCache.DEFAULT_CAPACITY
+
+        return size
+
+    def _model_path(self, team, model):
+        return os.path.join(self._models_path(), team, model)
+
     def _models_path(self):
         try:
             return self._options.models
         except AttributeError:
             raise RuntimeError('No models directory provided.')
 
+    def _replay(self):
+        """
+        Applies the records of the journal to the state machine.
+        """
+        #
+        # Records may be appended out of order when several processes
+        # share the journal, so they are applied in order of version.
+        # Records that the snapshot includes are skipped.
+        #
+        records = sorted(
+            (r for r in self.journal.records() if r['version'] > self._version),
+            key=lambda r: r['version'],
+        )
+        for record in records:
+            for name, value in record['values'].items():
+                self.states[name].current.value = value
+
+            self._set_current(self._table.index(record['current_state']))
+            self._version = record['version']
+
+    def _rows(self, values):
+        """
+        Returns `values` as a list of rows, treating a flat list of values
+        as a single row.
+        """
+        if values and isinstance(values[0], (list, tuple)):
+            return values
+
+        return [values]
+
     def _start_timer(self):
-        if self._thread_state:
-            self._thread_state.cancel()
+        if self._timer is not None:
+            self.scheduler.cancel(self._timer)
 
-        time = self.current_state.transition_time
+        transition_time = self.current_state.transition_time
         now = datetime.now()
-        interval = (time - now).total_seconds()
-        self._thread_state = threading.Timer(interval, self.update)
-        self._thread_state.start()
+        interval = (transition_time - now).total_seconds()
+        self._timer = self.scheduler.schedule(interval, self.update)
+
+    def _prediction_workers(self):
+        return getattr(self._options, 'prediction_workers', None) or 0
+
+    def _predict(self, model_name, values):
+        if self.executor is not None:
+            return self.executor.predict(model_name, values)
+
+        conf = self.models[model_name]
+        team, model = conf['team'], conf['model']
+        deserialized_model = self._load_model(
+            team, model, conf.get('framework'))
+
+        if deserialized_model is None:
+            raise RuntimeError(f'No model is available for {team}/{model}.pkl')
+
+        prediction = deserialized_model.predict(values)
+        return [conf['states'][i] for i in prediction]
+
+    def _persist(self):
+        """
+        Writes pending updates, flushing them to disk unless the durability
+        mode is `none`.
+        """
+        sync = self._durability() != durability.NONE
+
+        with self._persisting():
+            if self.storage is not None:
+                with self.lock:
+                    records, self._pending_records = \
+                        self._pending_records, []
+
+                self.storage.store(self._storage_name(), records, sync=sync)
+                return
+
+            if self.journal is None:
+                with self.lock:
+                    data = self._snapshot()
+
+                self._write_machine(data, sync=sync)
+                return
+
+            with self.lock:
+                records, self._pending_records = self._pending_records, []
+
+            if not records:
+                return
+
+            size = self.journal.append(records, sync=sync)
+
+        #
+        # Compaction runs in the background, and only one compaction runs
+        # at a time.
+        #
+        if size >= self._journal_size() and self._compacting.acquire(False):
+            thread = threading.Thread(target=self._compact, daemon=True)
+            thread.start()
+
+    @contextlib.contextmanager
+    def _persisting(self):
+        """
+        Serializes writes to the state machine's file and journal, across
+        processes when the state machine is shared.
+        """
+        start = time.perf_counter()
+        if self._shared is None:
+            with self._persist_lock:
+                self._lock_acquired('persist', start)
+                yield
+            return
+
+        with self._shared.lock:
+            with self._persist_lock:
+                self._lock_acquired('persist', start)
+                yield
+
+    def _lock_acquired(self, name, start):
+        metrics.LOCK_WAIT_SECONDS.labels(name).observe(
+            time.perf_counter() - start)
+
+    def _observe_prediction(self, model_name, start):
+        #
+        # Requests name models, so only configured models are observed, to
+        # bound the number of series. A prediction is observed whether it
+        # returned or raised, so observing must not raise: its error would
+        # replace the prediction's.
+        #
+        try:
+            if model_name in self.models:
+                metrics.PREDICT_SECONDS.labels(model_name).observe(
+                    time.perf_counter() - start)
+        except Exception as e:
+            self.logger.exception(
+                f'Unable to observe a prediction of {model_name}: {str(e)}')
+
+    @contextlib.contextmanager
+    def _process_transaction(self):
+        """
+        Holds the lock that the processes sharing the state machine share,
+        if any, as described by `transaction`.
+        """
+        if self._shared is None and self.storage is not None:
+            start = time.perf_counter()
+            with self.storage.lock(self._storage_name()):
+                self._lock_acquired('storage', start)
+                self._pull_storage()
+                yield
+            return
+
+        if self._shared is None:
+            yield
+            return
+
+        start = time.perf_counter()
+        with self._shared.lock:
+            self._lock_acquired('shared', start)
+            self._pull()
+            yield
+            self._shared.write(self._version, *self._shared_values())
+
+    def _pull(self):
+        """
+        Reads the shared state machine. Must be called with the lock of
+        the shared state machine.
+        """
+        version, current, counters = self._shared.read()
+        self._enter(current)
+        table = self._table
+        for index, counter in enumerate(counters):
+            if not table.is_end[index] and not table.is_async[index]:
+                table.states[index].current.value = counter
+
+        self._version = version
+
+    def _pull_storage(self):
+        """
+        Reads the stored state machine if another process updated it. Must
+        be called with the lock of the storage.
+        """
+        name = self._storage_name()
+
+        #
+        # Updates of this process that are not stored yet (e.g., with
+        # `async` durability) are newer than the stored state machine.
+        #
+        if self.storage.version(name) <= self._version:
+            return
+
+        version, current_state, values = self.storage.read(name)
+
+        for state_name, value in values.items():
+            state = self.states[state_name]
+            if not state.is_end_state and not state.is_async:
+                state.current.value = value
+
+        self._enter(self._table.index(current_state))
+        self._version = version
+
+    def _set_current(self, index):
+        self._current_index = index
+        self._current_state_name = self._table.names[index]
+
+    def _shared_values(self):
+        counters = [
+            0 if state.is_end_state or state.is_async else state.current.value
+            for state in self._table.states
+        ]
+        return self._current_index, counters
+
+    def _snapshot(self):
+        states_as_dict = [state.to_dict() for state in list(self.states.values())]
+        return {
+            'current_state': self._current_state_name,
+            'states': states_as_dict,
+            'version': self._version,
+        }
+
+    def _storage_name(self):
+        """
+        Returns the name of the state machine in storage: the name of its
+        file without extension, e.g., `rollout` for `rollout.yaml`.
+        """
+        return os.path.splitext(os.path.basename(self._machine_path()))[0]
+
+    def _sync(self):
+        """
+        Reads the shared state machine if another process changed it.
+        """
+        shared = self._shared
+        if shared is not None and shared.version != self._version:
+            with shared.lock:
+                self._pull()
+        elif shared is None and self.storage is not None:
+            version = self.storage.version(self._storage_name())
+            if version is not None and version > self._version:
+                with self.storage.lock(self._storage_name()):
+                    self._pull_storage()
 
     def _read_machine(self):
         """
-        Reads the state machine from a YAML file.
+        Reads the state machine.
+
+        The state machine's YAML file is its source. A snapshot in another
+        format, or a compiled (JSON) copy of the YAML file, is read
+        instead of parsing YAML when it was made from the same source,
+        i.e., when the hash of the YAML file has not changed.
 
         Returns:
             - State machine (dict) if read from file
@@ -264,21 +1169,107 @@ class StateMachine(StateDelegate):
 
         machine_path = self._machine_path()
 
-        if os.path.exists(machine_path):
-            with open(machine_path, 'rt') as data:
-                try:
-                    return yaml.load(data)
-                except yaml.YAMLError:
-                    raise RuntimeError(f'{machine_path} is not a YAML file')
-        else:
+        if not os.path.exists(machine_path):
             raise FileNotFoundError(f'{machine_path} does not exist')
 
-    def _write_machine(self, data):
+        with open(machine_path, 'rb') as f:
+            source = f.read()
+
+        self._source_digest = hashlib.sha1(source).hexdigest()
+
+        if self.codec.name != YamlCodec.name:
+            machine = self._read_snapshot(self._snapshot_path(), self.codec)
+            if machine is not None:
+                return machine
+
+        compiled_path = self._compiled_path()
+        machine = self._read_snapshot(compiled_path, JsonCodec())
+        if machine is not None:
+            return machine
+
+        try:
+            machine = YamlCodec().load(source)
+        except ValueError:
+            raise RuntimeError(f'{machine_path} is not a YAML file')
+
+        self._write_snapshot(compiled_path, JsonCodec(), machine)
+        return machine
+
+    def _read_snapshot(self, path, codec):
         """
-        Writes the state machine to a YAML file.
+        Returns the state machine stored in a snapshot or compiled file,
+        or None if the file is missing, unreadable or was made from
+        another source.
         """
+        try:
+            with open(path, 'rb') as f:
+                snapshot = codec.load(f.read())
+
+            if snapshot['source'] == self._source_digest:
+                return snapshot['machine']
+        except FileNotFoundError:
+            pass
+        except (OSError, KeyError, TypeError, ValueError) as e:
+            self.logger.warning(f'Unable to read {path}: {str(e)}')
 
+        return None
+
+    def _snapshot_path(self):
         machine_path = self._machine_path()
+        if self.codec.name == YamlCodec.name:
+            return machine_path
+
+        return f'{machine_path}{self.codec.extension}'
+
+    @metrics.timed(metrics.WRITE_MACHINE_SECONDS)
+    def _write_machine(self, data, sync=False, compiled=False):
+        """
+        Writes a snapshot of the state machine, flushing it to disk if
+        `sync` is True.
+
+        YAML snapshots replace the state machine's file, and its compiled
+        copy if `compiled` is True; snapshots in other formats are written
+        next to it and leave the YAML file untouched. The compiled copy is
+        only read when the state machine is built, so updates leave it
+        stale rather than writing a second file, and compaction refreshes
+        it.
+        """
+
+        codec = self.codec
+        path = self._snapshot_path()
 
-        with open(machine_path, 'wt') as f:
-            yaml.dump(data, f, default_flow_style=False)
+        if codec.name != YamlCodec.name:
+            snapshot = {'source': self._source_digest, 'machine': data}
+            self._write_file(path, codec.dump(snapshot), sync)
+            return
+
+        encoded = codec.dump(data)
+        self._write_file(path, encoded, sync)
+        self._source_digest = hashlib.sha1(encoded).hexdigest()
+        if compiled:
+            self._write_snapshot(self._compiled_path(), JsonCodec(), data)
+
+    def _write_file(self, path, data, sync=False):
+        """
+        Writes `data` to a temporary file that replaces the file at
+        `path`, so that a crash never leaves a partial file.
+        """
+        temporary_path = f'{path}.tmp'
+        with open(temporary_path, 'wb') as f:
+            f.write(data)
+            if sync:
+                f.flush()
+                os.fsync(f.fileno())
+
+        os.replace(temporary_path, path)
+
+    def _write_snapshot(self, path, codec, data):
+        """
+        Writes a compiled copy of the state machine. The copy is only an
+        optimization, so failing to write it is not an error.
+        """
+        snapshot = {'source': self._source_digest, 'machine': data}
+        try:
+            self._write_file(path, codec.dump(snapshot))
+        except OSError as e:
+            self.logger.warning(f'Unable to write {path}: {str(e)}')
@@ -8,16 +8,31 @@
 # LICENSE file in the root directory of this source tree.
 #
 
+import hmac
+import ipaddress
 import json
 import logging
+import math
+import random
+import signal
 import sys
+import threading
+import time
 
 from flask import Flask
+from flask import g
 from flask import request
 from flask import Response
 
+from . import asgi
+from . import metrics
+from .asgi import AsgiApplication
+from .events import Lagged
 from .logger import configure_logger
+from .machine_registry import MachineRegistry
 from .parser import Parser
+from .prefork import PreforkServer
+from .profiler import Profiler
 from .state_machine import StateMachine
 
 
@@ -30,18 +45,59 @@ class StateService(object):
     for example, when one state transitions to another state.
 
     GET /state?state=:state determines if a state, :state, is the current
-    state.
+    state. With &wait=:seconds, the request waits up to :seconds for :state
+    to become the current state. Responses carry the version of the state
+    machine as their ETag, and are 304 when it matches If-None-Match;
+    Cache-Control and Retry-After tell clients when the answer can change.
     POST /state determines the state that the requesting machine is in using
     a previously trained ML model for prediction.
+    POST /state/batch determines the states of many machines, calling each
+    model's `predict` method once for all machines that reference it.
     PUT /state?state=:state updates the state, :state, and determines if it
     should transition to another state.
+    GET /models/cache reports the counters of the in-memory model cache.
+    GET /ready reports whether StateService is ready to serve requests.
+    GET /models/batches reports the batch sizes achieved by coalescing
+    concurrent predictions.
+    GET /state/events streams the updates and transitions of the state
+    machine as Server-Sent Events.
+    GET /metrics reports request latencies and the latencies of
+    predictions, saves and locks in the Prometheus text format.
+    POST /profile?seconds=:seconds or ?requests=:requests samples the
+    stacks of the process, with --profile-dir, from loopback clients.
+    GET /machines lists the state machines hosted with --machines.
+    GET and PUT /machines/:name/state?state=:state act on the state
+    machine named :name, as GET and PUT /state do.
     """
 
+    EVENT_HEADERS = {'Cache-Control': 'no-cache', 'X-Accel-Buffering': 'no'}
+    #
+    # A stream of events sends a comment this often while the state machine
+    # does not change, so that proxies do not close it.
+    #
+    KEEPALIVE_INTERVAL = 15
+    MAX_CACHE_AGE = 3600
+    MAX_WAIT = 300
+
     def __init__(self, parser):
         self._logger = None
         self._machine = None
         self._options = None
         self._parser = parser
+        self._preload_errors = {}
+        self._profile_token = None
+        self._profiler = None
+        self._ready = threading.Event()
+        self._registry = None
+
+    def close(self):
+        """
+        Writes the pending updates of the state machine (and of the named
+        state machines) and stops their background threads.
+        """
+        self.machine.close()
+        if self._registry is not None:
+            self._registry.close()
 
     def create_state(self):
         """
@@ -57,59 +113,280 @@ class StateService(object):
             A 500 HTTP response if an error occurs in the prediction process
         """
 
-        error_response = Response(
-            response=json.dumps({}),
+        data = request.get_json(silent=True) if request.is_json else None
+        #
+        # A Flask server without threads answers one request at a time, so
+        # a coalescing window could never gather other requests.
+        #
+        status, data = self._predict_state(
+            'POST /state', data, coalesce=self.threaded)
+        return Response(
+            response=json.dumps(data),
             mimetype='application/json',
-            status=500,
+            status=status,
         )
-        if not request.is_json:
-            self.logger.error(f'POST /state: Request must be JSON formatted')
-            return error_response
 
-        if 'name' not in request.json:
-            self.logger.error(f'POST /state: Missing name')
-            return error_response
+    def create_states(self):
+        """
+        Predicts the states of many machines.
 
-        if 'values' not in request.json:
-            self.logger.error(f'POST /state: Missing values')
-            return error_response
+        The request contains a list of `entries`, each of which references
+        the name of a model, the `host_id` of a machine and the values that
+        the machine reported. Entries are grouped by model, so that each
+        model predicts the states of all of its machines in one call.
 
-        name, values = request.json.get('name'), request.json.get('values')
+        Returns:
+            The state of each machine keyed by `host_id`, and an error
+            message for each machine whose model failed (with a 200 HTTP
+            response), or,
+            A 500 HTTP response if the request is invalid
+        """
 
-        try:
-            state = self.machine.predict(name, values)
-            data = {'state': state}
+        data = request.get_json(silent=True) if request.is_json else None
+        status, data = self._predict_states('POST /state/batch', data)
+        return Response(
+            response=json.dumps(data),
+            mimetype='application/json',
+            status=status,
+        )
+
+    def get_model_batches(self):
+        """
+        Reports the number of batches, rows and the largest batch that were
+        predicted for each model that coalesces its requests.
+
+        Returns:
+            A 200 HTTP response with the batch statistics as JSON
+        """
+        return Response(
+            response=json.dumps(self.machine.coalescer.stats),
+            mimetype='application/json',
+            status=200,
+        )
+
+    def get_model_cache(self):
+        """
+        Reports the hits, misses, reloads and evictions of the model cache.
+
+        Returns:
+            A 200 HTTP response with the cache's counters as JSON
+        """
+        return Response(
+            response=json.dumps(self.machine.model_cache.stats),
+            mimetype='application/json',
+            status=200,
+        )
+
+    def get_ready(self):
+        """
+        Reports whether StateService is ready to serve requests, e.g.,
+        to a load balancer.
+
+        Returns:
+            A 200 HTTP response if StateService is ready, with the errors
+            of models that could not be preloaded, or,
+            A 503 HTTP response while models are being preloaded
+        """
+        if not self._ready.is_set():
             return Response(
-                response=json.dumps(data),
+                response=json.dumps({'ready': False}),
                 mimetype='application/json',
-                status=200,
+                status=503,
             )
-        except RuntimeError as e:
-            self.logger.exception(f'POST /state: {str(e)}')
-            return error_response
+
+        data = {'ready': True, 'errors': self._preload_errors}
+        return Response(
+            response=json.dumps(data),
+            mimetype='application/json',
+            status=200,
+        )
+
+    def get_events(self):
+        """
+        Streams the updates and transitions of the state machine as
+        Server-Sent Events.
+
+        A stream begins with a `state` event that reports the current state,
+        unless the client reconnects with the `Last-Event-ID` header, in
+        which case it begins with the events that the client missed. A
+        client that falls too far behind is disconnected, and reconnects
+        from the last event that it received.
+
+        A stream holds a thread of the server for as long as it is open, so
+        streams are refused unless the server is threaded (see `threaded`).
+
+        Returns:
+            A 200 HTTP response that streams events, or,
+            A 503 HTTP response if the server is not threaded
+        """
+        route = 'GET /state/events'
+        if not self.threaded:
+            self.logger.error(
+                f'{route}: A stream would hold the only thread of the '
+                f'server; serve with --threaded or --asgi'
+            )
+            return Response('', status=503)
+
+        machine = self.machine
+        payloads, last_id = self._first_events(
+            route, machine, request.headers.get('Last-Event-ID'))
+
+        def stream(payloads, last_id):
+            while True:
+                yield b''.join(payloads)
+                try:
+                    events = machine.events.wait(
+                        last_id, self.KEEPALIVE_INTERVAL)
+                except Lagged:
+                    self.logger.warning(f'{route}: Dropped a slow client')
+                    return
+
+                payloads, last_id = self._next_events(machine, last_id, events)
+
+        return Response(
+            stream(payloads, last_id),
+            mimetype='text/event-stream',
+            headers=self.EVENT_HEADERS,
+        )
+
+    def get_metrics(self):
+        """
+        Reports metrics in the Prometheus text format.
+
+        Returns:
+            A 200 HTTP response with the metrics of this process
+        """
+        return Response(
+            response=metrics.collect(),
+            content_type=metrics.CONTENT_TYPE,
+            status=200,
+        )
+
+    def get_machines(self):
+        """
+        Lists the state machines hosted with --machines.
+
+        Returns:
+            A 200 HTTP response with the names of the state machines as
+            JSON
+        """
+        return Response(
+            response=json.dumps({'machines': self.registry.names()}),
+            mimetype='application/json',
+            status=200,
+        )
+
+    def get_machine_state(self, name):
+        """
+        Determines whether the current state of the state machine named
+        :name matches the state passed in as a query parameter.
+
+        Returns:
+            The responses of `get_state`, or,
+            A 404 HTTP response if there is no state machine named :name
+        """
+        route = f'GET /machines/{name}/state'
+        machine = self._named_machine(route, name)
+        if machine is None:
+            return Response('', status=404)
+
+        return self._get_state(route, machine)
 
     def get_state(self):
         """
         Determines whether the current state matches the state passed in as a
         query parameter.
 
+        With a `wait` query parameter, the request waits up to `wait`
+        seconds (at most `MAX_WAIT`) for the state to become the current
+        state, rather than the client retrying until it does. Unless the
+        server is threaded (see `threaded`), `wait` is ignored, since the
+        waiting request would block the update that it waits for.
+
         Returns:
             A 200 HTTP response if :state is the current state,
-            A 406 HTTP response if :state is not the current state, or,
-            A 500 HTTP response if :state is missing
+            A 304 HTTP response if the state machine did not change since
+                the version in the If-None-Match header,
+            A 406 HTTP response if :state is not the current state (when
+                the request stopped waiting), or,
+            A 500 HTTP response if :state is missing or :wait is invalid
         """
-        state = request.args.get('state')
+        return self._get_state('GET /state', self.machine)
 
-        if state is None:
-            self.logger.error('GET /state: Missing :state query parameter')
-            return Response('', status=500)
+    def start_profile(self):
+        """
+        Samples the stacks of this process for :seconds, or until :requests
+        requests that start from now have been answered, and writes them to
+        --profile-dir in the collapsed-stack format of flame graphs.
+
+        The request must carry the token of --profile-token-file in its
+        X-Profile-Token header.
+
+        Returns:
+            A 202 HTTP response with the path of the profile as JSON,
+            A 403 HTTP response if the client is not on a loopback address
+              or does not send the token,
+            A 404 HTTP response if --profile-dir or --profile-token-file is
+              not configured,
+            A 409 HTTP response if the process is already being profiled, or,
+            A 500 HTTP response if :seconds or :requests is invalid
+        """
+        status, data = self._start_profile(
+            'POST /profile', request.args, request.remote_addr,
+            request.headers.get('X-Profile-Token'))
+        return Response(
+            response=json.dumps(data),
+            mimetype='application/json',
+            status=status,
+        )
+
+    def start_request(self):
+        g.request_start = time.perf_counter()
+        if self._profiler is not None:
+            g.profiled = self._profiler.active
 
-        if self.machine.is_current_state(state):
-            self.logger.info(f'GET /state: {state} is current state')
-            return Response(f'{state}', status=200)
+    def finish_request(self, response):
+        """
+        Observes the time taken to answer a request, by endpoint and
+        status code, and counts the request if it was profiled.
+        """
+        start = g.pop('request_start', None)
+        if start is not None:
+            metrics.REQUEST_SECONDS.labels(
+                request.endpoint or 'none', str(response.status_code),
+            ).observe(time.perf_counter() - start)
+
+        if g.pop('profiled', False):
+            self._profiler.count_request()
 
-        self.logger.info(f'GET /state: {state} is not current state')
-        return Response('', status=406)
+        return response
+
+    def handle_profile_signal(self, signum, frame):
+        """
+        Profiles this process for Profiler.DEFAULT_SECONDS when it receives
+        SIGUSR2.
+
+        The profiler is started from another thread, since the signal may
+        interrupt this thread while it holds the profiler's lock.
+        """
+        if self._profiler is not None:
+            threading.Thread(target=self._profiler.start, daemon=True).start()
+
+    def update_machine_state(self, name):
+        """
+        Updates the current state of the state machine named :name, as
+        `update_state` does.
+
+        Returns:
+            The responses of `update_state`, or,
+            A 404 HTTP response if there is no state machine named :name
+        """
+        route = f'PUT /machines/{name}/state'
+        machine = self._named_machine(route, name)
+        if machine is None:
+            return Response('', status=404)
+
+        return self._put_state(route, machine)
 
     def update_state(self):
         """
@@ -126,35 +403,7 @@ class StateService(object):
             A 500 HTTP response if :state is missing or could not be
                 updated
         """
-        state = request.args.get('state')
-
-        if state is None:
-            self.logger.error('PUT /state: Missing :state query parameter')
-            return Response('', status=500)
-
-        if self.machine.did_end:
-            self.logger.info(
-                'PUT /state: {state}; the state machine is in its final state'
-            )
-            return Response('', status=500)
-
-        if self.machine.is_async:
-            self.logger.info(
-                'PUT /state: {state}; an async state machine updates itself'
-            )
-            return Response('', status=500)
-
-        if self.machine.is_current_state(state):
-            self.machine.update()
-            self.machine.save()
-            self.logger.info(f'PUT /state: Updated {state} state')
-            return Response(f'{state}', status=200)
-        else:
-            self.logger.error(f'PUT /state: Unable to update {state} state')
-            return Response('', status=500)
-
-        self.logger.info(f'PUT /state: {state} is not current state')
-        return Response('', status=406)
+        return self._put_state('PUT /state', self.machine)
 
     @property
     def logger(self):
@@ -170,6 +419,27 @@ class StateService(object):
 
         return self._machine
 
+    @property
+    def registry(self):
+        if self._registry is None:
+            self._registry = MachineRegistry(self.options)
+
+        return self._registry
+
+    @property
+    def threaded(self):
+        """
+        Returns True if the Flask server answers requests from several
+        threads, so that a request that blocks its thread (by waiting or
+        streaming) does not block other requests. Workers of --workers
+        answer requests from a single thread each.
+        """
+        options = self.options
+        return getattr(options, 'workers', 1) <= 1 and (
+            getattr(options, 'threaded', False) or
+            (getattr(options, 'prediction_workers', 0) or 0) > 0
+        )
+
     @property
     def options(self):
         """
@@ -183,6 +453,364 @@ class StateService(object):
 
         return self._options
 
+    def _row(self, values):
+        """
+        Accepts a machine's values either as a row, e.g., `[500, 0]`, or
+        as a single-row matrix, e.g., `[[500, 0]]`, and returns the row.
+        """
+        if len(values) == 1 and isinstance(values[0], list):
+            return values[0]
+
+        return values
+
+    def _check_state(self, route, machine, state, if_none_match=None):
+        """
+        Determines whether :state is the current state of `machine`.
+
+        Responses carry the version of the state machine as their ETag, so
+        a client that sends it back in If-None-Match gets an empty 304
+        response until the state machine changes.
+
+        Returns:
+            The status, body and headers of the response
+        """
+        if state is None:
+            self.logger.error(f'{route}: Missing :state query parameter')
+            return 500, '', {}
+
+        #
+        # The version is read before the current state, so that the ETag
+        # is never newer than the response.
+        #
+        etag = f'"{machine.version}"'
+        headers = {'ETag': etag}
+        headers.update(self._cache_headers(machine))
+        if if_none_match is not None and \
+                self._etag_matches(if_none_match, etag):
+            return 304, '', headers
+
+        if machine.is_current_state(state):
+            self.logger.info(f'{route}: {state} is current state')
+            return 200, f'{state}', headers
+
+        self.logger.info(f'{route}: {state} is not current state')
+        return 406, '', headers
+
+    def _cache_headers(self, machine):
+        """
+        Returns the Cache-Control and Retry-After headers that tell clients
+        (and HTTP caches) for how long the answer to GET /state cannot
+        change.
+
+        An asynchronous state cannot change before its transition time.
+        Retry-After adds up to `--retry-jitter` random seconds, so that
+        clients that wait for the transition do not all retry at once;
+        max-age does not, so that caches never serve an answer past the
+        transition. Any update can change an increment state, so its hint
+        is configured with `--increment-hint` (none by default).
+        """
+        seconds = machine.time_to_transition()
+        if seconds is None:
+            if machine.did_end:
+                return {}
+
+            seconds = getattr(self.options, 'increment_hint', None) or 0
+
+        seconds = min(seconds, self.MAX_CACHE_AGE)
+        if seconds < 1:
+            return {}
+
+        jitter = getattr(self.options, 'retry_jitter', None) or 0
+        return {
+            'Cache-Control': f'max-age={int(seconds)}',
+            'Retry-After': str(math.ceil(seconds + random.uniform(0, jitter))),
+        }
+
+    def _change_state(self, route, machine, state):
+        """
+        Updates :state, the current state of `machine`.
+
+        Returns:
+            The status and body of the response
+        """
+        if state is None:
+            self.logger.error(f'{route}: Missing :state query parameter')
+            return 500, ''
+
+        #
+        # The state machine may be shared by several worker processes, so
+        # the current state must not change between checking and updating
+        # it.
+        #
+        with machine.transaction():
+            return self._update_state(route, machine, state)
+
+    def _get_state(self, route, machine):
+        state = request.args.get('state')
+        wait = self._wait_time(route, request.args.get('wait'))
+        if wait is None:
+            return Response('', status=500)
+
+        #
+        # A waiting request holds its thread, which would block the update
+        # that it waits for if the server has no other thread.
+        #
+        if state is not None and wait > 0 and self.threaded:
+            machine.wait_for_state(state, wait)
+
+        status, body, headers = self._check_state(
+            route, machine, state, request.headers.get('If-None-Match'))
+        return Response(body, status=status, headers=headers)
+
+    def _etag_matches(self, if_none_match, etag):
+        """
+        Returns True if the If-None-Match header lists `etag` (weakly).
+        """
+        for tag in if_none_match.split(','):
+            tag = tag.strip()
+            if tag == '*' or tag == etag or tag == f'W/{etag}':
+                return True
+
+        return False
+
+    def _first_events(self, route, machine, last_event_id):
+        """
+        Returns the payloads that begin a stream of events, and the id of
+        the last of them.
+        """
+        events = machine.events
+        if last_event_id is not None:
+            try:
+                last_id = int(last_event_id)
+                if last_id < 0:
+                    raise ValueError(last_event_id)
+
+                return self._next_events(
+                    machine, last_id, events.events_after(last_id))
+            except (Lagged, ValueError):
+                self.logger.info(
+                    f'{route}: Unable to resume after event {last_event_id}'
+                )
+
+        #
+        # Events published after `last_id` are sent after the current
+        # state, even if the current state already includes them.
+        #
+        last_id = events.last_id
+        state = machine.current_state.name
+        return [events.message('state', {
+            'state': state,
+            'version': machine.version,
+        }, last_id)], last_id
+
+    def _next_events(self, machine, last_id, events):
+        """
+        Returns the payloads of `events` (a keepalive if there are none)
+        and the id of the last event.
+        """
+        if not events:
+            return [machine.events.KEEPALIVE], last_id
+
+        return [payload for _, payload in events], events[-1][0]
+
+    def _named_machine(self, route, name):
+        """
+        Returns the state machine named `name`, or None if there is no such
+        state machine (or it cannot be built).
+        """
+        try:
+            machine = self.registry.get(name)
+        except (OSError, RuntimeError) as e:
+            self.logger.exception(f'{route}: {str(e)}')
+            return None
+
+        if machine is None:
+            self.logger.error(f'{route}: No state machine named {name}')
+
+        return machine
+
+    def _predict_state(self, route, data, coalesce=True):
+        """
+        Predicts the state of a machine from a request's JSON `data`, as
+        described by `create_state`, merging the prediction with
+        concurrent ones only if `coalesce` (see `StateMachine.predict`).
+
+        Returns:
+            The status and JSON data of the response
+        """
+        if not isinstance(data, dict):
+            self.logger.error(f'{route}: Request must be JSON formatted')
+            return 500, {}
+
+        if 'name' not in data:
+            self.logger.error(f'{route}: Missing name')
+            return 500, {}
+
+        if 'values' not in data:
+            self.logger.error(f'{route}: Missing values')
+            return 500, {}
+
+        name, values = data.get('name'), data.get('values')
+
+        try:
+            state = self.machine.predict(name, values, coalesce=coalesce)
+            return 200, {'state': state}
+        except RuntimeError as e:
+            self.logger.exception(f'{route}: {str(e)}')
+            return 500, {}
+
+    def _predict_states(self, route, data):
+        """
+        Predicts the states of many machines from a request's JSON `data`,
+        as described by `create_states`.
+
+        Returns:
+            The status and JSON data of the response
+        """
+        if not isinstance(data, dict):
+            self.logger.error(f'{route}: Request must be JSON formatted')
+            return 500, {}
+
+        entries = data.get('entries')
+        if not isinstance(entries, list):
+            self.logger.error(f'{route}: Missing entries')
+            return 500, {}
+
+        groups = {}
+        for entry in entries:
+            if not isinstance(entry, dict) or \
+                    not {'name', 'host_id', 'values'} <= entry.keys() or \
+                    not isinstance(entry['values'], list):
+                self.logger.error(
+                    f'{route}: Entries require name, host_id and values'
+                )
+                return 500, {}
+
+            host_ids, rows = groups.setdefault(entry['name'], ([], []))
+            host_ids.append(entry['host_id'])
+            rows.append(self._row(entry['values']))
+
+        states, errors = {}, {}
+        for name, (host_ids, rows) in groups.items():
+            #
+            # A model may raise anything for rows that it cannot predict
+            # (e.g., ValueError for rows of the wrong width); only the
+            # machines of that model fail.
+            #
+            try:
+                predictions = self.machine.predict_batch(name, rows)
+                states.update(zip(host_ids, predictions))
+            except Exception as e:
+                self.logger.exception(f'{route}: {name}: {str(e)}')
+                errors.update((host_id, str(e)) for host_id in host_ids)
+
+        return 200, {'states': states, 'errors': errors}
+
+    def _profile_limits(self, route, args):
+        """
+        Returns the :seconds and :requests of a profile, either of which
+        may be None, or None if they are invalid.
+        """
+        try:
+            seconds = args.get('seconds')
+            seconds = None if seconds is None else float(seconds)
+            requests = args.get('requests')
+            requests = None if requests is None else int(requests)
+        except ValueError:
+            seconds = requests = -1
+
+        if seconds is not None and not 0 < seconds < float('inf') or \
+                requests is not None and requests <= 0:
+            self.logger.error(
+                f'{route}: Invalid :seconds or :requests query parameter')
+            return None
+
+        return seconds, requests
+
+    def _put_state(self, route, machine):
+        status, body = self._change_state(
+            route, machine, request.args.get('state'))
+        return Response(body, status=status)
+
+    def _wait_time(self, route, value):
+        """
+        Returns the seconds that a request waits for a state, 0 if `value`
+        is missing, or None if it is invalid.
+        """
+        if value is None:
+            return 0
+
+        try:
+            wait = float(value)
+        except ValueError:
+            wait = -1
+
+        if not 0 <= wait < float('inf'):
+            self.logger.error(f'{route}: Invalid :wait query parameter')
+            return None
+
+        return min(wait, self.MAX_WAIT)
+
+    def _start_profile(self, route, args, remote_addr, token):
+        """
+        Starts profiling, as described by `start_profile`.
+
+        Returns:
+            The status and JSON data of the response
+        """
+        if self._profiler is None or self._profile_token is None:
+            return 404, {}
+
+        #
+        # Behind a reverse proxy on the same host, every client is on a
+        # loopback address, so the token is what admits a client.
+        #
+        try:
+            admin = ipaddress.ip_address(remote_addr or '').is_loopback
+        except ValueError:
+            admin = False
+
+        admin = admin and token is not None and hmac.compare_digest(
+            token.encode('utf-8'), self._profile_token.encode('utf-8'))
+        if not admin:
+            self.logger.error(f'{route}: Refused profiling to {remote_addr}')
+            return 403, {}
+
+        limits = self._profile_limits(route, args)
+        if limits is None:
+            return 500, {}
+
+        path = self._profiler.start(*limits)
+        if path is None:
+            return 409, {}
+
+        self.logger.info(f'{route}: Profiling to {path}')
+        return 202, {'path': path}
+
+    def _update_state(self, route, machine, state):
+        if machine.did_end:
+            self.logger.info(
+                f'{route}: {state}; the state machine is in its final state'
+            )
+            return 500, ''
+
+        if machine.is_async:
+            self.logger.info(
+                f'{route}: {state}; an async state machine updates itself'
+            )
+            return 500, ''
+
+        if machine.is_current_state(state):
+            machine.update()
+            self.logger.info(f'{route}: Updated {state} state')
+            return 200, f'{state}'
+        else:
+            self.logger.error(f'{route}: Unable to update {state} state')
+            return 500, ''
+
+        self.logger.info(f'{route}: {state} is not current state')
+        return 406, ''
+
     def _initialize(self):
         """
         Initializes the state machine to be served.
@@ -193,6 +821,64 @@ class StateService(object):
         if self.options.machine:
             self.machine.build()
 
+        profile_dir = getattr(self.options, 'profile_dir', None)
+        if profile_dir and self._profiler is None:
+            self._profiler = Profiler(profile_dir)
+            self._profile_token = self._read_profile_token()
+
+        #
+        # Threads do not survive `fork`, so each of --workers starts its own
+        # watcher (see `serve_prefork`).
+        #
+        if getattr(self.options, 'workers', 1) <= 1:
+            self._watch_models()
+
+        if getattr(self.options, 'preload_models', False):
+            self._ready.clear()
+            thread = threading.Thread(target=self._preload, daemon=True)
+            thread.start()
+        else:
+            self._ready.set()
+
+    def _read_profile_token(self):
+        """
+        Returns the token that enables POST /profile, or None if
+        --profile-token-file is not configured.
+
+        Raises:
+            - RuntimeError if the token cannot be read or is empty
+        """
+        path = getattr(self.options, 'profile_token_file', None)
+        if not path:
+            return None
+
+        try:
+            with open(path, 'r') as f:
+                token = f.read().strip()
+        except OSError as e:
+            raise RuntimeError(f'Unable to read {path}: {str(e)}')
+
+        if not token:
+            raise RuntimeError(f'{path} does not contain a profile token')
+
+        return token
+
+    def _watch_models(self):
+        interval = getattr(self.options, 'watch_models', None)
+        if interval:
+            self.machine.watch_models(interval)
+
+    def _preload(self):
+        """
+        Loads every model, and then reports that StateService is ready.
+        """
+        try:
+            self._preload_errors = self.machine.preload()
+        except Exception as e:
+            self.logger.exception(f'Unable to preload models: {str(e)}')
+        finally:
+            self._ready.set()
+
 
 """
 Initialize StateService and Flask app, but use placeholder methods that
@@ -203,6 +889,17 @@ state_service = StateService(parser)
 app = Flask(__name__)
 log = logging.getLogger('werkzeug')
 log.disabled = True
+asgi_app = AsgiApplication(state_service)
+
+
+@app.before_request
+def start_request():
+    state_service.start_request()
+
+
+@app.after_request
+def finish_request(response):
+    return state_service.finish_request(response)
 
 
 @app.route('/state', methods=['OPTIONS', 'GET'])
@@ -215,27 +912,128 @@ def create_state():
     return state_service.create_state()
 
 
+@app.route('/state/batch', methods=['OPTIONS', 'POST'])
+def create_states():
+    return state_service.create_states()
+
+
 @app.route('/state', methods=['OPTIONS', 'PUT'])
 def update_state():
     return state_service.update_state()
 
 
+@app.route('/state/events', methods=['OPTIONS', 'GET'])
+def get_events():
+    return state_service.get_events()
+
+
+@app.route('/profile', methods=['OPTIONS', 'POST'])
+def start_profile():
+    return state_service.start_profile()
+
+
+@app.route('/machines', methods=['OPTIONS', 'GET'])
+def get_machines():
+    return state_service.get_machines()
+
+
+@app.route('/machines/<name>/state', methods=['OPTIONS', 'GET'])
+def get_machine_state(name):
+    return state_service.get_machine_state(name)
+
+
+@app.route('/machines/<name>/state', methods=['OPTIONS', 'PUT'])
+def update_machine_state(name):
+    return state_service.update_machine_state(name)
+
+
+@app.route('/ready', methods=['OPTIONS', 'GET'])
+def get_ready():
+    return state_service.get_ready()
+
+
+@app.route('/metrics', methods=['OPTIONS', 'GET'])
+def get_metrics():
+    return state_service.get_metrics()
+
+
+@app.route('/models/batches', methods=['OPTIONS', 'GET'])
+def get_model_batches():
+    return state_service.get_model_batches()
+
+
+@app.route('/models/cache', methods=['OPTIONS', 'GET'])
+def get_model_cache():
+    return state_service.get_model_cache()
+
+
+def serve_prefork(host, port, workers):
+    """
+    Serves StateService from several forked worker processes.
+
+    Models are loaded and the state machine is moved to shared memory
+    before the workers are forked, so that the workers share the models'
+    memory copy-on-write and have a single view of the state machine.
+    With --watch-models, each worker watches the models directories once
+    it is forked. A worker that is stopped writes its pending updates
+    before it exits.
+    """
+    state_service._ready.wait()
+    if state_service.options.machine:
+        state_service.machine.share()
+
+    PreforkServer(
+        app, host, port, workers,
+        initializer=state_service._watch_models,
+        finalizer=state_service.close,
+    ).serve()
+
+
 def main():
     options = state_service.options
     debug = options.debug
     host = options.host
     logger_path = options.logger
     port = options.port
+    #
+    # When models run in worker processes, requests are served by threads,
+    # so that GET and PUT requests are not blocked by predictions.
+    #
+    threaded = state_service.threaded
     configure_logger(path=logger_path)
+    if options.machines and options.workers > 1:
+        #
+        # Each worker would build its own copy of every named state machine
+        # and rewrite the same files, losing the updates of the others.
+        #
+        state_service.logger.error(
+            '--machines cannot be served by several --workers')
+        return 1
+
+    if getattr(options, 'profile_dir', None):
+        signal.signal(signal.SIGUSR2, state_service.handle_profile_signal)
 
     try:
+        #
+        # The ASGI application initializes StateService when the server
+        # starts.
+        #
+        if getattr(options, 'asgi', False):
+            asgi.serve(asgi_app, host, port)
+            return 0
+
         state_service._initialize()
-        app.run(
-            debug=debug, host=host, port=port, threaded=False,
-        )
+        if options.workers > 1:
+            serve_prefork(host, port, options.workers)
+        else:
+            app.run(
+                debug=debug, host=host, port=port, threaded=threaded,
+            )
     except Exception:
         state_service.machine.save()
         return 1
+    finally:
+        state_service.close()
 
 
 if __name__ == '__main__':
@@ -0,0 +1,402 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+
+#
+# Copyright (c) Facebook, Inc. and its affiliates.
+#
+# This source code is licensed under the MIT license found in the
+# LICENSE file in the root directory of this source tree.
+#
+
+import contextlib
+import fcntl
+import json
+import os
+import sqlite3
+import threading
+import zlib
+
+
+class Storage(object):
+    """
+    Persists the state machines of StateService.
+
+    A state machine is created in storage from its YAML file the first time
+    it is built, and then only its updates are stored. Updates are stored as
+    records with the version of the state machine, the name of the current
+    state and the counters of the states that changed.
+
+    By default, StateService stores a state machine in its own file (see
+    `StateMachine.save`); a storage backend replaces the file.
+    """
+
+    def close(self):
+        pass
+
+    def create(self, name, machine):
+        """
+        Stores a state machine that was read from its file.
+        """
+        raise NotImplementedError
+
+    def load(self, name):
+        """
+        Returns the stored state machine named `name`, or None if it was
+        not created.
+        """
+        raise NotImplementedError
+
+    @contextlib.contextmanager
+    def lock(self, name):
+        """
+        Holds a lock that serializes the updates of the state machine named
+        `name` by every process that uses the storage; updates of other
+        state machines do not wait for it.
+        """
+        yield
+
+    def read(self, name):
+        """
+        Returns the version, the name of the current state and the counters
+        of the state machine named `name`.
+        """
+        raise NotImplementedError
+
+    def store(self, name, records, sync=False):
+        """
+        Stores the records of updates of the state machine named `name`,
+        flushing them to disk if `sync` is True.
+        """
+        raise NotImplementedError
+
+    def version(self, name):
+        """
+        Returns the version of the stored state machine named `name`.
+        """
+        raise NotImplementedError
+
+
+class SqliteStorage(Storage):
+    """
+    Stores state machines in a SQLite database, with one row per state
+    machine and one row per state.
+
+    An update changes the rows of the states whose counters changed and the
+    row of the state machine, in one transaction, rather than rewriting the
+    state machine. The database is in WAL mode, so that readers do not wait
+    for writers, and several processes on a host can share it.
+
+    One instance (see `get_storage`) serves every state machine of a
+    process, with one connection and one lock file, whatever the number of
+    state machines.
+    """
+
+    SCHEMA = (
+        'CREATE TABLE IF NOT EXISTS machines ('
+        ' name TEXT PRIMARY KEY,'
+        ' current_state TEXT NOT NULL,'
+        ' version INTEGER NOT NULL'
+        ') WITHOUT ROWID',
+        'CREATE TABLE IF NOT EXISTS states ('
+        ' machine TEXT NOT NULL,'
+        ' name TEXT NOT NULL,'
+        ' position INTEGER NOT NULL,'
+        ' definition TEXT NOT NULL,'
+        ' value,'
+        ' PRIMARY KEY (machine, name)'
+        ') WITHOUT ROWID',
+    )
+
+    #
+    # Statements are constant strings, so that sqlite3 prepares each of
+    # them once and reuses it from its statement cache.
+    #
+    INSERT_MACHINE = (
+        'INSERT OR REPLACE INTO machines (name, current_state, version) '
+        'VALUES (?, ?, ?)'
+    )
+    INSERT_STATE = (
+        'INSERT OR REPLACE INTO states '
+        '(machine, name, position, definition, value) '
+        'VALUES (?, ?, ?, ?, ?)'
+    )
+    SELECT_MACHINE = (
+        'SELECT current_state, version FROM machines WHERE name = ?'
+    )
+    SELECT_STATES = (
+        'SELECT name, definition, value FROM states WHERE machine = ? '
+        'ORDER BY position'
+    )
+    SELECT_VALUES = (
+        'SELECT name, value FROM states '
+        'WHERE machine = ? AND value IS NOT NULL'
+    )
+    SELECT_VERSION = 'SELECT version FROM machines WHERE name = ?'
+    UPDATE_MACHINE = (
+        'UPDATE machines SET current_state = ?, version = ? '
+        'WHERE name = ? AND version < ?'
+    )
+    UPDATE_STATE = (
+        'UPDATE states SET value = ? WHERE machine = ? AND name = ?'
+    )
+
+    def __init__(self, path):
+        """
+        Args:
+            path (str): Path to the database, which is created if it does
+                not exist
+        """
+        self._connection = None
+        self._file_lock = None
+        self._lock = threading.RLock()
+        self._machine_locks = {}
+        self._path = path
+        self._synchronous = None
+
+    def close(self):
+        with self._lock:
+            if self._connection is not None:
+                self._connection.close()
+                self._connection = None
+
+            if self._file_lock is not None:
+                self._file_lock.close()
+                self._file_lock = None
+
+    def create(self, name, machine):
+        rows = []
+        for position, state in enumerate(machine['states']):
+            definition = dict(state)
+            current = definition.get('current')
+            value = current.get('value') if current else None
+            rows.append((
+                name, state['name'], position, json.dumps(definition), value,
+            ))
+
+        with self._lock:
+            with self._transaction() as connection:
+                connection.execute(
+                    'DELETE FROM states WHERE machine = ?', (name,))
+                connection.executemany(self.INSERT_STATE, rows)
+                connection.execute(self.INSERT_MACHINE, (
+                    name, machine['current_state'], machine.get('version', 0),
+                ))
+
+    def load(self, name):
+        with self._lock:
+            connection = self._connect()
+            row = connection.execute(self.SELECT_MACHINE, (name,)).fetchone()
+            if row is None:
+                return None
+
+            states = []
+            for state_name, definition, value in connection.execute(
+                self.SELECT_STATES, (name,)
+            ):
+                state = json.loads(definition)
+                if value is not None:
+                    state['current']['value'] = value
+
+                states.append(state)
+
+        current_state, version = row
+        return {
+            'current_state': current_state,
+            'states': states,
+            'version': version,
+        }
+
+    @contextlib.contextmanager
+    def lock(self, name):
+        #
+        # SQLite's own locks are only held for the duration of a
+        # transaction, so a lock file serializes the read-modify-write of
+        # an update across processes. Each state machine locks one byte of
+        # the file, at an offset derived from its name, so that updates of
+        # different state machines do not wait for one another (unless
+        # their names share an offset). Record locks do not exclude the
+        # threads of a process, so a lock per state machine does.
+        #
+        with self._lock:
+            machine_lock = self._machine_locks.get(name)
+            if machine_lock is None:
+                machine_lock = _MachineLock(zlib.crc32(name.encode()))
+                self._machine_locks[name] = machine_lock
+
+            if self._file_lock is None:
+                self._file_lock = open(f'{self._path}.lock', 'a')
+
+            file_lock = self._file_lock
+
+        with machine_lock.lock:
+            if machine_lock.depth == 0:
+                fcntl.lockf(file_lock, fcntl.LOCK_EX, 1, machine_lock.offset)
+
+            machine_lock.depth += 1
+            try:
+                yield
+            finally:
+                machine_lock.depth -= 1
+                if machine_lock.depth == 0:
+                    fcntl.lockf(
+                        file_lock, fcntl.LOCK_UN, 1, machine_lock.offset)
+
+    def read(self, name):
+        with self._lock:
+            connection = self._connect()
+            current_state, version = connection.execute(
+                self.SELECT_MACHINE, (name,)).fetchone()
+            values = dict(connection.execute(self.SELECT_VALUES, (name,)))
+
+        return version, current_state, values
+
+    def store(self, name, records, sync=False):
+        if not records:
+            return
+
+        records = sorted(records, key=lambda record: record['version'])
+
+        with self._lock:
+            self._set_synchronous(sync)
+            with self._transaction() as connection:
+                for record in records:
+                    connection.executemany(self.UPDATE_STATE, [
+                        (value, name, state_name)
+                        for state_name, value in record['values'].items()
+                    ])
+
+                last = records[-1]
+                connection.execute(self.UPDATE_MACHINE, (
+                    last['current_state'], last['version'], name,
+                    last['version'],
+                ))
+
+    def version(self, name):
+        with self._lock:
+            row = self._connect().execute(
+                self.SELECT_VERSION, (name,)).fetchone()
+
+        return row[0] if row is not None else None
+
+    def _connect(self):
+        if self._connection is None:
+            connection = sqlite3.connect(
+                self._path, check_same_thread=False, isolation_level=None,
+            )
+            connection.execute('PRAGMA journal_mode=WAL')
+            for statement in self.SCHEMA:
+                connection.execute(statement)
+
+            self._connection = connection
+
+        return self._connection
+
+    def _reset(self):
+        """
+        Forgets the connection and the locks of a parent process in a
+        forked process, which opens its own; a SQLite connection must not
+        be used by two processes.
+        """
+        self._connection = None
+        self._file_lock = None
+        self._lock = threading.RLock()
+        self._machine_locks = {}
+        self._synchronous = None
+
+    def _set_synchronous(self, sync):
+        #
+        # In WAL mode, NORMAL does not flush (fsync) on commit, and FULL
+        # does.
+        #
+        if self._synchronous != sync:
+            mode = 'FULL' if sync else 'NORMAL'
+            self._connect().execute(f'PRAGMA synchronous={mode}')
+            self._synchronous = sync
+
+    @contextlib.contextmanager
+    def _transaction(self):
+        connection = self._connect()
+        connection.execute('BEGIN IMMEDIATE')
+        try:
+            yield connection
+        except BaseException:
+            connection.execute('ROLLBACK')
+            raise
+
+        connection.execute('COMMIT')
+
+
+class _MachineLock(object):
+    """
+    The lock of one state machine in a SqliteStorage: a reentrant lock for
+    the threads of the process, and the offset of its byte of the lock
+    file for other processes.
+    """
+
+    def __init__(self, offset):
+        self.depth = 0
+        self.lock = threading.RLock()
+        self.offset = offset
+
+
+STORAGES = {
+    'sqlite': SqliteStorage,
+}
+
+_storages = {}
+_storages_lock = threading.Lock()
+
+
+def get_storage(url):
+    """
+    Returns the storage described by `url`, e.g., `sqlite:/path/to.db`.
+
+    Every state machine of the process that is stored at the same path
+    shares one storage, which is closed when each of them released it
+    (see `release_storage`).
+
+    Raises:
+        - RuntimeError if the URL does not name a storage
+    """
+    scheme, _, path = url.partition(':')
+    if scheme not in STORAGES or not path:
+        raise RuntimeError(
+            f'{url} is not a storage; expected one of '
+            f'{", ".join(f"{name}:PATH" for name in sorted(STORAGES))}'
+        )
+
+    key = (scheme, os.path.abspath(path))
+    with _storages_lock:
+        entry = _storages.get(key)
+        if entry is None:
+            entry = _storages[key] = [STORAGES[scheme](path), 0]
+
+        entry[1] += 1
+        return entry[0]
+
+
+def release_storage(storage):
+    """
+    Releases a storage returned by `get_storage`, and closes it if no
+    other state machine uses it.
+    """
+    with _storages_lock:
+        for key, entry in _storages.items():
+            if entry[0] is storage:
+                entry[1] -= 1
+                if entry[1] <= 0:
+                    del _storages[key]
+                    storage.close()
+
+                return
+
+
+def _reset_after_fork():
+    global _storages_lock
+
+    _storages_lock = threading.Lock()
+    for storage, _ in _storages.values():
+        storage._reset()
+
+
+os.register_at_fork(after_in_child=_reset_after_fork)
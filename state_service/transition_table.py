@@ -0,0 +1,167 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+
+#
+# Copyright (c) Facebook, Inc. and its affiliates.
+#
+# This source code is licensed under the MIT license found in the
+# LICENSE file in the root directory of this source tree.
+#
+
+from .state import Action
+from .state import State
+
+
+class TransitionTable(object):
+    """
+    The states of a state machine, compiled into lists indexed by the
+    position of each state: its action, the guard that decides whether it
+    transitions, and the index of its target state.
+
+    The table is compiled (and validated) once when the state machine is
+    built, so updating the state machine, or checking whether its current
+    state is an end state, only indexes lists. A state machine is rejected
+    when a state has an unknown action, targets a state that does not
+    exist, or can return to itself through its targets, since its counters
+    and transition times would never let it transition again.
+    """
+
+    END = -1
+    #
+    # Longer cycles are reported by their first and last states.
+    #
+    MAX_CYCLE_NAMES = 8
+
+    def __init__(self, states):
+        """
+        Args:
+            states (list): The states of the state machine, in order
+
+        Raises:
+            - RuntimeError if the state machine is invalid
+        """
+        self.states = list(states)
+        self.names = [state.name for state in self.states]
+        self._indexes = {}
+
+        errors = []
+        for index, name in enumerate(self.names):
+            if name in self._indexes:
+                errors.append(f'{name} is defined more than once')
+            else:
+                self._indexes[name] = index
+
+        self.actions = []
+        self.guards = []
+        self.is_async = []
+        self.is_end = []
+        self.targets = []
+        for state in self.states:
+            self._compile(state, errors)
+
+        if not errors:
+            self._check_cycles(errors)
+
+        if errors:
+            raise RuntimeError(f'Invalid state machine: {"; ".join(errors)}')
+
+    def index(self, name):
+        """
+        Returns the index of the state named `name`.
+
+        Raises:
+            - RuntimeError if there is no such state
+        """
+        try:
+            return self._indexes[name]
+        except KeyError:
+            raise RuntimeError(f'{name} is not a state of the state machine')
+
+    def update(self, index):
+        """
+        Applies the action of the state at `index`.
+
+        Returns:
+            The index of the state that it transitioned to, or `index` if
+            it did not transition
+        """
+        state = self.states[index]
+        action = self.actions[index]
+        if action is not None:
+            action(state)
+
+        if self.guards[index](state):
+            return self.targets[index]
+
+        return index
+
+    def __len__(self):
+        return len(self.states)
+
+    def _check_cycles(self, errors):
+        """
+        Follows the targets of every state once; each state has at most
+        one target, so the states visited from a state form a path, and
+        a cycle is a path that reaches one of its own states.
+        """
+        #
+        # 0: not visited, 1: on the current path, 2: leads to an end state
+        #
+        marks = [0] * len(self.states)
+        for start in range(len(self.states)):
+            path = []
+            index = start
+            while index != self.END and marks[index] == 0:
+                marks[index] = 1
+                path.append(index)
+                index = self.targets[index]
+
+            if index != self.END and marks[index] == 1:
+                cycle = [self.names[i] for i in path[path.index(index):]]
+                if len(cycle) > self.MAX_CYCLE_NAMES:
+                    cycle = cycle[:2] + ['...'] + cycle[-1:]
+
+                errors.append(f'{" -> ".join(cycle + cycle[:1])} is a cycle')
+
+            for visited in path:
+                marks[visited] = 2
+
+    def _compile(self, state, errors):
+        if state.is_end_state:
+            self.actions.append(None)
+            self.guards.append(None)
+            self.is_async.append(False)
+            self.is_end.append(True)
+            self.targets.append(self.END)
+            return
+
+        if state.action not in State.GUARDS:
+            errors.append(f'{state.name} has an unknown action {state.action}')
+
+        target = self._indexes.get(state.target.name, self.END)
+        if target == self.END:
+            errors.append(
+                f'{state.name} targets {state.target.name}, which is not a '
+                f'state'
+            )
+
+        if state.action == Action.INCREMENT.value:
+            try:
+                state.current
+            except KeyError:
+                errors.append(f'{state.name} has no current value to count')
+
+        if state.is_async:
+            try:
+                state.transition_time
+            except (TypeError, ValueError):
+                errors.append(
+                    f'{state.name} has an invalid transition time '
+                    f'{state.target.when.value}'
+                )
+
+        self.actions.append(State.ACTIONS.get(state.action))
+        self.guards.append(State.GUARDS.get(state.action))
+        self.is_async.append(state.is_async)
+        self.is_end.append(False)
+        self.targets.append(target)
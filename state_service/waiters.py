@@ -0,0 +1,121 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+
+#
+# Copyright (c) Facebook, Inc. and its affiliates.
+#
+# This source code is licensed under the MIT license found in the
+# LICENSE file in the root directory of this source tree.
+#
+
+import asyncio
+import threading
+
+
+class StateWaiters(object):
+    """
+    Parks asyncio requests until a state of a state machine becomes the
+    current state.
+
+    A waiter is a future, so a parked request costs a few hundred bytes
+    rather than a thread. Waiters are grouped by the state that they wait
+    for, and the state machine has a single observer for all of them, so a
+    transition only wakes the requests that wait for the new state.
+    """
+
+    def __init__(self, machine, executor=None):
+        """
+        Args:
+            machine (StateMachine): The state machine to wait for
+            executor (Executor): Reads state machines that other processes
+                update; the event loop's default executor if None
+        """
+        self._executor = executor
+        self._lock = threading.Lock()
+        self._machine = machine
+        self._waiters = {}
+        machine.add_observer(self._did_enter_state)
+
+    async def wait(self, name, timeout):
+        """
+        Waits until `name` is the current state, or `timeout` seconds.
+
+        Returns:
+            True if `name` is the current state
+        """
+        loop = asyncio.get_running_loop()
+        deadline = loop.time() + timeout
+
+        while True:
+            #
+            # The future is registered before the current state is read,
+            # so that a transition in between is not missed.
+            #
+            future = loop.create_future()
+            with self._lock:
+                self._waiters.setdefault(name, set()).add(future)
+
+            try:
+                if await self._is_current_state(loop, name):
+                    return True
+
+                remaining = deadline - loop.time()
+                if remaining <= 0:
+                    return False
+
+                #
+                # Other processes that update the state machine do not
+                # notify this process, so it is read again periodically.
+                #
+                if self._machine.is_shared:
+                    remaining = min(remaining, self._machine.POLL_INTERVAL)
+
+                await asyncio.wait([future], timeout=remaining)
+            finally:
+                self._discard(name, future)
+
+    def __len__(self):
+        """
+        Returns the number of parked requests.
+        """
+        with self._lock:
+            return sum(len(futures) for futures in self._waiters.values())
+
+    async def _is_current_state(self, loop, name):
+        #
+        # Reading a state machine that other processes update queries its
+        # storage, so it is read off the event loop.
+        #
+        if self._machine.is_shared:
+            return await loop.run_in_executor(
+                self._executor, self._machine.is_current_state, name)
+
+        return self._machine.is_current_state(name)
+
+    def _did_enter_state(self, name):
+        """
+        Wakes the requests that wait for `name`; called by the state
+        machine, from any thread.
+        """
+        with self._lock:
+            futures = self._waiters.pop(name, ())
+
+        for future in futures:
+            try:
+                future.get_loop().call_soon_threadsafe(_resolve, future)
+            except RuntimeError:
+                # The event loop was closed.
+                pass
+
+    def _discard(self, name, future):
+        with self._lock:
+            futures = self._waiters.get(name)
+            if futures is not None:
+                futures.discard(future)
+                if not futures:
+                    del self._waiters[name]
+
+
+def _resolve(future):
+    if not future.done():
+        future.set_result(True)
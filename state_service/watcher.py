@@ -0,0 +1,135 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+
+#
+# Copyright (c) Facebook, Inc. and its affiliates.
+#
+# This source code is licensed under the MIT license found in the
+# LICENSE file in the root directory of this source tree.
+#
+
+import logging
+import os
+import threading
+
+#
+# inotify is used to apply changes as soon as they are made, where it is
+# available. Otherwise, the directories are polled.
+#
+try:
+    import inotify_simple
+except ImportError:
+    inotify_simple = None
+
+
+class ModelWatcher(object):
+    """
+    Watches the configuration and models directories of a state machine in
+    a background thread, and asks the state machine to apply changes to
+    its models' configuration files and serialized models.
+    """
+
+    DEFAULT_INTERVAL = 2.0
+
+    def __init__(self, machine, paths, interval=DEFAULT_INTERVAL):
+        """
+        Args:
+            machine (StateMachine): Applies changes with `reload_models`
+            paths (list): Directories to watch
+            interval (float): Seconds between scans of the directories
+        """
+        self._inotify = None
+        self._interval = interval
+        self._logger = None
+        self._machine = machine
+        self._paths = paths
+        self._stopped = threading.Event()
+        self._thread = None
+
+    def poll(self):
+        """
+        Applies changes to the watched directories.
+
+        Returns:
+            dict: The names of models that were added, changed or removed,
+            or None if the changes could not be applied
+        """
+        try:
+            changes = self._machine.reload_models()
+        except Exception as e:
+            self.logger.exception(f'Unable to reload models: {str(e)}')
+            return None
+
+        if any(changes.values()):
+            self.logger.info(f'Reloaded models: {changes}')
+
+        return changes
+
+    def start(self):
+        if self._thread is None:
+            self._stopped.clear()
+            self._inotify = self._create_inotify()
+            self._thread = threading.Thread(target=self._run, daemon=True)
+            self._thread.start()
+
+    def stop(self):
+        self._stopped.set()
+        if self._thread is not None:
+            self._thread.join()
+            self._thread = None
+
+        if self._inotify is not None:
+            self._inotify.close()
+            self._inotify = None
+
+    @property
+    def logger(self):
+        if self._logger is None:
+            self._logger = logging.getLogger(self.__class__.__name__)
+
+        return self._logger
+
+    def _create_inotify(self):
+        if inotify_simple is None:
+            return None
+
+        flags = inotify_simple.flags
+        mask = flags.CREATE | flags.DELETE | flags.MODIFY | \
+            flags.MOVED_FROM | flags.MOVED_TO | flags.CLOSE_WRITE
+        inotify = inotify_simple.INotify()
+        for path in self._paths:
+            for directory in self._directories(path):
+                inotify.add_watch(directory, mask)
+
+        return inotify
+
+    def _directories(self, path):
+        """
+        Returns `path` and its subdirectories, e.g., the team directories
+        of the models directory.
+        """
+        if not os.path.isdir(path):
+            return []
+
+        return [path] + [
+            entry.path for entry in os.scandir(path) if entry.is_dir()
+        ]
+
+    def _run(self):
+        while not self._stopped.is_set():
+            self._wait()
+            if not self._stopped.is_set():
+                self.poll()
+
+    def _wait(self):
+        if self._inotify is None:
+            self._stopped.wait(self._interval)
+            return
+
+        #
+        # Wait for the first event and then for the burst of events that
+        # a single change (e.g., an editor saving a file) usually makes.
+        #
+        timeout = int(self._interval * 1000)
+        if self._inotify.read(timeout=timeout):
+            self._inotify.read(timeout=50)
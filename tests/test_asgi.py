@@ -0,0 +1,267 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+
+#
+# Copyright (c) Facebook, Inc. and its affiliates.
+#
+# This source code is licensed under the MIT license found in the
+# LICENSE file in the root directory of this source tree.
+#
+
+import asyncio
+import json
+import os
+import tempfile
+import threading
+
+from unittest import mock
+from unittest import TestCase
+
+from .test_fixtures import argparse_fixture
+from .test_fixtures import normal_machine_fixture
+from ..state_service.asgi import AsgiApplication
+from ..state_service.state_service import state_service
+
+
+class TestAsgiApplication(TestCase):
+
+    machine_module = 'state_service.state_service.state_machine.StateMachine'
+    patched_is_shared_func = f'{machine_module}.is_shared'
+    patched_predict_func = f'{machine_module}.predict'
+    patched_read_machine_func = f'{machine_module}._read_machine'
+    patched_write_machine_func = f'{machine_module}._write_machine'
+
+    def setUp(self):
+        self.app = AsgiApplication(state_service)
+        self.options = mock.patch.object(
+            state_service, '_options', argparse_fixture()[0])
+        self.options.start()
+
+    def tearDown(self):
+        self.options.stop()
+        state_service._machine = None
+        state_service._profile_token = None
+        state_service._profiler = None
+        state_service._registry = None
+
+    def request(self, method, path, body=b'', headers=()):
+        path, _, query = path.partition('?')
+        scope = {
+            'type': 'http',
+            'method': method,
+            'path': path,
+            'query_string': query.encode('latin-1'),
+            'headers': list(headers),
+            'client': ('127.0.0.1', 50000),
+        }
+        messages = [{'type': 'http.request', 'body': body}]
+        sent = []
+
+        async def receive():
+            return messages.pop(0)
+
+        async def send(message):
+            sent.append(message)
+
+        asyncio.run(self.app(scope, receive, send))
+        self.headers = dict(sent[0]['headers'])
+        return sent[0]['status'], sent[1]['body']
+
+    def lifespan(self, *events):
+        messages = [{'type': f'lifespan.{event}'} for event in events]
+        sent = []
+
+        async def receive():
+            return messages.pop(0)
+
+        async def send(message):
+            sent.append(message['type'])
+
+        asyncio.run(self.app({'type': 'lifespan'}, receive, send))
+        return sent
+
+    @mock.patch(patched_read_machine_func, return_value=normal_machine_fixture())
+    @mock.patch(patched_write_machine_func, return_value=None)
+    def test_get_and_put_state_behave_as_the_flask_application(self, *patch):
+        expected = ['lifespan.startup.complete', 'lifespan.shutdown.complete']
+        self.assertEqual(expected, self.lifespan('startup', 'shutdown'))
+
+        self.assertEqual((200, b'state_1'),
+                         self.request('GET', '/state?state=state_1'))
+        self.assertEqual((200, b'state_1'),
+                         self.request('PUT', '/state?state=state_1'))
+        self.assertEqual((200, b'state_1'),
+                         self.request('PUT', '/state?state=state_1'))
+        self.assertEqual((406, b''),
+                         self.request('GET', '/state?state=state_1'))
+        self.assertEqual((500, b''), self.request('GET', '/state'))
+
+    def test_get_machines_and_model_statistics(self):
+        with tempfile.TemporaryDirectory() as directory:
+            state_service._options.machines = directory
+            open(os.path.join(directory, 'rollout.yaml'), 'w').close()
+
+            status, body = self.request('GET', '/machines')
+            self.assertEqual(200, status)
+            self.assertEqual({'machines': ['rollout']}, json.loads(body))
+
+        status, body = self.request('GET', '/models/cache')
+        self.assertEqual(200, status)
+        self.assertIn('hits', json.loads(body))
+
+        status, body = self.request('GET', '/models/batches')
+        self.assertEqual(200, status)
+        self.assertEqual({}, json.loads(body))
+
+    def test_shutdown_closes_the_named_state_machines(self):
+        with mock.patch.object(state_service, '_registry') as registry, \
+                mock.patch.object(state_service, '_machine') as machine:
+            self.lifespan('shutdown')
+
+        machine.close.assert_called_once()
+        registry.close.assert_called_once()
+
+    @mock.patch(patched_read_machine_func, return_value=normal_machine_fixture())
+    @mock.patch(patched_write_machine_func, return_value=None)
+    def test_get_state_returns_304_until_the_version_changes(self, *patch):
+        state_service._initialize()
+
+        self.assertEqual((200, b'state_1'),
+                         self.request('GET', '/state?state=state_1'))
+        self.assertEqual(b'"0"', self.headers[b'etag'])
+
+        headers = [(b'if-none-match', b'"0"')]
+        self.assertEqual((304, b''),
+                         self.request('GET', '/state?state=state_1',
+                                      headers=headers))
+
+        state_service.machine.update()
+        self.assertEqual((200, b'state_1'),
+                         self.request('GET', '/state?state=state_1',
+                                      headers=headers))
+        self.assertEqual(b'"1"', self.headers[b'etag'])
+
+    @mock.patch(patched_predict_func, return_value='walk')
+    def test_post_state_returns_predicted_state(self, mock_predict):
+        body = json.dumps({'name': 'fixture', 'values': [[100, 0]]})
+        status, body = self.request('POST', '/state', body.encode('utf-8'))
+
+        self.assertEqual(200, status)
+        self.assertEqual({'state': 'walk'}, json.loads(body))
+        mock_predict.assert_called_once_with(
+            'fixture', [[100, 0]], coalesce=True)
+
+        status, body = self.request('POST', '/state', b'not json')
+        self.assertEqual(500, status)
+
+    @mock.patch(patched_read_machine_func, return_value=normal_machine_fixture())
+    @mock.patch(patched_write_machine_func, return_value=None)
+    def test_get_events_streams_until_the_client_disconnects(self, *patch):
+        state_service._initialize()
+        machine = state_service.machine
+        scope = {
+            'type': 'http',
+            'method': 'GET',
+            'path': '/state/events',
+            'query_string': b'',
+            'headers': [(b'last-event-id', b'0')],
+        }
+
+        async def stream():
+            disconnected = asyncio.Event()
+            bodies = asyncio.Queue()
+
+            async def receive():
+                await disconnected.wait()
+                return {'type': 'http.disconnect'}
+
+            async def send(message):
+                await bodies.put(message)
+
+            task = asyncio.ensure_future(self.app(scope, receive, send))
+            start = await bodies.get()
+            first = await bodies.get()
+
+            loop = asyncio.get_running_loop()
+            await loop.run_in_executor(None, machine.update)
+            second = await bodies.get()
+
+            disconnected.set()
+            await asyncio.wait_for(task, 5)
+            return start, first, second
+
+        start, first, second = asyncio.run(stream())
+
+        self.assertEqual(200, start['status'])
+        self.assertIn((b'content-type', b'text/event-stream'), start['headers'])
+        self.assertEqual(b': keepalive\n\n', first['body'])
+        self.assertTrue(first['more_body'])
+        self.assertTrue(second['body'].startswith(b'event: update\n'))
+        self.assertTrue(second['body'].endswith(b'id: 1\n\n'))
+
+    @mock.patch(patched_read_machine_func, return_value=normal_machine_fixture())
+    def test_shared_state_machines_are_read_off_the_event_loop(self, *patch):
+        state_service._initialize()
+        check_state = state_service._check_state
+        threads = []
+
+        def record_thread(*args):
+            threads.append(threading.get_ident())
+            return check_state(*args)
+
+        with mock.patch.object(state_service, '_check_state', record_thread):
+            self.request('GET', '/state?state=state_1')
+            with mock.patch(self.patched_is_shared_func,
+                            new_callable=mock.PropertyMock,
+                            return_value=True):
+                self.assertEqual((200, b'state_1'),
+                                 self.request('GET', '/state?state=state_1'))
+
+        self.assertEqual(threading.get_ident(), threads[0])
+        self.assertNotEqual(threading.get_ident(), threads[1])
+
+    @mock.patch(patched_read_machine_func, return_value=normal_machine_fixture())
+    def test_get_metrics_reports_request_durations(self, *patch):
+        state_service._initialize()
+        self.request('GET', '/machines/unknown/state?state=state_1')
+
+        status, body = self.request('GET', '/metrics')
+
+        self.assertEqual(200, status)
+        self.assertTrue(self.headers[b'content-type'].startswith(b'text/plain'))
+        self.assertIn(
+            b'state_service_request_duration_seconds_count'
+            b'{route="get_machine_state",status="404"}',
+            body,
+        )
+
+    @mock.patch(patched_read_machine_func, return_value=normal_machine_fixture())
+    def test_post_profile_profiles_the_next_requests(self, *patch):
+        with tempfile.TemporaryDirectory() as directory:
+            state_service._options.profile_dir = directory
+            state_service._options.profile_token_file = os.path.join(
+                directory, 'token')
+            with open(state_service._options.profile_token_file, 'w') as f:
+                f.write('secret')
+
+            state_service._initialize()
+
+            status, _ = self.request('POST', '/profile?requests=1')
+            self.assertEqual(403, status)
+
+            status, body = self.request(
+                'POST', '/profile?requests=1',
+                headers=[(b'x-profile-token', b'secret')],
+            )
+            self.assertEqual(202, status)
+            thread = state_service._profiler._thread
+
+            self.request('GET', '/state?state=state_1')
+            thread.join(5)
+
+            self.assertFalse(state_service._profiler.active)
+            self.assertTrue(os.path.exists(json.loads(body)['path']))
+
+    def test_unknown_routes_return_404(self):
+        self.assertEqual(404, self.request('GET', '/unknown')[0])
+        self.assertEqual(404, self.request('DELETE', '/state')[0])
@@ -0,0 +1,93 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+
+#
+# Copyright (c) Facebook, Inc. and its affiliates.
+#
+# This source code is licensed under the MIT license found in the
+# LICENSE file in the root directory of this source tree.
+#
+
+import json
+import os
+import tempfile
+
+from unittest import TestCase
+
+from ..benchmarks.runner import compare
+from ..benchmarks.runner import main
+from ..benchmarks.runner import Runner
+from ..benchmarks.suite import Environment
+from ..state_service.state_service import state_service
+
+
+class TestBenchmarks(TestCase):
+
+    def result(self, benchmark_id, seconds):
+        return {'id': benchmark_id, 'min': seconds, 'median': seconds}
+
+    def test_environment_serves_a_state_machine_that_never_ends(self):
+        options = state_service._options
+        env = Environment(machine_size=10)
+        try:
+            self.assertEqual(200, env.client.put('/state?state=state_0')
+                             .status_code)
+            self.assertEqual(10, len(env.machine.states))
+        finally:
+            env.close()
+
+        self.assertIs(options, state_service._options)
+
+    def test_runner_times_every_parameter_value(self):
+        results = Runner(repeat=1).run(
+            ['get_state', 'create_states'],
+            {'machine_size': [3, 5], 'batch_size': [2]},
+        )
+
+        expected = [
+            'get_state[machine_size=3]',
+            'get_state[machine_size=5]',
+            'create_states[batch_size=2]',
+        ]
+        self.assertEqual(expected, [result['id'] for result in results])
+        for result in results:
+            self.assertGreater(result['min'], 0)
+            self.assertGreaterEqual(result['median'], result['min'])
+
+    def test_compare_reports_results_slower_than_the_tolerance(self):
+        baseline = {'results': [
+            self.result('get_state[machine_size=3]', 1.0),
+            self.result('save[machine_size=3]', 1.0),
+        ]}
+        results = [
+            self.result('get_state[machine_size=3]', 1.05),
+            self.result('save[machine_size=3]', 1.5),
+            self.result('save[machine_size=100]', 9.0),
+        ]
+
+        comparisons, regressions = compare(results, baseline, 0.1)
+
+        self.assertEqual(2, len(comparisons))
+        self.assertEqual(['save[machine_size=3]'], regressions)
+
+    def test_main_writes_results_and_fails_on_regressions(self):
+        with tempfile.TemporaryDirectory() as directory:
+            output = os.path.join(directory, 'results.json')
+            args = [
+                '--benchmarks', 'deserialize_model', '--model-sizes', '10',
+                '--repeat', '1', '--output', output,
+            ]
+            self.assertEqual(0, main(args))
+
+            with open(output) as f:
+                document = json.load(f)
+
+            self.assertEqual(['deserialize_model[model_size=10]'],
+                             [result['id'] for result in document['results']])
+
+            document['results'][0]['min'] /= 100
+            baseline = os.path.join(directory, 'baseline.json')
+            with open(baseline, 'w') as f:
+                json.dump(document, f)
+
+            self.assertEqual(1, main(args + ['--baseline', baseline]))
@@ -0,0 +1,65 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+
+#
+# Copyright (c) Facebook, Inc. and its affiliates.
+#
+# This source code is licensed under the MIT license found in the
+# LICENSE file in the root directory of this source tree.
+#
+
+import threading
+
+from unittest import mock
+from unittest import TestCase
+
+from ..state_service.coalescer import PredictionCoalescer
+
+
+class TestPredictionCoalescer(TestCase):
+
+    def setUp(self):
+        self.predict = mock.Mock(
+            side_effect=lambda name, rows: [row[0] for row in rows]
+        )
+        self.coalescer = PredictionCoalescer(self.predict)
+
+    def tearDown(self):
+        self.coalescer = None
+
+    def test_predict_returns_predictions_for_a_single_request(self):
+        actual = self.coalescer.predict('fixture', [[1, 0], [2, 0]], window=0)
+
+        self.assertEqual([1, 2], actual)
+        self.predict.assert_called_once_with('fixture', [[1, 0], [2, 0]])
+
+    def test_predict_merges_concurrent_requests(self):
+        results = {}
+
+        def request(value):
+            results[value] = self.coalescer.predict(
+                'fixture', [[value, 0]], window=5, max_batch_size=4,
+            )
+
+        threads = [
+            threading.Thread(target=request, args=(value,))
+            for value in range(4)
+        ]
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join()
+
+        self.predict.assert_called_once()
+        self.assertEqual({value: [value] for value in range(4)}, results)
+
+        expected = {'batches': 1, 'rows': 4, 'largest': 4, 'mean': 4.0}
+        self.assertEqual(expected, self.coalescer.stats['fixture'])
+
+    def test_predict_raises_the_error_of_the_model(self):
+        self.predict.side_effect = RuntimeError('No model is available')
+
+        with self.assertRaises(RuntimeError):
+            self.coalescer.predict('fixture', [[1, 0]], window=0)
+
+        self.assertEqual(1, self.coalescer.stats['fixture']['batches'])
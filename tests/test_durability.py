@@ -0,0 +1,47 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+
+#
+# Copyright (c) Facebook, Inc. and its affiliates.
+#
+# This source code is licensed under the MIT license found in the
+# LICENSE file in the root directory of this source tree.
+#
+
+import threading
+
+from unittest import TestCase
+
+from ..state_service.durability import Flusher
+from ..state_service.durability import GroupCommit
+
+
+class TestGroupCommit(TestCase):
+
+    def test_commit_raises_the_error_of_its_round(self):
+        def persist():
+            raise OSError('disk full')
+
+        group_commit = GroupCommit(persist, window=0)
+
+        with self.assertRaises(OSError):
+            group_commit.commit()
+
+
+class TestFlusher(TestCase):
+
+    def test_close_flushes_pending_updates(self):
+        calls = []
+        flusher = Flusher(lambda: calls.append(1), interval=60)
+        flusher.notify()
+        flusher.close()
+
+        self.assertGreaterEqual(len(calls), 1)
+
+    def test_notify_flushes_in_the_background(self):
+        flushed = threading.Event()
+        flusher = Flusher(flushed.set, interval=0)
+        flusher.notify()
+
+        self.assertTrue(flushed.wait(5))
+        flusher.close()
@@ -0,0 +1,114 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+
+#
+# Copyright (c) Facebook, Inc. and its affiliates.
+#
+# This source code is licensed under the MIT license found in the
+# LICENSE file in the root directory of this source tree.
+#
+
+import asyncio
+import threading
+
+from unittest import mock
+from unittest import TestCase
+
+from .test_fixtures import argparse_fixture
+from .test_fixtures import normal_machine_fixture
+from ..state_service.events import EventPublisher
+from ..state_service.events import Lagged
+from ..state_service.state_machine import StateMachine
+
+
+class TestEventPublisher(TestCase):
+
+    machine_module = 'state_service.state_service.state_machine.StateMachine'
+    patched_machine_func = f'{machine_module}._read_machine'
+    patched_save_func = f'{machine_module}.save'
+
+    def setUp(self):
+        self.publisher = EventPublisher(size=4)
+
+    def tearDown(self):
+        self.publisher = None
+
+    def test_events_are_numbered_and_encoded_once(self):
+        self.publisher.publish('update', {'value': 1})
+        self.publisher.publish('update', {'value': 2})
+
+        expected = [
+            (1, b'event: update\ndata: {"value": 1}\nid: 1\n\n'),
+            (2, b'event: update\ndata: {"value": 2}\nid: 2\n\n'),
+        ]
+        self.assertEqual(expected, self.publisher.events_after(0))
+        self.assertEqual(expected[1:], self.publisher.events_after(1))
+        self.assertEqual([], self.publisher.events_after(2))
+
+    def test_subscribers_that_fall_behind_lag(self):
+        for value in range(6):
+            self.publisher.publish('update', {'value': value})
+
+        self.assertEqual([5, 6], [
+            event_id for event_id, _ in self.publisher.events_after(4)])
+
+        with self.assertRaises(Lagged):
+            self.publisher.events_after(1)
+
+        # Ids sent before a restart are ahead of the publisher.
+        with self.assertRaises(Lagged):
+            self.publisher.events_after(7)
+
+    def test_wait_returns_published_events(self):
+        self.assertEqual([], self.publisher.wait(0, 0.01))
+
+        timer = threading.Timer(
+            0.05, self.publisher.publish, ('update', {'value': 1}))
+        timer.start()
+        events = self.publisher.wait(0, 5)
+        timer.join()
+
+        self.assertEqual([1], [event_id for event_id, _ in events])
+
+    def test_wait_async_wakes_every_subscriber(self):
+        async def wait():
+            tasks = [
+                asyncio.ensure_future(self.publisher.wait_async(0, 5))
+                for _ in range(100)
+            ]
+            await asyncio.sleep(0.01)
+
+            thread = threading.Thread(
+                target=self.publisher.publish, args=('update', {}))
+            thread.start()
+            results = await asyncio.gather(*tasks)
+            thread.join()
+            return results
+
+        results = asyncio.run(wait())
+        self.assertTrue(all(len(events) == 1 for events in results))
+        self.assertEqual(0, len(self.publisher._futures))
+
+    @mock.patch(patched_machine_func, return_value=normal_machine_fixture())
+    @mock.patch(patched_save_func, return_value=True)
+    def test_machine_publishes_updates_and_transitions(self, *patch):
+        machine = StateMachine(argparse_fixture()[0])
+        machine.build()
+        publisher = machine.events
+
+        machine.update()
+        machine.update()
+
+        expected = [
+            b'event: update\n'
+            b'data: {"state": "state_1", "value": 1, "version": 1}\n'
+            b'id: 1\n\n',
+            b'event: update\n'
+            b'data: {"state": "state_1", "value": 2, "version": 2}\n'
+            b'id: 2\n\n',
+            b'event: transition\n'
+            b'data: {"from": "state_1", "to": "state_2", "version": 2}\n'
+            b'id: 3\n\n',
+        ]
+        actual = [payload for _, payload in publisher.events_after(0)]
+        self.assertEqual(expected, actual)
@@ -0,0 +1,114 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+
+#
+# Copyright (c) Facebook, Inc. and its affiliates.
+#
+# This source code is licensed under the MIT license found in the
+# LICENSE file in the root directory of this source tree.
+#
+
+import os
+import threading
+import time
+
+from concurrent.futures.process import BrokenProcessPool
+from unittest import mock
+from unittest import TestCase
+
+from .test_fixtures import argparse_fixture
+from ..state_service.executor import PredictionExecutor
+
+
+class MachineFixture(object):
+    """
+    Stands in for StateMachine in worker processes.
+    """
+
+    def __init__(self, options):
+        self.options = options
+
+    def _predict(self, model_name, values):
+        if values == 'crash':
+            os._exit(1)
+
+        return [(model_name, os.getpid(), self.options.prediction_workers)
+                for _ in values]
+
+
+class TestPredictionExecutor(TestCase):
+
+    def setUp(self):
+        options = argparse_fixture()[0]
+        self.executor = PredictionExecutor(2, MachineFixture, options)
+
+    def tearDown(self):
+        self.executor.shutdown()
+        self.executor = None
+
+    def test_predict_runs_models_in_a_worker_process(self):
+        actual = self.executor.predict('fixture', [[100, 0], [0, 100]])
+
+        self.assertEqual(2, len(actual))
+
+        name, pid, workers = actual[0]
+        self.assertEqual('fixture', name)
+        self.assertNotEqual(os.getpid(), pid)
+        self.assertEqual(0, workers)
+
+    def test_predict_routes_a_model_to_the_same_worker(self):
+        pids = {self.executor.predict('fixture', [[0]])[0][1]
+                for _ in range(4)}
+
+        self.assertEqual(1, len(pids))
+
+    def test_pools_are_created_once_by_concurrent_threads(self):
+        create_pool = self.executor._create_pool
+
+        def create_slowly():
+            time.sleep(0.01)
+            return create_pool()
+
+        with mock.patch.object(self.executor, '_create_pool',
+                               side_effect=create_slowly) as created:
+            pools = []
+            threads = [
+                threading.Thread(target=lambda: pools.append(
+                    self.executor.pools))
+                for _ in range(4)
+            ]
+            for thread in threads:
+                thread.start()
+            for thread in threads:
+                thread.join()
+
+        self.assertEqual(2, created.call_count)
+        self.assertTrue(all(p is pools[0] for p in pools))
+
+    def test_predict_replaces_a_pool_whose_worker_died(self):
+        pid = self.executor.predict('fixture', [[0]])[0][1]
+
+        with self.assertRaises(BrokenProcessPool):
+            self.executor.predict('fixture', 'crash')
+
+        with self.assertLogs('PredictionExecutor', 'WARNING'):
+            actual = self.executor.predict('fixture', [[0]])
+
+        self.assertEqual('fixture', actual[0][0])
+        self.assertNotEqual(pid, actual[0][1])
+
+    def test_predict_starts_new_pools_in_a_forked_process(self):
+        parent_pid = self.executor.predict('fixture', [[0]])[0][1]
+
+        pid = os.fork()
+        if pid == 0:
+            status = 1
+            try:
+                future = self.executor.submit('fixture', [[0]])
+                if future.result(timeout=30)[0][1] != parent_pid:
+                    status = 0
+            finally:
+                os._exit(status)
+
+        _, status = os.waitpid(pid, 0)
+        self.assertEqual(0, os.WEXITSTATUS(status))
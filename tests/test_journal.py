@@ -0,0 +1,56 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+
+#
+# Copyright (c) Facebook, Inc. and its affiliates.
+#
+# This source code is licensed under the MIT license found in the
+# LICENSE file in the root directory of this source tree.
+#
+
+import os
+import tempfile
+
+from unittest import TestCase
+
+from ..state_service.journal import Journal
+
+
+class TestJournal(TestCase):
+
+    def setUp(self):
+        self.directory = tempfile.TemporaryDirectory()
+        self.path = os.path.join(self.directory.name, 'machine.log')
+        self.journal = Journal(self.path)
+
+    def tearDown(self):
+        self.journal.close()
+        self.directory.cleanup()
+
+    def test_append_records_updates_in_order(self):
+        self.journal.append([{'current_state': 'state_1', 'values': {}}])
+        size = self.journal.append([{'current_state': 'state_2', 'values': {}}])
+
+        self.assertEqual(os.path.getsize(self.path), size)
+
+        expected = ['state_1', 'state_2']
+        actual = [r['current_state'] for r in self.journal.records()]
+        self.assertEqual(expected, actual)
+
+    def test_records_ignores_a_partial_record(self):
+        self.journal.append([{'current_state': 'state_1', 'values': {}}])
+        with open(self.path, 'ab') as f:
+            f.write(b'{"current_state": "sta')
+
+        self.assertEqual(1, len(list(self.journal.records())))
+
+    def test_discard_removes_records_before_an_offset(self):
+        offset = self.journal.append([{'current_state': 'state_1', 'values': {}}])
+        self.journal.append([{'current_state': 'state_2', 'values': {}}])
+
+        self.journal.discard(offset)
+        self.journal.append([{'current_state': 'state_3', 'values': {}}])
+
+        expected = ['state_2', 'state_3']
+        actual = [r['current_state'] for r in self.journal.records()]
+        self.assertEqual(expected, actual)
@@ -0,0 +1,50 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+
+#
+# Copyright (c) Facebook, Inc. and its affiliates.
+#
+# This source code is licensed under the MIT license found in the
+# LICENSE file in the root directory of this source tree.
+#
+
+import pickle
+
+from unittest import TestCase
+
+from .test_fixtures import normal_machine_fixture
+from ..state_service.machine_codec import BinaryCodec
+from ..state_service.machine_codec import get_codec
+from ..state_service.machine_codec import JsonCodec
+from ..state_service.machine_codec import YamlCodec
+
+
+class TestMachineCodec(TestCase):
+
+    def test_codecs_round_trip_a_state_machine(self):
+        machine = normal_machine_fixture()
+        for codec in (YamlCodec(), JsonCodec(), BinaryCodec()):
+            data = codec.dump(machine)
+
+            self.assertIsInstance(data, bytes)
+            self.assertEqual(machine, codec.load(data))
+
+    def test_binary_codec_rejects_other_files(self):
+        with self.assertRaises(ValueError):
+            BinaryCodec().load(b'current_state: state_1\n')
+
+    def test_binary_codec_does_not_read_pickles(self):
+        data = b'SSMACHINE1\n' + pickle.dumps(normal_machine_fixture())
+
+        with self.assertRaises(ValueError):
+            BinaryCodec().load(data)
+
+    def test_yaml_codec_raises_value_error_for_invalid_yaml(self):
+        with self.assertRaises(ValueError):
+            YamlCodec().load(b'states: [')
+
+    def test_get_codec_raises_runtime_error_for_unknown_format(self):
+        self.assertIsInstance(get_codec('json'), JsonCodec)
+
+        with self.assertRaises(RuntimeError):
+            get_codec('xml')
@@ -0,0 +1,65 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+
+#
+# Copyright (c) Facebook, Inc. and its affiliates.
+#
+# This source code is licensed under the MIT license found in the
+# LICENSE file in the root directory of this source tree.
+#
+
+import argparse
+import os
+import tempfile
+import yaml
+
+from unittest import mock
+from unittest import TestCase
+
+from .test_fixtures import normal_machine_fixture
+from ..state_service.machine_registry import MachineRegistry
+
+
+class TestMachineRegistry(TestCase):
+
+    machine_module = 'state_service.state_service.state_machine.StateMachine'
+    patched_build_func = f'{machine_module}.build'
+
+    def setUp(self):
+        self.directory = tempfile.TemporaryDirectory()
+        for name in ('rollout_1', 'rollout_2'):
+            path = os.path.join(self.directory.name, f'{name}.yaml')
+            with open(path, 'wt') as f:
+                yaml.dump(normal_machine_fixture(), f)
+
+        options = argparse.Namespace(machines=self.directory.name)
+        self.registry = MachineRegistry(options)
+
+    def tearDown(self):
+        self.registry.close()
+        self.directory.cleanup()
+
+    def test_names_lists_the_machines_of_the_directory(self):
+        self.assertEqual(['rollout_1', 'rollout_2'], self.registry.names())
+
+    def test_get_builds_each_machine_once_on_first_use(self):
+        with mock.patch(self.patched_build_func) as mock_build:
+            machine = self.registry.get('rollout_1')
+
+            self.assertIs(machine, self.registry.get('rollout_1'))
+            mock_build.assert_called_once()
+
+    def test_machines_have_their_own_state_and_files(self):
+        machine_1 = self.registry.get('rollout_1')
+        machine_2 = self.registry.get('rollout_2')
+        machine_1.update()
+        machine_1.update()
+
+        self.assertTrue(machine_1.is_current_state('state_2'))
+        self.assertTrue(machine_2.is_current_state('state_1'))
+        self.assertIsNot(machine_1.lock, machine_2.lock)
+
+    def test_get_returns_none_for_unknown_machines(self):
+        self.assertIsNone(self.registry.get('rollout_3'))
+        self.assertIsNone(self.registry.get('../rollout_1'))
+        self.assertIsNone(self.registry.get('.rollout_1'))
@@ -0,0 +1,86 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+
+#
+# Copyright (c) Facebook, Inc. and its affiliates.
+#
+# This source code is licensed under the MIT license found in the
+# LICENSE file in the root directory of this source tree.
+#
+
+from unittest import mock
+from unittest import TestCase
+
+from ..state_service import metrics
+from ..state_service.metrics import Gauge
+from ..state_service.metrics import Histogram
+
+
+class TestMetrics(TestCase):
+
+    def setUp(self):
+        self.histogram = Histogram(
+            'test_seconds', 'Test durations.', ('route',), buckets=(0.1, 1))
+
+    def tearDown(self):
+        self.histogram = None
+
+    def test_buckets_are_cumulative(self):
+        series = self.histogram.labels('get_state')
+        for value in (0.05, 0.1, 0.5, 2):
+            series.observe(value)
+
+        expected = [
+            '# HELP test_seconds Test durations.',
+            '# TYPE test_seconds histogram',
+            'test_seconds_bucket{route="get_state",le="0.1"} 2',
+            'test_seconds_bucket{route="get_state",le="1.0"} 3',
+            'test_seconds_bucket{route="get_state",le="+Inf"} 4',
+            'test_seconds_sum{route="get_state"} 2.65',
+            'test_seconds_count{route="get_state"} 4',
+        ]
+        self.assertEqual(expected, self.histogram.collect())
+
+    def test_label_values_are_escaped(self):
+        self.histogram.labels('a"b\\c\n').observe(0)
+
+        self.assertIn('test_seconds_count{route="a\\"b\\\\c\\n"} 1',
+                      self.histogram.collect())
+
+    def test_series_expect_every_label(self):
+        with self.assertRaises(RuntimeError):
+            self.histogram.labels()
+
+        with self.assertRaises(RuntimeError):
+            self.histogram.labels('get_state', '200')
+
+    def test_timed_observes_returns_and_raises(self):
+        histogram = Histogram('test_seconds', 'Test durations.')
+
+        @metrics.timed(histogram)
+        def func(fail):
+            if fail:
+                raise ValueError()
+
+            return 1
+
+        self.assertEqual(1, func(False))
+        with self.assertRaises(ValueError):
+            func(True)
+
+        self.assertIn('test_seconds_count 2', histogram.collect())
+
+    def test_gauge_is_read_when_collected(self):
+        function = mock.Mock(return_value=3)
+        gauge = Gauge('test_timers', 'Test timers.', function)
+
+        function.assert_not_called()
+        self.assertEqual('test_timers 3.0', gauge.collect()[-1])
+
+    def test_collect_reports_every_metric(self):
+        text = metrics.collect()
+
+        self.assertTrue(text.endswith('\n'))
+        self.assertIn('# TYPE state_service_request_duration_seconds '
+                      'histogram', text)
+        self.assertIn('# TYPE state_service_pending_timers gauge', text)
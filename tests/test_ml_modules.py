@@ -0,0 +1,57 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+
+#
+# Copyright (c) Facebook, Inc. and its affiliates.
+#
+# This source code is licensed under the MIT license found in the
+# LICENSE file in the root directory of this source tree.
+#
+
+import os
+import subprocess
+import sys
+
+from unittest import TestCase
+
+from ..state_service import ml_modules
+
+
+class TestMLModules(TestCase):
+
+    def tearDown(self):
+        for name in ('fixture', 'missing'):
+            ml_modules.FRAMEWORKS.pop(name, None)
+            ml_modules._loaded.discard(name)
+
+    def test_load_frameworks_imports_registered_modules(self):
+        ml_modules.register_framework('fixture', ['colorsys'])
+        ml_modules.load_frameworks('fixture')
+
+        self.assertIn('fixture', ml_modules.loaded_frameworks())
+        self.assertIn('colorsys', sys.modules)
+
+    def test_load_frameworks_raises_an_error_for_unknown_frameworks(self):
+        with self.assertRaises(RuntimeError):
+            ml_modules.load_frameworks(['fixture'])
+
+    def test_load_frameworks_raises_an_error_for_missing_modules(self):
+        ml_modules.register_framework('missing', ['state_service_missing'])
+
+        with self.assertRaises(RuntimeError):
+            ml_modules.load_frameworks('missing')
+
+        self.assertNotIn('missing', ml_modules.loaded_frameworks())
+
+    def test_importing_state_service_does_not_import_ml_libraries(self):
+        package = __package__.rsplit('.', 1)[0]
+        code = (
+            f'import sys, {package}.state_service.state_service; '
+            f'print(any(m in sys.modules for m in ("sklearn", "pandas")))'
+        )
+        env = dict(os.environ, PYTHONPATH=os.pathsep.join(sys.path))
+        output = subprocess.check_output(
+            [sys.executable, '-c', code], env=env
+        )
+
+        self.assertEqual(b'False', output.strip())
@@ -0,0 +1,117 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+
+#
+# Copyright (c) Facebook, Inc. and its affiliates.
+#
+# This source code is licensed under the MIT license found in the
+# LICENSE file in the root directory of this source tree.
+#
+
+import os
+import tempfile
+
+from unittest import mock
+from unittest import TestCase
+
+from ..state_service.model_cache import ModelCache
+
+
+class TestModelCache(TestCase):
+
+    def setUp(self):
+        self.directory = tempfile.TemporaryDirectory()
+        self.cache = ModelCache(capacity=2)
+
+    def tearDown(self):
+        self.directory.cleanup()
+        self.cache = None
+
+    def write_model(self, name, data=b'model'):
+        path = os.path.join(self.directory.name, name)
+        with open(path, 'wb') as f:
+            f.write(data)
+
+        return path
+
+    def test_get_loads_a_model_once(self):
+        path = self.write_model('a.pkl')
+        loader = mock.Mock(return_value='a')
+
+        self.assertEqual('a', self.cache.get('a', path, loader))
+        self.assertEqual('a', self.cache.get('a', path, loader))
+
+        loader.assert_called_once()
+
+        stats = self.cache.stats
+        self.assertEqual(1, stats['hits'])
+        self.assertEqual(1, stats['misses'])
+
+    def test_get_reloads_a_model_when_its_file_changes(self):
+        path = self.write_model('a.pkl')
+        loader = mock.Mock(side_effect=['a', 'b'])
+
+        self.cache.get('a', path, loader)
+        self.write_model('a.pkl', b'a larger model')
+        actual = self.cache.get('a', path, loader)
+
+        self.assertEqual('b', actual)
+        self.assertEqual(1, self.cache.stats['reloads'])
+
+    def test_get_evicts_the_least_recently_used_model(self):
+        paths = [self.write_model(f'{name}.pkl') for name in 'abc']
+
+        self.cache.get('a', paths[0], lambda: 'a')
+        self.cache.get('b', paths[1], lambda: 'b')
+        self.cache.get('a', paths[0], lambda: 'a')
+        self.cache.get('c', paths[2], lambda: 'c')
+
+        loader = mock.Mock(return_value='b')
+        self.cache.get('b', paths[1], loader)
+        loader.assert_called_once()
+
+        self.assertEqual(2, len(self.cache))
+        self.assertEqual(2, self.cache.stats['evictions'])
+
+    def test_get_does_not_cache_missing_files(self):
+        path = os.path.join(self.directory.name, 'missing.pkl')
+        loader = mock.Mock(side_effect=FileNotFoundError(path))
+
+        with self.assertRaises(FileNotFoundError):
+            self.cache.get('missing', path, loader)
+
+        self.assertEqual(0, len(self.cache))
+
+    def test_get_with_hash_reloads_a_model_whose_contents_changed(self):
+        self.cache = ModelCache(capacity=2, use_hash=True)
+        path = self.write_model('a.pkl', b'aaaa')
+        loader = mock.Mock(side_effect=['a', 'b'])
+
+        self.cache.get('a', path, loader)
+        self.write_model('a.pkl', b'bbbb')
+        os.utime(path, ns=(0, 0))
+
+        self.assertEqual('b', self.cache.get('a', path, loader))
+
+    def test_get_with_hash_keeps_a_model_whose_contents_did_not_change(self):
+        self.cache = ModelCache(capacity=2, use_hash=True)
+        path = self.write_model('a.pkl', b'aaaa')
+        loader = mock.Mock(return_value='a')
+
+        self.cache.get('a', path, loader)
+        os.utime(path, ns=(0, 0))
+
+        self.assertEqual('a', self.cache.get('a', path, loader))
+        loader.assert_called_once()
+        self.assertEqual(0, self.cache.stats['reloads'])
+
+    def test_get_with_hash_does_not_read_the_file_on_a_hit(self):
+        self.cache = ModelCache(capacity=2, use_hash=True)
+        path = self.write_model('a.pkl')
+        self.cache.get('a', path, lambda: 'a')
+
+        with mock.patch('builtins.open') as mock_open:
+            self.assertEqual('a', self.cache.get('a', path, lambda: 'b'))
+
+        mock_open.assert_not_called()
+        self.assertEqual(1, self.cache.stats['hits'])
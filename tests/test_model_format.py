@@ -0,0 +1,63 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+
+#
+# Copyright (c) Facebook, Inc. and its affiliates.
+#
+# This source code is licensed under the MIT license found in the
+# LICENSE file in the root directory of this source tree.
+#
+
+import os
+import pickle
+import tempfile
+
+from unittest import TestCase
+
+import numpy as np
+
+from ..state_service import model_format
+
+
+class TestModelFormat(TestCase):
+
+    def setUp(self):
+        self.directory = tempfile.TemporaryDirectory()
+        self.path = os.path.join(self.directory.name, 'fixture.mpkl')
+
+    def tearDown(self):
+        self.directory.cleanup()
+
+    def test_load_model_maps_arrays_from_the_file(self):
+        model = {
+            'weights': np.arange(1000, dtype=np.float64),
+            'bias': np.ones((3, 3), dtype=np.int32),
+            'states': ['walk', 'run', 'jump'],
+        }
+        model_format.dump_model(model, self.path)
+
+        actual = model_format.load_model(self.path)
+
+        np.testing.assert_array_equal(model['weights'], actual['weights'])
+        np.testing.assert_array_equal(model['bias'], actual['bias'])
+        self.assertEqual(model['states'], actual['states'])
+        self.assertFalse(actual['weights'].flags.writeable)
+        self.assertEqual(0, actual['weights'].ctypes.data % 64)
+
+    def test_load_model_raises_an_error_for_pickled_models(self):
+        with open(self.path, 'wb') as f:
+            pickle.dump({'weights': [1, 2, 3]}, f)
+
+        with self.assertRaises(RuntimeError):
+            model_format.load_model(self.path)
+
+    def test_convert_model_converts_a_pickled_model(self):
+        source = os.path.join(self.directory.name, 'fixture.pkl')
+        with open(source, 'wb') as f:
+            pickle.dump({'weights': np.zeros(8)}, f)
+
+        model_format.convert_model(source, self.path)
+
+        actual = model_format.load_model(self.path)
+        np.testing.assert_array_equal(np.zeros(8), actual['weights'])
+        self.assertTrue(model_format.is_mapped_model(self.path))
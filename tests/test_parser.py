@@ -27,6 +27,7 @@ class TestParser(TestCase):
              '--debug',
              '--host', 'www.facebook.com',
              '--models', '/tmp/models',
+             '--model-cache-size', '4',
              '--port', '22111',
              ]
         )
@@ -46,6 +47,10 @@ class TestParser(TestCase):
         actual = options.models
         self.assertEqual(expected, actual)
 
+        expected = 4
+        actual = options.model_cache_size
+        self.assertEqual(expected, actual)
+
         expected = 22111
         actual = options.port
         self.assertEqual(expected, actual)
@@ -0,0 +1,98 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+
+#
+# Copyright (c) Facebook, Inc. and its affiliates.
+#
+# This source code is licensed under the MIT license found in the
+# LICENSE file in the root directory of this source tree.
+#
+
+import os
+import signal
+import socket
+import tempfile
+import time
+import urllib.request
+
+from unittest import TestCase
+
+from ..state_service.prefork import PreforkServer
+
+
+finalized_directory = None
+initialized_pids = []
+
+
+def app_fixture(environ, start_response):
+    start_response('200 OK', [('Content-Type', 'text/plain')])
+    initialized = int(os.getpid() in initialized_pids)
+    return [f'{os.getpid()} {initialized}'.encode('utf-8')]
+
+
+def finalizer_fixture():
+    open(os.path.join(finalized_directory, str(os.getpid())), 'w').close()
+
+
+def initializer_fixture():
+    initialized_pids.append(os.getpid())
+
+
+class TestPreforkServer(TestCase):
+
+    def setUp(self):
+        global finalized_directory
+
+        self.directory = tempfile.TemporaryDirectory()
+        finalized_directory = self.directory.name
+        with socket.socket() as sock:
+            sock.bind(('127.0.0.1', 0))
+            self.port = sock.getsockname()[1]
+
+        self.pid = os.fork()
+        if self.pid == 0:
+            try:
+                PreforkServer(
+                    app_fixture, '127.0.0.1', self.port, 2,
+                    initializer=initializer_fixture,
+                    finalizer=finalizer_fixture,
+                ).serve()
+            finally:
+                os._exit(0)
+
+    def tearDown(self):
+        if self.pid is not None:
+            self.stop()
+
+        self.directory.cleanup()
+
+    def stop(self):
+        os.kill(self.pid, signal.SIGTERM)
+        os.waitpid(self.pid, 0)
+        self.pid = None
+
+    def get(self):
+        url = f'http://127.0.0.1:{self.port}/'
+        for _ in range(100):
+            try:
+                with urllib.request.urlopen(url, timeout=5) as response:
+                    pid, initialized = response.read().split()
+                    return int(pid), bool(int(initialized))
+            except OSError:
+                time.sleep(0.05)
+
+        self.fail(f'{url} is not served')
+
+    def test_serve_responds_from_worker_processes(self):
+        worker_pid, initialized = self.get()
+
+        self.assertTrue(initialized)
+        self.assertNotEqual(self.pid, worker_pid)
+        self.assertNotEqual(os.getpid(), worker_pid)
+
+    def test_stopped_workers_are_finalized(self):
+        worker_pid, _ = self.get()
+        self.stop()
+
+        path = os.path.join(self.directory.name, str(worker_pid))
+        self.assertTrue(os.path.exists(path))
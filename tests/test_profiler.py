@@ -0,0 +1,98 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+
+#
+# Copyright (c) Facebook, Inc. and its affiliates.
+#
+# This source code is licensed under the MIT license found in the
+# LICENSE file in the root directory of this source tree.
+#
+
+import os
+import tempfile
+import threading
+import time
+
+from unittest import mock
+from unittest import TestCase
+
+from ..state_service.profiler import Profiler
+
+
+class TestProfiler(TestCase):
+
+    def setUp(self):
+        self.directory = tempfile.TemporaryDirectory()
+        self.profiler = Profiler(self.directory.name, interval=0.001)
+
+    def tearDown(self):
+        self.profiler.stop()
+        self.profiler = None
+        self.directory.cleanup()
+
+    def busy(self, stop):
+        while not stop.is_set():
+            sum(range(100))
+
+    def read(self, path):
+        with open(path) as f:
+            return f.read().splitlines()
+
+    def test_profiles_are_written_as_collapsed_stacks(self):
+        stop = threading.Event()
+        thread = threading.Thread(target=self.busy, args=(stop,))
+        thread.start()
+
+        path = self.profiler.start(seconds=5)
+        self.assertTrue(self.profiler.active)
+        time.sleep(0.05)
+        self.assertEqual(path, self.profiler.stop())
+        stop.set()
+        thread.join()
+
+        self.assertFalse(self.profiler.active)
+        self.assertEqual(self.directory.name, os.path.dirname(path))
+        self.assertTrue(path.endswith('.folded'))
+
+        stacks = dict(line.rsplit(' ', 1) for line in self.read(path))
+        busy = [stack for stack in stacks if 'busy (test_profiler.py:' in stack]
+        self.assertTrue(busy)
+        self.assertTrue(all(int(count) > 0 for count in stacks.values()))
+        self.assertTrue(busy[0].startswith('_bootstrap (threading.py:'))
+
+    def test_profiling_stops_after_seconds(self):
+        path = self.profiler.start(seconds=0.01)
+        self.profiler._thread.join()
+
+        self.assertFalse(self.profiler.active)
+        self.assertTrue(os.path.exists(path))
+
+    def test_profiling_stops_after_requests(self):
+        path = self.profiler.start(requests=2)
+        thread = self.profiler._thread
+
+        self.profiler.count_request()
+        self.assertTrue(self.profiler.active)
+        self.profiler.count_request()
+        thread.join(5)
+
+        self.assertFalse(self.profiler.active)
+        self.assertTrue(os.path.exists(path))
+
+    def test_one_profile_runs_at_a_time(self):
+        self.assertIsNotNone(self.profiler.start(seconds=5))
+        self.assertIsNone(self.profiler.start(seconds=5))
+
+        self.assertIsNotNone(self.profiler.stop())
+        self.assertIsNone(self.profiler.stop())
+
+    def test_profiles_started_in_the_same_second_have_different_paths(self):
+        with mock.patch('time.strftime', return_value='20261016-120000'):
+            first = self.profiler.start(seconds=5)
+            self.profiler.stop()
+            second = self.profiler.start(seconds=5)
+            self.profiler.stop()
+
+        self.assertNotEqual(first, second)
+        self.assertTrue(os.path.exists(first))
+        self.assertTrue(os.path.exists(second))
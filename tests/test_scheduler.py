@@ -0,0 +1,70 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+
+#
+# Copyright (c) Facebook, Inc. and its affiliates.
+#
+# This source code is licensed under the MIT license found in the
+# LICENSE file in the root directory of this source tree.
+#
+
+import threading
+
+from unittest import TestCase
+
+from ..state_service.scheduler import get_scheduler
+from ..state_service.scheduler import TimerScheduler
+
+
+class TestTimerScheduler(TestCase):
+
+    def setUp(self):
+        self.scheduler = TimerScheduler()
+
+    def tearDown(self):
+        self.scheduler.close()
+
+    def test_timers_run_in_order_of_deadline(self):
+        calls = []
+        done = threading.Event()
+        self.scheduler.schedule_many([
+            (0.03, done.set),
+            (0.02, lambda: calls.append(2)),
+            (0.01, lambda: calls.append(1)),
+        ])
+
+        self.assertTrue(done.wait(5))
+        self.assertEqual([1, 2], calls)
+
+    def test_cancelled_timers_do_not_run(self):
+        calls = []
+        done = threading.Event()
+        timer = self.scheduler.schedule(0.01, lambda: calls.append(1))
+        self.scheduler.schedule(0.02, done.set)
+        self.scheduler.cancel(timer)
+
+        self.assertTrue(done.wait(5))
+        self.assertEqual([], calls)
+        self.assertEqual(0, len(self.scheduler))
+
+    def test_many_timers_share_one_thread(self):
+        threads = threading.active_count()
+        timers = self.scheduler.schedule_many(
+            [(3600 + i, lambda: None) for i in range(100000)])
+
+        self.assertEqual(100000, len(self.scheduler))
+        self.assertEqual(threads + 1, threading.active_count())
+
+        self.scheduler.cancel_many(timers[:60000])
+        self.assertEqual(40000, len(self.scheduler))
+        self.assertEqual(40000, len(self.scheduler._heap))
+
+    def test_far_future_timers_do_not_overflow(self):
+        done = threading.Event()
+        self.scheduler.schedule(1e12, lambda: None)
+        self.scheduler.schedule(0.01, done.set)
+
+        self.assertTrue(done.wait(5))
+
+    def test_get_scheduler_returns_one_scheduler_per_process(self):
+        self.assertIs(get_scheduler(), get_scheduler())
@@ -209,6 +209,16 @@ class TestState(TestCase):
         actual = self.state._can_transition()
         self.assertTrue(actual)
 
+    @mock.patch(patched_now_func, return_value=datetime(3000, 1, 1, 1, 0))
+    def test_time_to_transition_counts_down_to_the_transition_time(
+        self, *patch
+    ):
+        self.set_up_async_state_fixture()
+
+        expected = 3610.0
+        actual = self.state.time_to_transition()
+        self.assertEqual(expected, actual)
+
     @mock.patch(patched_now_func, return_value=datetime(3000, 1, 1, 1, 0))
     def test_transition_returns_false_if_async_state_cannot_transition(
         self, *patch
@@ -240,3 +250,33 @@ class TestState(TestCase):
         self.state.update()
         actual = self.state.did_enter_state
         self.assertTrue(actual)
+
+    #
+    # Testing the representation of states
+    #
+    def test_definition_is_immutable_and_counter_is_not(self):
+        self.set_up_normal_state_fixture()
+
+        with self.assertRaises(AttributeError):
+            self.state.target.name = 'state_3'
+
+        with self.assertRaises(AttributeError):
+            self.state.target.when.value = 3
+
+        with self.assertRaises(AttributeError):
+            self.state.extra = True
+
+        self.state.current.value = 1
+        expected = {'key': 'count', 'value': 1}
+        self.assertEqual(expected, self.state.to_dict()['current'])
+
+    def test_end_state_has_no_action_current_or_target(self):
+        self.state = State({'name': 'state_3'})
+
+        self.assertTrue(self.state.is_end_state)
+        self.assertFalse(self.state.is_async)
+        self.assertEqual({'name': 'state_3'}, self.state.to_dict())
+
+        for key in ('action', 'current', 'target'):
+            with self.assertRaises(KeyError):
+                getattr(self.state, key)
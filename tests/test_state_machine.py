@@ -8,6 +8,13 @@
 # LICENSE file in the root directory of this source tree.
 #
 
+import json
+import os
+import tempfile
+import threading
+import time
+import yaml
+
 from unittest import mock
 from unittest import TestCase
 
@@ -23,13 +30,18 @@ from ..state_service.state_machine import StateMachine
 
 class TestStateMachine(TestCase):
 
+    codec_module = 'state_service.state_service.machine_codec'
     machine_module = 'state_service.state_service.state_machine.StateMachine'
     state_module = 'state_service.state_service.state.State'
     patched_deserialize_func = f'{machine_module}._deserialize_model'
+    patched_executor_class = (
+        'state_service.state_service.state_machine.PredictionExecutor'
+    )
     patched_machine_func = f'{machine_module}._read_machine'
     patched_models_func = f'{machine_module}.models'
     patched_now_func = f'{state_module}._now'
     patched_save_func = f'{machine_module}.save'
+    patched_write_machine_func = f'{machine_module}._write_machine'
 
     @mock.patch(patched_save_func, return_value=True)
     def setUp(self, *patch):
@@ -40,10 +52,50 @@ class TestStateMachine(TestCase):
     def tearDown(self):
         self.machine = None
 
+    def test_executor_is_created_once_by_concurrent_threads(self):
+        self.machine._options.prediction_workers = 2
+
+        def create_slowly(*args):
+            time.sleep(0.01)
+            return mock.Mock()
+
+        with mock.patch(self.patched_executor_class,
+                        side_effect=create_slowly) as created:
+            executors = []
+            threads = [
+                threading.Thread(target=lambda: executors.append(
+                    self.machine.executor))
+                for _ in range(4)
+            ]
+            for thread in threads:
+                thread.start()
+            for thread in threads:
+                thread.join()
+
+        created.assert_called_once()
+        self.assertTrue(all(e is executors[0] for e in executors))
+
     def test_read_machine_raises_filenotfound_error_without_path(self):
         with self.assertRaises(FileNotFoundError):
             self.machine.build()
 
+    def test_build_rejects_invalid_state_machines(self):
+        machine = normal_machine_fixture()
+        machine['states'][1]['target']['name'] = 'state_1'
+
+        with mock.patch(self.patched_machine_func, return_value=machine):
+            with self.assertRaises(RuntimeError):
+                self.machine.build()
+
+        self.assertIsNone(self.machine.machine)
+
+        machine = normal_machine_fixture()
+        machine['current_state'] = 'state_4'
+
+        with mock.patch(self.patched_machine_func, return_value=machine):
+            with self.assertRaises(RuntimeError):
+                self.machine.build()
+
     @mock.patch(patched_machine_func, return_value=normal_machine_fixture())
     def test_state_machine_calls_save_without_transition(self, *patch):
         self.machine.build()
@@ -188,3 +240,329 @@ class TestStateMachine(TestCase):
         actual = self.machine.predict('fixture', [100, 0])
 
         self.assertEqual(expected, actual)
+
+    @mock.patch(patched_deserialize_func, return_value=deserialize_model_fixture())
+    def test_predict_reuses_a_cached_model(self, mock_deserialize):
+        type(self.machine).models = mock.PropertyMock(
+            return_value=models_fixture()
+        )
+
+        with tempfile.TemporaryDirectory() as models_path:
+            os.makedirs(os.path.join(models_path, 'state_service'))
+            model_path = os.path.join(models_path, 'state_service', 'fixture.pkl')
+            with open(model_path, 'wb') as f:
+                f.write(b'model')
+
+            self.machine._options.models = models_path
+            self.machine.predict('fixture', [100, 0])
+            self.machine.predict('fixture', [100, 0])
+
+        mock_deserialize.assert_called_once()
+        self.assertEqual(1, self.machine.model_cache.stats['hits'])
+
+    @mock.patch(patched_deserialize_func, return_value=deserialize_model_fixture())
+    def test_predict_batch_raises_an_error_when_predictions_are_missing(
+        self, *patch
+    ):
+        type(self.machine).models = mock.PropertyMock(
+            return_value=models_fixture()
+        )
+
+        with self.assertRaises(RuntimeError):
+            self.machine.predict_batch('fixture', [[100, 0], [0, 100]])
+
+    @mock.patch(patched_deserialize_func, return_value=deserialize_model_fixture())
+    def test_predict_coalesces_when_the_model_is_configured_to(self, *patch):
+        models = models_fixture()
+        models['fixture']['coalesce'] = {'window_ms': 0, 'max_batch_size': 1}
+        type(self.machine).models = mock.PropertyMock(return_value=models)
+
+        expected = ['run']
+        actual = self.machine.predict('fixture', [100, 0])
+
+        self.assertEqual(expected, actual)
+        self.assertEqual(1, self.machine.coalescer.stats['fixture']['rows'])
+
+    @mock.patch(patched_deserialize_func, return_value=deserialize_model_fixture())
+    def test_predict_does_not_coalesce_unless_asked_to(self, *patch):
+        models = models_fixture()
+        models['fixture']['coalesce'] = {'window_ms': 60000}
+        type(self.machine).models = mock.PropertyMock(return_value=models)
+
+        expected = ['run']
+        actual = self.machine.predict('fixture', [100, 0], coalesce=False)
+
+        self.assertEqual(expected, actual)
+        self.assertEqual({}, self.machine.coalescer.stats)
+
+    def test_predict_raises_the_error_of_the_model(self):
+        type(self.machine).models = mock.PropertyMock(
+            side_effect=RuntimeError('Unable to read the configuration'))
+        error = ValueError('X has 1 features, but expects 2')
+
+        with mock.patch.object(self.machine, '_predict', side_effect=error):
+            with self.assertRaises(ValueError):
+                self.machine.predict_batch('fixture', [[100]])
+
+    def test_predict_returns_when_it_cannot_be_observed(self):
+        type(self.machine).models = mock.PropertyMock(
+            return_value=models_fixture())
+
+        with mock.patch.object(self.machine, '_predict',
+                               return_value=['run']), \
+                mock.patch('state_service.state_service.metrics.'
+                           'PREDICT_SECONDS.labels',
+                           side_effect=RuntimeError('metrics failed')):
+            self.assertEqual(['run'], self.machine.predict('fixture', [1]))
+
+    @mock.patch(patched_deserialize_func, return_value=deserialize_model_fixture())
+    def test_preload_loads_and_warms_up_every_model(self, mock_deserialize):
+        models = models_fixture()
+        models['fixture']['warmup'] = [100, 0]
+        models['missing'] = {
+            'name': 'missing',
+            'team': 'state_service',
+            'states': [],
+        }
+        type(self.machine).models = mock.PropertyMock(return_value=models)
+
+        with mock.patch.object(self.machine, '_predict') as mock_predict:
+            errors = self.machine.preload()
+
+        mock_deserialize.assert_called_once()
+        mock_predict.assert_called_once_with('fixture', [[100, 0]])
+        self.assertEqual(['missing'], list(errors))
+
+    def test_reload_models_applies_only_changes(self):
+        with tempfile.TemporaryDirectory() as config_path:
+            self.machine._options.config = config_path
+
+            def write_config(filename, conf):
+                with open(os.path.join(config_path, filename), 'w') as f:
+                    json.dump(conf, f)
+
+            fixture = models_fixture()['fixture']
+            write_config('fixture.json', fixture)
+            write_config('other.json', dict(fixture, name='other'))
+
+            changes = self.machine.reload_models()
+            self.assertEqual(['fixture', 'other'], changes['added'])
+
+            write_config('fixture.json', dict(fixture, states=['walk']))
+            os.remove(os.path.join(config_path, 'other.json'))
+
+            with mock.patch.object(self.machine, '_read_config',
+                                   wraps=self.machine._read_config) as read:
+                changes = self.machine.reload_models()
+                read.assert_called_once()
+
+        expected = {'added': [], 'changed': ['fixture'], 'removed': ['other']}
+        self.assertEqual(expected, changes)
+        self.assertEqual(['walk'], self.machine._models['fixture']['states'])
+
+    @mock.patch(patched_machine_func, return_value=normal_machine_fixture())
+    @mock.patch(patched_save_func, return_value=True)
+    def test_shared_state_machine_is_updated_by_other_processes(self, *patch):
+        self.machine.build()
+        self.machine.share()
+
+        pid = os.fork()
+        if pid == 0:
+            self.machine.update()
+            self.machine.update()
+            os._exit(0)
+
+        os.waitpid(pid, 0)
+
+        self.assertTrue(self.machine.is_current_state('state_2'))
+        self.assertEqual(2, self.machine.states['state_1'].current.value)
+
+    @mock.patch(patched_machine_func, return_value=normal_machine_fixture())
+    @mock.patch(patched_write_machine_func)
+    def test_journal_records_updates_and_replays_them(self, mock_write, *patch):
+        with tempfile.TemporaryDirectory() as directory:
+            self.machine._options.journal = os.path.join(directory, 'log')
+            self.machine.build()
+            self.machine.update()
+            self.machine.update()
+            self.machine.journal.close()
+
+            mock_write.assert_not_called()
+
+            machine = StateMachine(self.machine._options)
+            machine.build()
+            machine.journal.close()
+
+        self.assertTrue(machine.is_current_state('state_2'))
+        self.assertEqual(2, machine.states['state_1'].current.value)
+
+    @mock.patch(patched_machine_func, return_value=normal_machine_fixture())
+    @mock.patch(patched_write_machine_func)
+    def test_compact_writes_a_snapshot_and_discards_records(
+        self, mock_write, *patch
+    ):
+        with tempfile.TemporaryDirectory() as directory:
+            self.machine._options.journal = os.path.join(directory, 'log')
+            self.machine.build()
+            self.machine.update()
+            self.machine.compact()
+
+            self.assertEqual(0, self.machine.journal.size)
+            self.machine.journal.close()
+
+        data = mock_write.call_args[0][0]
+        self.assertEqual('state_1', data['current_state'])
+        self.assertEqual(1, data['states'][0]['current']['value'])
+
+    @mock.patch(patched_machine_func, return_value=normal_machine_fixture())
+    @mock.patch(patched_write_machine_func)
+    def test_sync_durability_flushes_each_update(self, mock_write, *patch):
+        self.machine._options.durability = 'sync'
+        self.machine.build()
+
+        with mock.patch('os.fsync') as mock_fsync:
+            with tempfile.TemporaryDirectory() as directory:
+                self.machine._options.journal = os.path.join(directory, 'log')
+                self.machine.update()
+                self.machine.update()
+                self.machine.close()
+
+        self.assertEqual(2, mock_fsync.call_count)
+
+    @mock.patch(patched_write_machine_func)
+    def test_group_durability_persists_concurrent_updates_together(
+        self, mock_write
+    ):
+        machine = normal_machine_fixture()
+        machine['states'][0]['target']['when']['value'] = 100
+        self.machine._options.durability = 'group'
+        self.machine._options.durability_window = 20
+        with tempfile.TemporaryDirectory() as directory, \
+                mock.patch(self.patched_machine_func, return_value=machine):
+            self.machine._options.journal = os.path.join(directory, 'log')
+            self.machine.build()
+
+            with mock.patch.object(self.machine.journal, 'append',
+                                   wraps=self.machine.journal.append) as append:
+                threads = [
+                    threading.Thread(target=self.machine.update)
+                    for _ in range(40)
+                ]
+                for thread in threads:
+                    thread.start()
+                for thread in threads:
+                    thread.join()
+
+            self.machine.close()
+            versions = [r['version'] for r in self.machine.journal.records()]
+
+        self.assertLess(append.call_count, 40)
+        self.assertEqual(list(range(1, 41)), sorted(versions))
+
+    @mock.patch(patched_machine_func, return_value=normal_machine_fixture())
+    @mock.patch(patched_write_machine_func)
+    def test_async_durability_writes_updates_on_close(self, mock_write, *patch):
+        self.machine._options.durability = 'async'
+        self.machine._options.durability_window = 60000
+        with tempfile.TemporaryDirectory() as directory:
+            self.machine._options.journal = os.path.join(directory, 'log')
+            self.machine.build()
+            self.machine.update()
+            self.machine.update()
+            self.machine.close()
+
+            versions = [r['version'] for r in self.machine.journal.records()]
+
+        self.assertEqual([1, 2], versions)
+
+    def test_build_reads_the_compiled_machine_when_yaml_is_unchanged(self):
+        with tempfile.TemporaryDirectory() as directory:
+            path = os.path.join(directory, 'states.yaml')
+            with open(path, 'wt') as f:
+                yaml.dump(normal_machine_fixture(), f)
+
+            self.machine._options.machine = path
+            self.machine.build()
+
+            with open(f'{path}.compiled', 'rb') as f:
+                compiled = f.read()
+
+            self.assertEqual(normal_machine_fixture(),
+                             json.loads(compiled)['machine'])
+
+            machine = StateMachine(self.machine._options)
+            with mock.patch(f'{self.codec_module}.YamlCodec.load') as mock_load:
+                machine.build()
+                mock_load.assert_not_called()
+
+            # Updates only rewrite the YAML file.
+            machine.update()
+            with open(f'{path}.compiled', 'rb') as f:
+                self.assertEqual(compiled, f.read())
+
+        self.assertTrue(machine.is_current_state('state_1'))
+
+    def test_json_snapshots_are_written_next_to_the_yaml_file(self):
+        with tempfile.TemporaryDirectory() as directory:
+            path = os.path.join(directory, 'states.yaml')
+            with open(path, 'wt') as f:
+                yaml.dump(normal_machine_fixture(), f)
+
+            self.machine._options.machine = path
+            self.machine._options.snapshot_format = 'json'
+            self.machine.build()
+            self.machine.update()
+            self.machine.update()
+
+            with open(path, 'rt') as f:
+                self.assertEqual(normal_machine_fixture(), yaml.safe_load(f))
+
+            machine = StateMachine(self.machine._options)
+            machine.build()
+
+        self.assertTrue(machine.is_current_state('state_2'))
+        self.assertEqual(2, machine.states['state_1'].current.value)
+
+    @mock.patch(patched_machine_func, return_value=normal_machine_fixture())
+    @mock.patch(patched_write_machine_func)
+    def test_machines_share_state_through_sqlite_storage(
+        self, mock_write, *patch
+    ):
+        with tempfile.TemporaryDirectory() as directory:
+            url = 'sqlite:' + os.path.join(directory, 'machines.db')
+            self.machine._options.storage = url
+            self.machine.build()
+            other = StateMachine(self.machine._options)
+            other.build()
+
+            with other.transaction():
+                other.update()
+            with other.transaction():
+                other.update()
+
+            actual = self.machine.is_current_state('state_2')
+            value = self.machine.states['state_1'].current.value
+            self.machine.close()
+            other.close()
+
+        mock_write.assert_not_called()
+        self.assertTrue(actual)
+        self.assertEqual(2, value)
+
+    @mock.patch(patched_machine_func, return_value=normal_machine_fixture())
+    @mock.patch(patched_save_func, return_value=True)
+    def test_wait_for_state_returns_when_the_state_is_entered(self, *patch):
+        self.machine.build()
+        entered = []
+        self.machine.add_observer(entered.append)
+
+        self.assertFalse(self.machine.wait_for_state('state_2', 0.01))
+
+        timer = threading.Timer(0.05, lambda: [
+            self.machine.update() for _ in range(2)])
+        timer.start()
+        actual = self.machine.wait_for_state('state_2', 5)
+        timer.join()
+
+        self.assertTrue(actual)
+        self.assertEqual(['state_2'], entered)
@@ -8,6 +8,12 @@
 # LICENSE file in the root directory of this source tree.
 #
 
+import os
+import tempfile
+import threading
+import time
+import yaml
+
 from unittest import mock
 from unittest import TestCase
 
@@ -17,7 +23,11 @@ from .test_fixtures import argparse_fixture
 from .test_fixtures import async_machine_fixture
 from .test_fixtures import normal_machine_fixture
 from .test_fixtures import predict_fixture
+from ..state_service.state_machine import StateMachine
+from ..state_service.parser import Parser
 from ..state_service.state_service import app
+from ..state_service.state_service import main
+from ..state_service.state_service import StateService
 from ..state_service.state_service import state_service
 
 
@@ -25,11 +35,15 @@ class TestStateService(TestCase):
 
     machine_module = 'state_service.state_service.state_machine.StateMachine'
     parser_module = 'argparse.ArgumentParser'
+    service_module = 'state_service.state_service.state_service'
     state_module = 'state_service.state_service.state.State'
+    patched_configure_logger_func = f'{service_module}.configure_logger'
     patched_models_func = f'{machine_module}.models'
     patched_now_func = f'{state_module}._now'
     patched_parser_func = f'{parser_module}.parse_known_args'
     patched_predict_func = f'{machine_module}.predict'
+    patched_predict_batch_func = f'{machine_module}.predict_batch'
+    patched_preload_func = f'{machine_module}.preload'
     patched_read_machine_func = f'{machine_module}._read_machine'
     patched_save_func = f'{machine_module}.save'
     patched_write_machine_func = f'{machine_module}._write_machine'
@@ -41,6 +55,9 @@ class TestStateService(TestCase):
     def tearDown(self):
         self.app = None
         state_service._machine = None
+        state_service._profile_token = None
+        state_service._profiler = None
+        state_service._registry = None
 
     @mock.patch(patched_parser_func, return_value=argparse_fixture())
     @mock.patch(patched_read_machine_func, return_value=normal_machine_fixture())
@@ -92,6 +109,76 @@ class TestStateService(TestCase):
         expected = b'state_2'
         self.assertEqual(expected, actual.data)
 
+    @mock.patch(patched_parser_func, return_value=argparse_fixture())
+    @mock.patch(patched_write_machine_func, return_value=None)
+    def test_concurrent_puts_update_the_state_machine_once_each(self, *patch):
+        machine = normal_machine_fixture()
+        machine['states'][0]['target']['when']['value'] = 100
+        statuses = []
+        is_current_state = StateMachine.is_current_state
+
+        def check_slowly(self, name):
+            # Lets other requests run between checking and updating.
+            result = is_current_state(self, name)
+            time.sleep(0.0005)
+            return result
+
+        def put():
+            client = app.test_client()
+            for _ in range(20):
+                statuses.append(
+                    client.put('/state?state=state_1').status_code)
+
+        with mock.patch(TestStateService.patched_read_machine_func,
+                        return_value=machine), \
+                mock.patch.object(StateMachine, 'is_current_state',
+                                  check_slowly):
+            state_service._initialize()
+            threads = [threading.Thread(target=put) for _ in range(8)]
+            for thread in threads:
+                thread.start()
+
+            for thread in threads:
+                thread.join()
+
+        states = state_service.machine.states
+        self.assertEqual(100, statuses.count(200))
+        self.assertEqual(100, states['state_1'].current.value)
+        self.assertEqual(0, states['state_2'].current.value)
+        self.assertEqual(100, state_service.machine.version)
+
+    @mock.patch(patched_write_machine_func, return_value=None)
+    def test_concurrent_puts_share_group_commits(self, mock_write):
+        options = argparse_fixture()[0]
+        options.durability = 'group'
+        options.durability_window = 20
+        machine = normal_machine_fixture()
+        machine['states'][0]['target']['when']['value'] = 100
+        statuses = []
+
+        def put():
+            client = app.test_client()
+            for _ in range(5):
+                statuses.append(
+                    client.put('/state?state=state_1').status_code)
+
+        with mock.patch(TestStateService.patched_parser_func,
+                        return_value=(options, [])), \
+                mock.patch(TestStateService.patched_read_machine_func,
+                           return_value=machine):
+            state_service._initialize()
+            mock_write.reset_mock()
+            threads = [threading.Thread(target=put) for _ in range(8)]
+            for thread in threads:
+                thread.start()
+
+            for thread in threads:
+                thread.join()
+
+        self.assertEqual(40, statuses.count(200))
+        self.assertEqual(40, state_service.machine.version)
+        self.assertLess(mock_write.call_count, 40)
+
     @mock.patch(patched_now_func, return_value=datetime(3000, 1, 1, 3, 0))
     @mock.patch(patched_parser_func, return_value=argparse_fixture())
     @mock.patch(patched_read_machine_func, return_value=async_machine_fixture())
@@ -136,6 +223,21 @@ class TestStateService(TestCase):
 
         self.assertEqual(expected, actual.json['state'])
 
+    @mock.patch(patched_read_machine_func, return_value=normal_machine_fixture())
+    def test_post_state_coalesces_only_when_threaded(self, *patch):
+        data = {'name': 'fixture', 'values': [100, 0]}
+        with mock.patch(TestStateService.patched_predict_func,
+                        return_value=predict_fixture()) as mock_predict:
+            self.app.post('/state', json=data)
+            with mock.patch.object(StateService, 'threaded', True):
+                self.app.post('/state', json=data)
+
+        self.assertEqual(
+            [mock.call('fixture', [100, 0], coalesce=False),
+             mock.call('fixture', [100, 0], coalesce=True)],
+            mock_predict.call_args_list,
+        )
+
     @mock.patch(patched_predict_func, return_value=predict_fixture())
     @mock.patch(patched_read_machine_func, return_value=normal_machine_fixture())
     def test_post_state_returns_500_when_request_is_invalid(self, *patch):
@@ -149,3 +251,363 @@ class TestStateService(TestCase):
 
         actual = self.app.post('/state', json={'name': ''})
         self.assertEqual(expected, actual.status_code)
+
+    @mock.patch(patched_read_machine_func, return_value=normal_machine_fixture())
+    def test_get_model_cache_returns_counters(self, *patch):
+        expected = 200
+        actual = self.app.get('/models/cache')
+
+        self.assertEqual(expected, actual.status_code)
+        self.assertIn('hits', actual.json)
+        self.assertIn('evictions', actual.json)
+
+    @mock.patch(patched_read_machine_func, return_value=normal_machine_fixture())
+    def test_post_state_batch_predicts_once_per_model(self, *patch):
+        data = {
+            'entries': [
+                {'name': 'fixture', 'host_id': 'host_1', 'values': [100, 0]},
+                {'name': 'other', 'host_id': 'host_2', 'values': [[5, 5]]},
+                {'name': 'fixture', 'host_id': 'host_3', 'values': [0, 100]},
+            ],
+        }
+
+        def predict_batch(name, rows):
+            if name == 'other':
+                raise RuntimeError('No model is available')
+            return ['run' if row[0] else 'walk' for row in rows]
+
+        with mock.patch(TestStateService.patched_predict_batch_func,
+                        side_effect=predict_batch) as mock_predict_batch:
+            actual = self.app.post('/state/batch', json=data)
+
+        self.assertEqual(200, actual.status_code)
+        self.assertEqual(2, mock_predict_batch.call_count)
+        mock_predict_batch.assert_any_call('fixture', [[100, 0], [0, 100]])
+
+        expected = {'host_1': 'run', 'host_3': 'walk'}
+        self.assertEqual(expected, actual.json['states'])
+        self.assertEqual(['host_2'], list(actual.json['errors']))
+
+    @mock.patch(patched_read_machine_func, return_value=normal_machine_fixture())
+    def test_post_state_batch_reports_errors_raised_by_a_model(self, *patch):
+        data = {
+            'entries': [
+                {'name': 'fixture', 'host_id': 'host_1', 'values': [100, 0]},
+                {'name': 'other', 'host_id': 'host_2', 'values': [5]},
+            ],
+        }
+
+        def predict_batch(name, rows):
+            if name == 'other':
+                raise ValueError('X has 1 features, but expects 2')
+            return ['run' for row in rows]
+
+        with mock.patch(TestStateService.patched_predict_batch_func,
+                        side_effect=predict_batch):
+            actual = self.app.post('/state/batch', json=data)
+
+        self.assertEqual(200, actual.status_code)
+        self.assertEqual({'host_1': 'run'}, actual.json['states'])
+        expected = {'host_2': 'X has 1 features, but expects 2'}
+        self.assertEqual(expected, actual.json['errors'])
+
+    @mock.patch(patched_read_machine_func, return_value=normal_machine_fixture())
+    def test_post_state_batch_returns_500_when_request_is_invalid(self, *patch):
+        expected = 500
+        actual = self.app.post('/state/batch', json={})
+
+        self.assertEqual(expected, actual.status_code)
+
+        entries = [{'name': 'fixture', 'values': [100, 0]}]
+        actual = self.app.post('/state/batch', json={'entries': entries})
+
+        self.assertEqual(expected, actual.status_code)
+
+    @mock.patch(patched_configure_logger_func)
+    def test_main_refuses_machines_with_several_workers(self, *patch):
+        options = Parser().parser.parse_args(
+            ['--machines', '/var/opt/state_service/machines', '--workers', '2'])
+
+        with mock.patch.object(state_service, '_options', options):
+            self.assertEqual(1, main())
+
+    @mock.patch(patched_parser_func, return_value=argparse_fixture())
+    @mock.patch(patched_read_machine_func, return_value=normal_machine_fixture())
+    def test_get_ready_returns_200_without_preloading(self, *patch):
+        state_service._initialize()
+
+        expected = 200
+        actual = self.app.get('/ready')
+
+        self.assertEqual(expected, actual.status_code)
+
+    @mock.patch(patched_parser_func, return_value=argparse_fixture())
+    @mock.patch(patched_read_machine_func, return_value=normal_machine_fixture())
+    def test_get_metrics_reports_request_durations(self, *patch):
+        state_service._initialize()
+        self.app.get('/state?state=state_1')
+
+        actual = self.app.get('/metrics')
+
+        self.assertEqual(200, actual.status_code)
+        self.assertTrue(actual.content_type.startswith('text/plain'))
+        self.assertIn(
+            b'state_service_request_duration_seconds_count'
+            b'{route="get_state",status="200"}',
+            actual.data,
+        )
+
+    @mock.patch(patched_read_machine_func, return_value=normal_machine_fixture())
+    def test_post_profile_profiles_the_next_requests(self, *patch):
+        options = argparse_fixture()[0]
+        with tempfile.TemporaryDirectory() as directory, \
+                mock.patch.object(state_service, '_options', options):
+            state_service._initialize()
+            self.assertEqual(404, self.app.post('/profile').status_code)
+
+            options.profile_dir = directory
+            state_service._initialize()
+            self.assertEqual(404, self.app.post('/profile').status_code)
+
+            state_service._profiler = None
+            options.profile_token_file = os.path.join(directory, 'token')
+            with open(options.profile_token_file, 'w') as f:
+                f.write('secret\n')
+
+            state_service._initialize()
+            headers = {'X-Profile-Token': 'secret'}
+            remote = {'REMOTE_ADDR': '10.0.0.1'}
+            actual = self.app.post(
+                '/profile', headers=headers, environ_base=remote)
+            self.assertEqual(403, actual.status_code)
+            actual = self.app.post('/profile')
+            self.assertEqual(403, actual.status_code)
+            actual = self.app.post(
+                '/profile', headers={'X-Profile-Token': 'guess'})
+            self.assertEqual(403, actual.status_code)
+            actual = self.app.post('/profile?requests=0', headers=headers)
+            self.assertEqual(500, actual.status_code)
+
+            actual = self.app.post('/profile?requests=2', headers=headers)
+            self.assertEqual(202, actual.status_code)
+            path = actual.get_json()['path']
+            thread = state_service._profiler._thread
+            actual = self.app.post('/profile', headers=headers)
+            self.assertEqual(409, actual.status_code)
+
+            self.app.get('/state?state=state_1')
+            self.app.get('/state?state=state_1')
+            thread.join(5)
+
+            self.assertFalse(state_service._profiler.active)
+            self.assertEqual(directory, os.path.dirname(path))
+            self.assertTrue(os.path.exists(path))
+
+    @mock.patch(patched_read_machine_func, return_value=normal_machine_fixture())
+    def test_get_ready_returns_503_until_models_are_preloaded(self, *patch):
+        options = argparse_fixture()[0]
+        options.preload_models = True
+        loaded = threading.Event()
+
+        def preload():
+            loaded.wait(5)
+            return {'fixture': 'Unable to deserialize fixture.pkl'}
+
+        with mock.patch.object(state_service, '_options', options), \
+                mock.patch(TestStateService.patched_preload_func,
+                           side_effect=preload):
+            state_service._initialize()
+
+            expected = 503
+            actual = self.app.get('/ready')
+            self.assertEqual(expected, actual.status_code)
+
+            loaded.set()
+            state_service._ready.wait(5)
+
+        expected = 200
+        actual = self.app.get('/ready')
+
+        self.assertEqual(expected, actual.status_code)
+        self.assertIn('fixture', actual.json['errors'])
+
+    @mock.patch(patched_write_machine_func, return_value=None)
+    def test_machines_are_served_by_name(self, *patch):
+        options = argparse_fixture()[0]
+        with tempfile.TemporaryDirectory() as directory:
+            options.machines = directory
+            path = os.path.join(directory, 'rollout.yaml')
+            with open(path, 'wt') as f:
+                yaml.dump(normal_machine_fixture(), f)
+
+            with mock.patch.object(state_service, '_options', options):
+                actual = self.app.get('/machines')
+                self.assertEqual({'machines': ['rollout']}, actual.json)
+
+                url = '/machines/rollout/state?state=state_1'
+                self.assertEqual(200, self.app.get(url).status_code)
+                self.assertEqual(200, self.app.put(url).status_code)
+                self.assertEqual(200, self.app.put(url).status_code)
+                self.assertEqual(406, self.app.get(url).status_code)
+
+                url = '/machines/other/state?state=state_1'
+                self.assertEqual(404, self.app.get(url).status_code)
+                self.assertEqual(404, self.app.put(url).status_code)
+
+    @mock.patch(patched_parser_func, return_value=argparse_fixture())
+    @mock.patch(patched_read_machine_func, return_value=normal_machine_fixture())
+    @mock.patch(patched_write_machine_func, return_value=None)
+    def test_get_state_does_not_wait_unless_threaded(self, *patch):
+        state_service._initialize()
+
+        start = time.monotonic()
+        expected = 406
+        actual = self.app.get('/state?state=state_2&wait=5')
+
+        self.assertEqual(expected, actual.status_code)
+        self.assertLess(time.monotonic() - start, 1)
+
+    @mock.patch.object(StateService, 'threaded', True)
+    @mock.patch(patched_parser_func, return_value=argparse_fixture())
+    @mock.patch(patched_read_machine_func, return_value=normal_machine_fixture())
+    @mock.patch(patched_write_machine_func, return_value=None)
+    def test_get_state_waits_for_the_state(self, *patch):
+        state_service._initialize()
+
+        expected = 406
+        actual = self.app.get('/state?state=state_2&wait=0.01')
+        self.assertEqual(expected, actual.status_code)
+
+        expected = 500
+        actual = self.app.get('/state?state=state_2&wait=soon')
+        self.assertEqual(expected, actual.status_code)
+
+        timer = threading.Timer(0.05, lambda: [
+            state_service.machine.update() for _ in range(2)])
+        timer.start()
+
+        expected = 200
+        actual = self.app.get('/state?state=state_2&wait=5')
+        timer.join()
+
+        self.assertEqual(expected, actual.status_code)
+
+    @mock.patch(patched_parser_func, return_value=argparse_fixture())
+    @mock.patch(patched_read_machine_func, return_value=normal_machine_fixture())
+    @mock.patch(patched_write_machine_func, return_value=None)
+    def test_get_state_returns_304_until_the_version_changes(self, *patch):
+        state_service._initialize()
+
+        actual = self.app.get('/state?state=state_1')
+        self.assertEqual(200, actual.status_code)
+        self.assertEqual('"0"', actual.headers['ETag'])
+
+        headers = {'If-None-Match': '"0"'}
+        actual = self.app.get('/state?state=state_1', headers=headers)
+        self.assertEqual(304, actual.status_code)
+        self.assertEqual(b'', actual.data)
+
+        headers = {'If-None-Match': 'W/"7", W/"0"'}
+        actual = self.app.get('/state?state=state_2', headers=headers)
+        self.assertEqual(304, actual.status_code)
+
+        state_service.machine.update()
+
+        headers = {'If-None-Match': '"0"'}
+        actual = self.app.get('/state?state=state_1', headers=headers)
+        self.assertEqual(200, actual.status_code)
+        self.assertEqual('"1"', actual.headers['ETag'])
+
+        actual = self.app.get('/state')
+        self.assertEqual(500, actual.status_code)
+        self.assertNotIn('ETag', actual.headers)
+
+    @mock.patch(patched_now_func, return_value=datetime(3000, 1, 1, 1, 59, 30))
+    @mock.patch(patched_parser_func, return_value=argparse_fixture())
+    @mock.patch(patched_read_machine_func, return_value=async_machine_fixture())
+    def test_get_async_state_is_cacheable_until_its_transition(self, *patch):
+        options = argparse_fixture()[0]
+        options.retry_jitter = 10
+
+        with mock.patch.object(state_service, '_options', options), \
+                mock.patch('random.uniform', return_value=4.5):
+            state_service._initialize()
+
+            actual = self.app.get('/state?state=state_1')
+            self.assertEqual(200, actual.status_code)
+            self.assertEqual('max-age=30', actual.headers['Cache-Control'])
+            self.assertEqual('35', actual.headers['Retry-After'])
+
+            headers = {'If-None-Match': actual.headers['ETag']}
+            actual = self.app.get('/state?state=state_2', headers=headers)
+            self.assertEqual(304, actual.status_code)
+            self.assertEqual('max-age=30', actual.headers['Cache-Control'])
+
+    @mock.patch(patched_now_func, return_value=datetime(3000, 1, 1, 3, 0))
+    @mock.patch(patched_parser_func, return_value=argparse_fixture())
+    @mock.patch(patched_read_machine_func, return_value=async_machine_fixture())
+    def test_get_async_state_is_not_cacheable_once_due(self, *patch):
+        state_service._initialize()
+
+        actual = self.app.get('/state?state=state_1')
+        self.assertNotIn('Cache-Control', actual.headers)
+        self.assertNotIn('Retry-After', actual.headers)
+
+    @mock.patch(patched_parser_func, return_value=argparse_fixture())
+    @mock.patch(patched_read_machine_func, return_value=normal_machine_fixture())
+    def test_get_increment_state_uses_the_configured_hint(self, *patch):
+        state_service._initialize()
+
+        actual = self.app.get('/state?state=state_1')
+        self.assertNotIn('Cache-Control', actual.headers)
+
+        options = argparse_fixture()[0]
+        options.increment_hint = 2.5
+        with mock.patch.object(state_service, '_options', options):
+            actual = self.app.get('/state?state=state_1')
+            self.assertEqual('max-age=2', actual.headers['Cache-Control'])
+            self.assertEqual('3', actual.headers['Retry-After'])
+
+    @mock.patch(patched_parser_func, return_value=argparse_fixture())
+    @mock.patch(patched_read_machine_func, return_value=normal_machine_fixture())
+    def test_get_events_returns_503_unless_threaded(self, *patch):
+        state_service._initialize()
+
+        self.assertEqual(503, self.app.get('/state/events').status_code)
+
+    @mock.patch.object(StateService, 'threaded', True)
+    @mock.patch(patched_parser_func, return_value=argparse_fixture())
+    @mock.patch(patched_read_machine_func, return_value=normal_machine_fixture())
+    @mock.patch(patched_write_machine_func, return_value=None)
+    def test_get_events_streams_updates_and_resumes(self, *patch):
+        state_service._initialize()
+
+        response = self.app.get('/state/events', buffered=False)
+        self.assertEqual(200, response.status_code)
+        self.assertEqual('text/event-stream', response.mimetype)
+
+        stream = iter(response.response)
+        expected = (b'event: state\n'
+                    b'data: {"state": "state_1", "version": 0}\nid: 0\n\n')
+        self.assertEqual(expected, next(stream))
+
+        state_service.machine.update()
+        expected = b'id: 1\n\n'
+        self.assertTrue(next(stream).endswith(expected))
+
+        with mock.patch.object(state_service, 'KEEPALIVE_INTERVAL', 0.01):
+            self.assertEqual(b': keepalive\n\n', next(stream))
+
+        response.close()
+
+        state_service.machine.update()
+        response = self.app.get(
+            '/state/events', headers={'Last-Event-ID': '1'}, buffered=False)
+        chunk = next(iter(response.response))
+        response.close()
+
+        self.assertIn(b'"value": 2', chunk)
+        self.assertTrue(chunk.endswith(b'event: transition\n'
+                                       b'data: {"from": "state_1", '
+                                       b'"to": "state_2", "version": 2}\n'
+                                       b'id: 3\n\n'))
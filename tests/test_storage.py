@@ -0,0 +1,133 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+
+#
+# Copyright (c) Facebook, Inc. and its affiliates.
+#
+# This source code is licensed under the MIT license found in the
+# LICENSE file in the root directory of this source tree.
+#
+
+import fcntl
+import os
+import tempfile
+import threading
+import zlib
+
+from unittest import TestCase
+
+from .test_fixtures import normal_machine_fixture
+from ..state_service.storage import get_storage
+from ..state_service.storage import release_storage
+from ..state_service.storage import SqliteStorage
+
+
+class TestSqliteStorage(TestCase):
+
+    def setUp(self):
+        self.directory = tempfile.TemporaryDirectory()
+        self.path = os.path.join(self.directory.name, 'machines.db')
+        self.storage = SqliteStorage(self.path)
+
+    def tearDown(self):
+        self.storage.close()
+        self.directory.cleanup()
+
+    def test_load_returns_none_before_create(self):
+        self.assertIsNone(self.storage.load('rollout'))
+        self.assertIsNone(self.storage.version('rollout'))
+
+    def test_create_and_load_round_trip_a_state_machine(self):
+        machine = normal_machine_fixture()
+        self.storage.create('rollout', machine)
+
+        expected = dict(machine, version=0)
+        self.assertEqual(expected, self.storage.load('rollout'))
+
+    def test_store_updates_only_the_changed_states(self):
+        self.storage.create('rollout', normal_machine_fixture())
+        self.storage.store('rollout', [
+            {'version': 2, 'current_state': 'state_2',
+             'values': {'state_1': 2}},
+            {'version': 1, 'current_state': 'state_1',
+             'values': {'state_1': 1}},
+        ])
+
+        expected = (2, 'state_2', {'state_1': 2, 'state_2': 0})
+        self.assertEqual(expected, self.storage.read('rollout'))
+
+        other = SqliteStorage(self.path)
+        self.assertEqual(2, other.version('rollout'))
+        other.close()
+
+    def test_store_ignores_records_older_than_the_stored_version(self):
+        self.storage.create('rollout', dict(normal_machine_fixture(), version=5))
+        self.storage.store('rollout', [
+            {'version': 3, 'current_state': 'state_2', 'values': {}},
+        ])
+
+        self.assertEqual(5, self.storage.version('rollout'))
+        self.assertEqual('state_1', self.storage.read('rollout')[1])
+
+    def test_get_storage_parses_urls(self):
+        storage = get_storage(f'sqlite:{self.path}')
+        self.assertIsInstance(storage, SqliteStorage)
+        release_storage(storage)
+
+        with self.assertRaises(RuntimeError):
+            get_storage('redis://localhost')
+
+    def test_get_storage_shares_one_storage_per_path(self):
+        storage = get_storage(f'sqlite:{self.path}')
+        other = get_storage(f'sqlite:{os.path.relpath(self.path)}')
+        self.assertIs(storage, other)
+
+        storage.create('rollout', normal_machine_fixture())
+        release_storage(storage)
+        self.assertIsNotNone(other._connection)
+
+        release_storage(other)
+        self.assertIsNone(other._connection)
+        self.assertIsNot(storage, get_storage(f'sqlite:{self.path}'))
+
+    def test_lock_does_not_wait_for_other_state_machines(self):
+        locked = []
+
+        def lock_machines():
+            for name in ('other', 'rollout'):
+                with self.storage.lock(name):
+                    locked.append(name)
+
+        with self.storage.lock('rollout'):
+            thread = threading.Thread(target=lock_machines, daemon=True)
+            thread.start()
+            thread.join(0.2)
+
+            self.assertEqual(['other'], locked)
+
+        thread.join(5)
+        self.assertEqual(['other', 'rollout'], locked)
+
+    def test_lock_excludes_other_processes_per_state_machine(self):
+        with self.storage.lock('rollout'):
+            pid = os.fork()
+            if pid == 0:
+                status = 1
+                try:
+                    storage = SqliteStorage(self.path)
+                    with storage.lock('other'):
+                        pass
+
+                    with open(f'{self.path}.lock', 'a') as f:
+                        fcntl.lockf(
+                            f, fcntl.LOCK_EX | fcntl.LOCK_NB, 1,
+                            zlib.crc32(b'rollout'),
+                        )
+                except BlockingIOError:
+                    status = 0
+                finally:
+                    os._exit(status)
+
+            _, status = os.waitpid(pid, 0)
+
+        self.assertEqual(0, os.WEXITSTATUS(status))
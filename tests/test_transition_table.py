@@ -0,0 +1,136 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+
+#
+# Copyright (c) Facebook, Inc. and its affiliates.
+#
+# This source code is licensed under the MIT license found in the
+# LICENSE file in the root directory of this source tree.
+#
+
+from unittest import mock
+from unittest import TestCase
+
+from datetime import datetime
+
+from .test_fixtures import async_machine_fixture
+from .test_fixtures import normal_machine_fixture
+from ..state_service.state import State
+from ..state_service.transition_table import TransitionTable
+
+
+class TestTransitionTable(TestCase):
+
+    state_module = 'state_service.state_service.state.State'
+    patched_now_func = f'{state_module}._now'
+
+    def compile(self, machine):
+        return TransitionTable([State(s) for s in machine['states']])
+
+    def increment_state(self, name, target):
+        return {
+            'name': name,
+            'func': 'increment',
+            'current': {'key': 'count', 'value': 0},
+            'target': {'name': target, 'when': {'key': 'count', 'value': 1}},
+        }
+
+    def test_table_indexes_actions_guards_and_targets(self):
+        table = self.compile(normal_machine_fixture())
+
+        self.assertEqual(['state_1', 'state_2', 'state_3'], table.names)
+        self.assertEqual([1, 2, TransitionTable.END], table.targets)
+        self.assertEqual([False, False, True], table.is_end)
+        self.assertEqual([False, False, False], table.is_async)
+        self.assertEqual(1, table.index('state_2'))
+
+        with self.assertRaises(RuntimeError):
+            table.index('state_4')
+
+    def test_update_returns_the_target_once_the_guard_passes(self):
+        table = self.compile(normal_machine_fixture())
+
+        self.assertEqual(0, table.update(0))
+        self.assertEqual(1, table.update(0))
+        self.assertEqual(2, table.states[0].current.value)
+
+    @mock.patch(patched_now_func, return_value=datetime(3000, 1, 1, 2, 0, 5))
+    def test_update_of_async_state_compares_its_transition_time(self, *patch):
+        table = self.compile(async_machine_fixture())
+
+        self.assertEqual([True, True, False], table.is_async)
+        self.assertEqual(1, table.update(0))
+        self.assertEqual(1, table.update(1))
+
+    def test_unknown_targets_and_actions_are_rejected(self):
+        states = [
+            self.increment_state('state_1', 'state_9'),
+            dict(self.increment_state('state_2', 'state_3'), func='decrement'),
+            {'name': 'state_3'},
+        ]
+
+        with self.assertRaises(RuntimeError) as context:
+            self.compile({'states': states})
+
+        message = str(context.exception)
+        self.assertIn('state_1 targets state_9', message)
+        self.assertIn('state_2 has an unknown action decrement', message)
+
+    def test_invalid_definitions_are_rejected(self):
+        states = [
+            {
+                'name': 'state_1',
+                'func': 'increment',
+                'target': {
+                    'name': 'state_2',
+                    'when': {'key': 'count', 'value': 1},
+                },
+            },
+            {
+                'name': 'state_2',
+                'func': 'time',
+                'target': {
+                    'name': 'state_3',
+                    'when': {'key': 'clock', 'value': 'tomorrow'},
+                },
+            },
+            {'name': 'state_3'},
+            {'name': 'state_3'},
+        ]
+
+        with self.assertRaises(RuntimeError) as context:
+            self.compile({'states': states})
+
+        message = str(context.exception)
+        self.assertIn('state_1 has no current value', message)
+        self.assertIn('state_2 has an invalid transition time', message)
+        self.assertIn('state_3 is defined more than once', message)
+
+    def test_cycles_are_rejected(self):
+        states = [
+            self.increment_state('state_1', 'state_2'),
+            self.increment_state('state_2', 'state_3'),
+            self.increment_state('state_3', 'state_2'),
+        ]
+
+        with self.assertRaises(RuntimeError) as context:
+            self.compile({'states': states})
+
+        self.assertIn('state_2 -> state_3 -> state_2 is a cycle',
+                      str(context.exception))
+
+        states = [self.increment_state('state_1', 'state_1')]
+        with self.assertRaises(RuntimeError) as context:
+            self.compile({'states': states})
+
+        self.assertIn('state_1 -> state_1 is a cycle', str(context.exception))
+
+        states = [
+            self.increment_state(f'state_{i}', f'state_{(i + 1) % 20}')
+            for i in range(20)
+        ]
+        with self.assertRaises(RuntimeError) as context:
+            self.compile({'states': states})
+
+        self.assertIn('state_0 -> state_1 -> ... -> state_19 -> state_0',
+                      str(context.exception))
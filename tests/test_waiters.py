@@ -0,0 +1,74 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+
+#
+# Copyright (c) Facebook, Inc. and its affiliates.
+#
+# This source code is licensed under the MIT license found in the
+# LICENSE file in the root directory of this source tree.
+#
+
+import asyncio
+import threading
+
+from unittest import mock
+from unittest import TestCase
+
+from .test_fixtures import argparse_fixture
+from .test_fixtures import normal_machine_fixture
+from ..state_service.state_machine import StateMachine
+from ..state_service.waiters import StateWaiters
+
+
+class TestStateWaiters(TestCase):
+
+    machine_module = 'state_service.state_service.state_machine.StateMachine'
+    patched_machine_func = f'{machine_module}._read_machine'
+    patched_save_func = f'{machine_module}.save'
+
+    @mock.patch(patched_machine_func, return_value=normal_machine_fixture())
+    def setUp(self, *patch):
+        self.machine = StateMachine(argparse_fixture()[0])
+        self.machine.build()
+        self.waiters = StateWaiters(self.machine)
+
+    def tearDown(self):
+        self.machine = None
+
+    @mock.patch(patched_save_func, return_value=True)
+    def test_wait_returns_when_the_state_is_entered(self, *patch):
+        async def wait():
+            timer = threading.Timer(0.05, self.update)
+            timer.start()
+            entered = await self.waiters.wait('state_2', 5)
+            timer.join()
+            return entered
+
+        self.assertTrue(asyncio.run(wait()))
+        self.assertEqual(0, len(self.waiters))
+
+    def test_wait_returns_false_after_timeout(self):
+        self.assertFalse(asyncio.run(self.waiters.wait('state_2', 0.01)))
+        self.assertTrue(asyncio.run(self.waiters.wait('state_1', 0)))
+        self.assertEqual(0, len(self.waiters))
+
+    def test_many_waiters_are_woken_by_one_transition(self):
+        async def wait():
+            tasks = [
+                asyncio.ensure_future(self.waiters.wait('state_2', 5))
+                for _ in range(1000)
+            ]
+            await asyncio.sleep(0.01)
+            self.assertEqual(1000, len(self.waiters))
+
+            with mock.patch(TestStateWaiters.patched_save_func):
+                await asyncio.get_running_loop().run_in_executor(
+                    None, self.update)
+
+            return await asyncio.gather(*tasks)
+
+        self.assertTrue(all(asyncio.run(wait())))
+
+    def update(self):
+        self.machine.update()
+        self.machine.update()
@@ -0,0 +1,54 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+
+#
+# Copyright (c) Facebook, Inc. and its affiliates.
+#
+# This source code is licensed under the MIT license found in the
+# LICENSE file in the root directory of this source tree.
+#
+
+import tempfile
+import threading
+
+from unittest import mock
+from unittest import TestCase
+
+from ..state_service.watcher import ModelWatcher
+
+
+class TestModelWatcher(TestCase):
+
+    def setUp(self):
+        self.directory = tempfile.TemporaryDirectory()
+        self.machine = mock.Mock()
+        self.machine.reload_models.return_value = {
+            'added': ['fixture'], 'changed': [], 'removed': [],
+        }
+        self.watcher = ModelWatcher(
+            self.machine, [self.directory.name], interval=0.01)
+
+    def tearDown(self):
+        self.watcher.stop()
+        self.directory.cleanup()
+
+    def test_poll_returns_changes(self):
+        actual = self.watcher.poll()
+
+        self.assertEqual(['fixture'], actual['added'])
+
+    def test_poll_keeps_models_when_changes_are_invalid(self):
+        self.machine.reload_models.side_effect = RuntimeError('not JSON')
+
+        actual = self.watcher.poll()
+
+        self.assertIsNone(actual)
+
+    def test_start_reloads_models_in_the_background(self):
+        reloaded = threading.Event()
+        self.machine.reload_models.side_effect = \
+            lambda: reloaded.set() or {'added': [], 'changed': [], 'removed': []}
+
+        self.watcher.start()
+
+        self.assertTrue(reloaded.wait(5))